@@ -1,100 +1,197 @@
 import base64
-import google.generativeai as genai
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
-from io import BytesIO
 from config import Config
+import ingest
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from metrics import REGISTRY, GEMINI_SECONDS, GEMINI_ERRORS
+
+logger = logging.getLogger(__name__)
+
+GEMINI_HEDGES = REGISTRY.counter(
+    "editor_gemini_hedges_total", "Second Gemini requests sent because the first was slow", ("method",)
+)
+GEMINI_DEGRADED = REGISTRY.counter(
+    "editor_gemini_degraded_total", "AI answers served from the local fallback", ("method", "reason")
+)
+
+
+class AIText(str):
+    """An AI feature's reply. degraded is True for the local fallback shown
+    while Gemini is failing; callers don't charge an edit for those.
+    actions are (label, code) edits the reply recommends, for one-tap buttons."""
+    degraded = False
+    actions = ()
 
 
 class AIEditor:
-    def __init__(self):
-        if Config.GEMINI_API_KEY:
+    def __init__(self, model=None, clock=time.monotonic):
+        # model: anything with generate_content(parts) -> obj with .text;
+        # tests pass a scripted fake instead of Gemini, and a fake clock
+        # the breaker measures latency and open time with
+        if model is not None:
+            self.model = model
+        elif Config.GEMINI_API_KEY:
+            # Imported here, not at module level: it alone takes longer to
+            # import than the rest of the bot
+            import google.generativeai as genai
             genai.configure(api_key=Config.GEMINI_API_KEY)
             self.model = genai.GenerativeModel("gemini-1.5-flash")
         else:
             self.model = None
 
-    def _bytes_to_pil(self, image_bytes: bytes) -> Image.Image:
-        return Image.open(BytesIO(image_bytes)).convert("RGB")
+        self.breaker = CircuitBreaker(
+            "gemini",
+            window=Config.GEMINI_BREAKER_WINDOW,
+            min_calls=Config.GEMINI_BREAKER_MIN_CALLS,
+            error_rate=Config.GEMINI_BREAKER_ERROR_RATE,
+            slow_seconds=Config.GEMINI_SLOW_SECONDS,
+            open_seconds=Config.GEMINI_BREAKER_OPEN_SECONDS,
+            clock=clock,
+        )
+        # Attempts run here so a hung request can be abandoned at the
+        # timeout (and hedged) instead of holding the caller's thread
+        self._pool = ThreadPoolExecutor(max_workers=Config.GEMINI_MAX_INFLIGHT, thread_name_prefix="gemini")
 
-    def analyze_image(self, image_bytes: bytes) -> str:
-        """Gemini se image analyze karwao - FREE"""
-        if not self.model:
-            return "❌ Gemini API key nahi hai. .env file mein GEMINI_API_KEY daalo."
+    def _bytes_to_pil(self, image_bytes: bytes) -> Image.Image:
+        # Gemini downsamples anyway; draft-decode big files straight to ~AI size
+        return ingest.open_image(image_bytes, Config.AI_INPUT_SIDE * Config.AI_INPUT_SIDE)
 
+    def _attempt(self, method: str, parts: list):
         try:
-            img = self._bytes_to_pil(image_bytes)
-
-            prompt = (
-                "You are a professional photo editor. Analyze this image and provide:\n\n"
-                "1. 🎨 **Image Description**: What is in this image?\n"
-                "2. 📊 **Quality Rating**: Rate exposure, color, sharpness (1-10)\n"
-                "3. ✨ **Top 5 Editing Tips**: Specific improvements\n"
-                "4. 🎭 **Best Filter**: Which filter would suit this image?\n"
-                "5. 📐 **Best Crop**: What crop ratio would look best?\n"
-                "6. 💡 **Pro Tip**: One expert tip for this image\n\n"
-                "Be concise and use emojis. Reply in simple English."
-            )
-
-            response = self.model.generate_content([prompt, img])
-            return response.text
-
+            with GEMINI_SECONDS.time(method=method):
+                return self.model.generate_content(parts)
+        except Exception:
+            GEMINI_ERRORS.inc(method=method)
+            raise
+
+    def _hedged(self, method: str, parts: list):
+        """First successful answer of up to two attempts: a hedge goes out
+        once the first has taken longer than recent p95 (GEMINI_HEDGE=1).
+        Raises TimeoutError after GEMINI_TIMEOUT_SECONDS."""
+        deadline = time.monotonic() + Config.GEMINI_TIMEOUT_SECONDS
+        futures = {self._pool.submit(self._attempt, method, parts)}
+
+        hedge_after = self.breaker.latency_quantile(0.95) if Config.GEMINI_HEDGE else None
+        if hedge_after is not None:
+            hedge_after = max(hedge_after, Config.GEMINI_HEDGE_MIN_SECONDS)
+            done, _ = wait(futures, timeout=min(hedge_after, Config.GEMINI_TIMEOUT_SECONDS))
+            if not done:
+                GEMINI_HEDGES.inc(method=method)
+                futures.add(self._pool.submit(self._attempt, method, parts))
+
+        error = None
+        while futures:
+            done, futures = wait(futures, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"Gemini took over {Config.GEMINI_TIMEOUT_SECONDS}s")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _generate(self, method: str, parts: list):
+        return self.breaker.call(self._hedged, method, parts)
+
+    def _ask(self, method: str, prompt: str, image_bytes: bytes) -> AIText:
+        """Gemini's answer, or the local fallback when it fails or the
+        circuit is open (fails fast, no waiting on a dead API)"""
+        img = self._bytes_to_pil(image_bytes)
+        try:
+            return AIText(self._generate(method, [prompt, img]).text)
+        except CircuitOpen:
+            reason = "circuit_open"
+        except TimeoutError:
+            reason = "timeout"
         except Exception as e:
-            return f"❌ Analysis failed: {str(e)}"
+            logger.error(f"Gemini {method} error: {e}")
+            reason = "error"
+        GEMINI_DEGRADED.inc(method=method, reason=reason)
+        return self._degraded(method, img)
 
-    def get_caption_suggestions(self, image_bytes: bytes) -> str:
+    def analyze_image(self, image_bytes: bytes) -> AIText:
+        """Gemini se image analyze karwao - FREE"""
+        if not self.model:
+            return AIText("❌ Gemini API key nahi hai. .env file mein GEMINI_API_KEY daalo.")
+
+        prompt = (
+            "You are a professional photo editor. Analyze this image and provide:\n\n"
+            "1. 🎨 **Image Description**: What is in this image?\n"
+            "2. 📊 **Quality Rating**: Rate exposure, color, sharpness (1-10)\n"
+            "3. ✨ **Top 5 Editing Tips**: Specific improvements\n"
+            "4. 🎭 **Best Filter**: Which filter would suit this image?\n"
+            "5. 📐 **Best Crop**: What crop ratio would look best?\n"
+            "6. 💡 **Pro Tip**: One expert tip for this image\n\n"
+            "Be concise and use emojis. Reply in simple English."
+        )
+        return self._ask("analyze_image", prompt, image_bytes)
+
+    def get_caption_suggestions(self, image_bytes: bytes) -> AIText:
         """Image ke liye social media captions - FREE"""
         if not self.model:
-            return "❌ Gemini API key nahi hai. .env file mein GEMINI_API_KEY daalo."
-
-        try:
-            img = self._bytes_to_pil(image_bytes)
-
-            prompt = (
-                "Generate 5 creative social media captions for this image:\n\n"
-                "1. 📸 Instagram caption (with hashtags)\n"
-                "2. 🎵 TikTok caption (short, trendy)\n"
-                "3. 👥 Facebook caption (friendly)\n"
-                "4. 🐦 Twitter/X caption (witty, under 280 chars)\n"
-                "5. 💼 LinkedIn caption (professional)\n\n"
-                "Use emojis and make them engaging!"
+            return AIText("❌ Gemini API key nahi hai. .env file mein GEMINI_API_KEY daalo.")
+
+        prompt = (
+            "Generate 5 creative social media captions for this image:\n\n"
+            "1. 📸 Instagram caption (with hashtags)\n"
+            "2. 🎵 TikTok caption (short, trendy)\n"
+            "3. 👥 Facebook caption (friendly)\n"
+            "4. 🐦 Twitter/X caption (witty, under 280 chars)\n"
+            "5. 💼 LinkedIn caption (professional)\n\n"
+            "Use emojis and make them engaging!"
+        )
+        return self._ask("get_caption_suggestions", prompt, image_bytes)
+
+    def get_edit_suggestions(self, image_bytes: bytes) -> AIText:
+        """Quick editing suggestions - FREE. Ranked locally from the photo's
+        histogram; with AI_SUGGESTIONS=gemini, Gemini writes the text"""
+        # numpy-backed; loaded on the first request, not with the bot
+        import image_stats
+        import suggestions
+        width, height, _ = ingest.probe(image_bytes)
+        thumb = ingest.decode(image_bytes, ingest.fit(width, height, suggestions.THUMB_PIXELS))
+        # Reuse the version's full-size histograms if a render already
+        # computed them
+        stats = image_stats.CACHE.peek(image_stats.key(image_bytes, (width, height)))
+        picks = suggestions.suggest(thumb, stats)
+        if Config.AI_SUGGESTIONS != "gemini" or not self.model:
+            result = AIText(suggestions.format_suggestions(picks))
+            result.actions = [(label, code) for code, label, _ in picks]
+            return result
+
+        prompt = (
+            "Look at this photo and suggest the 3 best quick edits from this list:\n"
+            "Filters: warm, cool, vintage, sepia, bw, dramatic, vivid, fade, bright, dark, hdr, retro, moody\n"
+            "Crops: square, wide (16:9), story (9:16)\n"
+            "Enhancements: sharpen, bright, contrast, saturation\n\n"
+            "Format: Just list the 3 best options with one emoji each and a short reason. Be very brief."
+        )
+        result = self._ask("get_edit_suggestions", prompt, image_bytes)
+        result.actions = [(label, code) for code, label, _ in picks]
+        return result
+
+
+    # ─── LOCAL FALLBACK ────────────────────────────────────────────────────
+
+    def _degraded(self, method: str, img: Image.Image) -> AIText:
+        if method == "get_caption_suggestions":
+            text = (
+                "⚠️ AI abhi busy hai, yeh quick captions try karo:\n\n"
+                "1. 📸 Moments like this ✨ #photooftheday #vibes\n"
+                "2. 🎵 Main character energy 🎬\n"
+                "3. 👥 Good times, great memories 😊\n"
+                "4. 🐦 Filter? Barely knew her.\n"
+                "5. 💼 Capturing the details that matter."
             )
-
-            response = self.model.generate_content([prompt, img])
-            return response.text
-
-        except Exception as e:
-            return f"❌ Caption generation failed: {str(e)}"
-
-    def get_edit_suggestions(self, image_bytes: bytes) -> str:
-        """Quick editing suggestions - FREE"""
-        if not self.model:
-            return "❌ Gemini API key nahi hai."
-
-        try:
-            img = self._bytes_to_pil(image_bytes)
-
-            prompt = (
-                "Look at this photo and suggest the 3 best quick edits from this list:\n"
-                "Filters: warm, cool, vintage, sepia, bw, dramatic, vivid, fade, bright, dark, hdr, retro, moody\n"
-                "Crops: square, wide (16:9), story (9:16)\n"
-                "Enhancements: sharpen, bright, contrast, saturation\n\n"
-                "Format: Just list the 3 best options with one emoji each and a short reason. Be very brief."
+        else:
+            import suggestions
+            text = "⚠️ AI abhi busy hai — quick local check:\n\n" + suggestions.format_suggestions(
+                suggestions.suggest(img)
             )
-
-            response = self.model.generate_content([prompt, img])
-            return response.text
-
-        except Exception as e:
-            return f"❌ Suggestions failed: {str(e)}"
-
-
-AI_STYLES = [
-    ("🎬 Cinematic", "cinematic"),
-    ("🎌 Anime Style", "anime"),
-    ("🎨 Watercolor", "watercolor"),
-    ("🖼️ Oil Painting", "oil_painting"),
-    ("✏️ Pencil Sketch", "sketch"),
-    ("🌆 Neon City", "neon_city"),
-    ("📮 Vintage Poster", "vintage_poster"),
-    ("📸 Professional", "professional"),
-]
+        result = AIText(text)
+        result.degraded = True
+        return result
@@ -0,0 +1,47 @@
+import math
+from PIL import Image, ImageChops, ImageFilter
+
+# Blur radius (PIL sigma) kept at the reduced level. Below this the
+# downsample itself starts to show through as blockiness.
+MIN_LEVEL_RADIUS = 1.5
+MAX_FACTOR = 16
+
+
+def _factor(radius: float) -> int:
+    f = 1
+    while f * 2 <= radius / MIN_LEVEL_RADIUS and f < MAX_FACTOR:
+        f *= 2
+    return f
+
+
+def _blur_small(img: Image.Image, radius: float) -> tuple:
+    """Downsample by a power of two, blur what's left of radius there.
+    Returns (small blurred image, factor)."""
+    f = _factor(radius)
+    if f == 1:
+        return img.filter(ImageFilter.GaussianBlur(radius)), 1
+    small = img.reduce(f)
+    # Box reduce + bilinear upsample already spread by ~(f² - 1) / 6
+    residual = math.sqrt(max(radius * radius - (f * f - 1) / 6, 0.25)) / f
+    return small.filter(ImageFilter.GaussianBlur(residual)), f
+
+
+def pyramid_blur(img: Image.Image, radius: float) -> Image.Image:
+    """Gaussian-looking blur whose cost barely grows with radius: a 12 MP
+    radius-8 blur runs on a 0.75 MP image"""
+    small, f = _blur_small(img, radius)
+    if f == 1:
+        return small
+    return small.resize(img.size, Image.BILINEAR)
+
+
+def glow(img: Image.Image, radius: float, amount: float) -> Image.Image:
+    """img + amount * blur(img), saturating uint8 — bloom/halation.
+    The scale is a lookup table applied at low resolution, so the only
+    full-size work is one upsample and one ImageChops.add."""
+    small, f = _blur_small(img, radius)
+    table = [min(255, int(v * amount + 0.5)) for v in range(256)]
+    small = small.point(table * len(img.getbands()))
+    if f > 1:
+        small = small.resize(img.size, Image.BILINEAR)
+    return ImageChops.add(img, small)
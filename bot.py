@@ -1,22 +1,42 @@
+import time
+
+# Process start, for the startup timing report
+_STARTED = time.perf_counter()
+
 import os
 import logging
 import asyncio
-import aiohttp
+import contextvars
+import math
+import threading
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaDocument
 )
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
-    CallbackQueryHandler, filters, ContextTypes
+    CallbackQueryHandler, TypeHandler, ApplicationHandlerStop, filters, ContextTypes
 )
-from telegram.constants import ParseMode
+from telegram.constants import ParseMode, ChatAction, MessageLimit
 
 from telegram.request import HTTPXRequest
 from config import Config
 from database import Database
-from image_processor import ImageProcessor
-from ai_editor import AIEditor, AI_STYLES
+import lut_library
+from session_store import create_session_store
+from ingest import ImageRejected, probe
+from update_processor import PerUserUpdateProcessor, WorkerRouter
+from rate_limiter import TelegramRateLimiter, low_priority
+from metrics import REGISTRY, STAGE_SECONDS, SESSION_LOOKUPS, start_metrics_server
+from tracing import trace, traced, span, current_trace, profiled, slowest
+
+# (stage, seconds since process start), logged once polling is up
+STARTUP_MARKS = [("imports", time.perf_counter() - _STARTED)]
+
+
+def _mark_startup(stage: str):
+    STARTUP_MARKS.append((stage, time.perf_counter() - _STARTED))
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -25,85 +45,182 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 db = Database()
-img_proc = ImageProcessor()
-ai_editor = AIEditor()
 
-USER_IMAGE_CACHE: dict = {}
+# ImageProcessor (numpy) and AIEditor (google.generativeai) are built on
+# first use, so a restart is back to polling before either is imported.
+_img_proc = None
+_ai_editor = None
+_lazy_lock = threading.Lock()
+
+
+def image_processor():
+    global _img_proc
+    if _img_proc is None:
+        with _lazy_lock:
+            if _img_proc is None:
+                from image_processor import ImageProcessor
+                _img_proc = ImageProcessor()
+    return _img_proc
+
+
+def ai_editor():
+    global _ai_editor
+    if _ai_editor is None:
+        with _lazy_lock:
+            if _ai_editor is None:
+                from ai_editor import AIEditor
+                _ai_editor = AIEditor()
+    return _ai_editor
+
+# Filters, crops, enhancements and AI styles all render here so CPU work never
+# blocks the event loop.
+PROCESSING_POOL = ThreadPoolExecutor(max_workers=Config.PROCESSING_WORKERS)
+# Previews get their own threads: a few ms of work each, they would
+# otherwise queue behind full-resolution renders of other users
+PREVIEW_POOL = ThreadPoolExecutor(max_workers=Config.PREVIEW_WORKERS)
+
+# Different users' updates run concurrently; one user's updates stay in order
+update_processor = PerUserUpdateProcessor(Config.MAX_CONCURRENT_UPDATES)
+
+# With several webhook replicas, each user's updates are handled by the one
+# replica that owns them (see Config.WORKER_URLS)
+worker_router = WorkerRouter(Config.WORKER_URLS, Config.WORKER_INDEX, Config.TELEGRAM_BOT_TOKEN)
+
+# Every outgoing Bot API call goes through here; "⏳" status edits and status
+# cleanup run under low_priority() so results go out first under load
+rate_limiter = TelegramRateLimiter(
+    global_rate=Config.TG_GLOBAL_RATE,
+    chat_rate=Config.TG_CHAT_RATE,
+    chat_burst=Config.TG_CHAT_BURST,
+    group_rate=Config.TG_GROUP_PER_MINUTE / 60,
+    max_retries=Config.TG_MAX_RETRIES,
+    max_defer=Config.TG_LOW_PRIORITY_MAX_DEFER,
+)
+
+# Per-user edit session, shared between replicas when SESSION_BACKEND=sqlite.
+# Fields:
+#   photo_sizes  every Telegram PhotoSize of the photo, smallest first
+#   original     full-size download, fetched on the first full-res render
+#   current      latest edit result; absent while the photo is unedited
+#   tier:<id>    smaller PhotoSize downloads used for AI requests
+#   document     True when the photo came in as a file; edits go back as files
+# Albums (media groups) keep the first photo in the fields above, for the AI
+# features, plus:
+#   album_group          media_group_id being collected
+#   album                photo_sizes list of every photo in the album
+#   album_original:<i>   full-size download of photo i
+#   album_current:<i>    latest batch edit result of photo i
+sessions = create_session_store()
+
+PROCESSING_QUEUE = REGISTRY.gauge(
+    "editor_processing_queue_depth", "Render jobs submitted to the processing pool and not finished yet"
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "editor_startup_seconds", "Process start until polling/webhook was running"
+)
+REGISTRY.gauge("editor_sessions", "Sessions in the session store", callback=lambda: len(sessions))
+REGISTRY.gauge(
+    "editor_update_queue_depth", "Updates holding a slot while they wait for their user's lock",
+    callback=lambda: update_processor.pending
+)
+# Bot API calls an edit waits on (status, upload, cleanup), by how the
+# result was delivered: edit_media / reply with EDIT_IN_PLACE, legacy without
+EDIT_TELEGRAM_CALLS = REGISTRY.histogram(
+    "editor_edit_telegram_calls", "Bot API calls awaited per single-photo edit", ("mode",),
+    buckets=(1, 2, 3, 4, 5)
+)
+EDIT_TELEGRAM_SECONDS = REGISTRY.histogram(
+    "editor_edit_telegram_seconds", "Time per single-photo edit spent waiting on the Bot API", ("mode",)
+)
+TIME_TO_FIRST_PIXEL = REGISTRY.histogram(
+    "editor_time_to_first_pixel_seconds", "Button press until the edited image was sent", ("mode",)
+)
+REGISTRY.gauge(
+    "editor_telegram_throttled_calls", "Bot API calls waiting for a rate limiter token",
+    callback=lambda: rate_limiter.waiting
+)
 
 
 # ─── KEYBOARDS ─────────────────────────────────────────────────────────────────
-
-def main_menu_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("🎨 Filters (25)", callback_data="menu_filters"),
-            InlineKeyboardButton("✂️ Crop (5)", callback_data="menu_crop"),
-        ],
-        [
-            InlineKeyboardButton("✨ Enhance (10)", callback_data="menu_enhance"),
-            InlineKeyboardButton("🤖 AI Tips 💎", callback_data="menu_ai"),
-        ],
-        [
-            InlineKeyboardButton("📝 AI Captions 💎", callback_data="menu_captions"),
-            InlineKeyboardButton("🔍 AI Analysis 💎", callback_data="menu_analysis"),
-        ],
-        [
-            InlineKeyboardButton("📊 My Stats", callback_data="menu_stats"),
-            InlineKeyboardButton("💎 Get Premium", callback_data="menu_premium"),
-        ],
-    ])
-
-
-def filters_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    row = []
-    for i, (label, code) in enumerate(Config.FILTERS_LIST):
-        row.append(InlineKeyboardButton(label, callback_data=f"filter_{code}"))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def crop_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    for label, code in Config.CROP_LIST:
-        buttons.append([InlineKeyboardButton(label, callback_data=f"filter_{code}")])
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def enhance_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    row = []
-    for i, (label, code) in enumerate(Config.ENHANCE_LIST):
-        row.append(InlineKeyboardButton(label, callback_data=f"filter_{code}"))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def ai_styles_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    for label, code in AI_STYLES:
-        buttons.append([InlineKeyboardButton(label, callback_data=f"ai_style_{code}")])
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def premium_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⭐ Pay with Telegram Stars", callback_data="pay_stars")],
-        [InlineKeyboardButton("📧 Contact Admin for Payment", callback_data="contact_admin")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="back_main")],
-    ])
+# Built once at import and shared by every message: InlineKeyboardMarkup is
+# immutable in PTB 20, so nothing needs rebuilding per callback.
+
+def _button_grid(items, prefix: str, columns: int) -> list:
+    buttons = [InlineKeyboardButton(label, callback_data=f"{prefix}{code}") for label, code in items]
+    rows = [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
+    rows.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
+    return rows
+
+
+_MAIN_MENU_ROWS = [
+    [
+        InlineKeyboardButton("🎨 Filters (25)", callback_data="menu_filters"),
+        InlineKeyboardButton("✂️ Crop (5)", callback_data="menu_crop"),
+    ],
+    [
+        InlineKeyboardButton("✨ Enhance (10)", callback_data="menu_enhance"),
+        InlineKeyboardButton("🤖 AI Tips 💎", callback_data="menu_ai"),
+    ],
+    [
+        InlineKeyboardButton("📝 AI Captions 💎", callback_data="menu_captions"),
+        InlineKeyboardButton("🔍 AI Analysis 💎", callback_data="menu_analysis"),
+    ],
+    [
+        InlineKeyboardButton("📊 My Stats", callback_data="menu_stats"),
+        InlineKeyboardButton("💎 Get Premium", callback_data="menu_premium"),
+    ],
+    [
+        InlineKeyboardButton("🪄 AI Styles (8) 💎", callback_data="menu_styles"),
+        InlineKeyboardButton("⭐ My Presets", callback_data="menu_presets"),
+    ],
+]
+
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup(_MAIN_MENU_ROWS)
+# Same menu once the photo has edits to undo
+MAIN_MENU_EDITED_KEYBOARD = InlineKeyboardMarkup(_MAIN_MENU_ROWS + [
+    [InlineKeyboardButton("↩️ Original Pic Pe Wapas", callback_data="start_over")]
+])
+
+_FILTER_ROWS = _button_grid(Config.FILTERS_LIST, "filter_", 2)
+_FILTER_ROWS.insert(-1, [InlineKeyboardButton("🎞️ Custom LUTs", callback_data="menu_luts")])
+FILTERS_KEYBOARD = InlineKeyboardMarkup(_FILTER_ROWS)
+CROP_KEYBOARD = InlineKeyboardMarkup(_button_grid(Config.CROP_LIST, "filter_", 1))
+ENHANCE_KEYBOARD = InlineKeyboardMarkup(_button_grid(Config.ENHANCE_LIST, "filter_", 2))
+AI_STYLES_KEYBOARD = InlineKeyboardMarkup(_button_grid(Config.AI_STYLES_LIST, "ai_style_", 1))
+AI_STYLE_CODES = frozenset(code for _, code in Config.AI_STYLES_LIST)
+AI_STYLES_PITCH = "💎 *AI Styles — Premium Feature*\n\nUpgrade to unlock all 8 AI styles!"
+
+MORE_EDITS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🎨 Aur Filters", callback_data="menu_filters"),
+        InlineKeyboardButton("✨ Enhance", callback_data="menu_enhance"),
+    ],
+    [
+        InlineKeyboardButton("✂️ Crop", callback_data="menu_crop"),
+        InlineKeyboardButton("🔍 AI Analysis", callback_data="menu_analysis"),
+    ],
+    [
+        InlineKeyboardButton("↩️ Original Pe Wapas", callback_data="start_over"),
+        InlineKeyboardButton("💎 Premium", callback_data="menu_premium"),
+    ],
+    [InlineKeyboardButton("⭐ My Presets", callback_data="menu_presets")],
+])
+
+PREMIUM_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⭐ Pay with Telegram Stars", callback_data="pay_stars")],
+    [InlineKeyboardButton("📧 Contact Admin for Payment", callback_data="contact_admin")],
+    [InlineKeyboardButton("⬅️ Back", callback_data="back_main")],
+])
+
+BACK_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
+])
+BACK_TO_EDIT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Back to Edit", callback_data="back_main")]
+])
+BACK_TO_PREMIUM_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Wapas", callback_data="menu_premium")]
+])
 
 
 # ─── COMMANDS ──────────────────────────────────────────────────────────────────
@@ -144,8 +261,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Welcome message\n"
         "/stats - Your usage stats\n"
         "/premium - Get unlimited access\n"
+        "/preset <name> - Save this photo's edits as a preset\n"
         "/help - This message\n\n"
-        "💡 *Tip:* Send multiple photos for batch editing!"
+        "💡 *Tip:* Send multiple photos for batch editing!\n"
+        "📎 Send a photo as a *file* to edit the full-resolution original."
     )
     await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
 
@@ -187,7 +306,7 @@ async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         text,
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=premium_keyboard()
+        reply_markup=PREMIUM_KEYBOARD
     )
 
 
@@ -197,16 +316,53 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     stats = db.get_stats()
+    upload = image_processor().encode_report().get("upload")
     text = (
         f"🔧 *Admin Dashboard*\n\n"
         f"👥 Total Users: {stats['total_users']}\n"
         f"💎 Premium Users: {stats['premium_users']}\n"
+        f"🟢 Active Today: {stats['active_today']}\n"
         f"✏️ Total Edits: {stats['total_edits']}\n"
         f"📆 Today's Edits: {stats['today_edits']}\n"
     )
+    waits = update_processor.wait_stats()
+    text += (
+        f"⏱️ Update queue wait: p50 {waits['p50'] * 1000:.0f} ms, "
+        f"p95 {waits['p95'] * 1000:.0f} ms ({update_processor.pending} queued)\n"
+    )
+    if upload:
+        text += (
+            f"📦 Uploads: {upload['count']} × {upload['avg_bytes'] // 1024} KB avg, "
+            f"~{upload['saved_pct']}% smaller than q95 "
+            f"({upload['bytes_saved'] / 1024 / 1024:.1f} MB saved)\n"
+        )
     await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
 
 
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != Config.ADMIN_USER_ID:
+        await update.message.reply_text("❌ Admin only!")
+        return
+
+    traces = slowest(5)
+    lines = ["🐢 Slowest recent requests\n"] if traces else ["No requests traced yet."]
+    for t in traces:
+        stages = sorted(t["spans"].items(), key=lambda s: s[1], reverse=True)
+        breakdown = ", ".join(f"{name} {ms:.0f}" for name, ms in stages[:5])
+        lines.append(f"{t['total_ms']:.0f} ms  {t['name']} (user {t['user_id']})\n   {breakdown}")
+
+    # Round trips per edit by delivery mode; the gap is what in-place saves
+    modes = []
+    for mode in ("edit_media", "reply", "legacy"):
+        total_calls, n = EDIT_TELEGRAM_CALLS.stats(mode=mode)
+        total_seconds, _ = EDIT_TELEGRAM_SECONDS.stats(mode=mode)
+        if n:
+            modes.append(f"{mode}: {total_calls / n:.1f} calls, {total_seconds / n * 1000:.0f} ms ({n} edits)")
+    if modes:
+        lines.append("\n📡 Telegram time per edit\n" + "\n".join(modes))
+    await update.message.reply_text("\n".join(lines))
+
+
 async def grant_premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != Config.ADMIN_USER_ID:
         await update.message.reply_text("❌ Admin only!")
@@ -233,747 +389,616 @@ async def grant_premium_command(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("❌ Invalid user ID")
 
 
-# ─── PHOTO HANDLER ─────────────────────────────────────────────────────────────
-
-async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def preset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/preset <name> saves the edits made to the current photo as a
+    preset; /preset delete <name> removes one"""
     user = update.effective_user
-    db.get_or_create_user(user.id, user.username or "", user.full_name or "")
-
-    msg = await update.message.reply_text("⏳ Processing your image...")
-
-    try:
-        photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
-        image_bytes = await file.download_as_bytearray()
-        USER_IMAGE_CACHE[user.id] = bytes(image_bytes)
-
-        remaining = db.get_remaining_edits(user.id)
-        user_data = db.get_or_create_user(user.id)
-        plan = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
-
-        text = (
-            f"✅ *Photo received!*\n\n"
-            f"🏷️ Plan: {plan}\n"
-            f"🔋 Remaining edits: {remaining}\n\n"
-            f"👇 *Choose what to do with your photo:*"
-        )
-
-        await msg.edit_text(
-            text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=main_menu_keyboard()
-        )
-
-    except Exception as e:
-        logger.error(f"Photo handler error: {e}")
-        await msg.edit_text("❌ Failed to process image. Please try again.")
-
-
-# ─── CALLBACK HANDLER ──────────────────────────────────────────────────────────
-
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user = query.from_user
-    data = query.data
-
-    # ── Menu Navigation ──
-    if data == "back_main":
-        remaining = db.get_remaining_edits(user.id)
-        await query.edit_message_text(
-            f"✅ *Photo ready!*\n🔋 Remaining edits: {remaining}\n\n👇 Choose an option:",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=main_menu_keyboard()
-        )
+    args = context.args or []
+    if len(args) > 1 and args[0].lower() == "delete":
+        name = _preset_name(args[1:])
+        if db.delete_preset(user.id, name):
+            await update.message.reply_text(f"🗑️ Preset \"{name}\" delete ho gaya.")
+        else:
+            await update.message.reply_text(f"❌ \"{name}\" naam ka koi preset nahi mila.")
         return
 
-    if data == "menu_filters":
-        await query.edit_message_text(
-            "🎨 *Choose a Filter:*\n\nAll 25 filters are available!",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=filters_keyboard()
+    if not args:
+        await update.message.reply_text(
+            "⭐ *Presets*\n\n"
+            "Photo pe apni edits karo, phir bhejo:\n"
+            "`/preset naam` — yeh chain save karo\n"
+            "`/preset delete naam` — preset hatao\n\n"
+            "Saved presets agli photo pe *⭐ My Presets* se ek tap mein lagte hain (1 edit).",
+            parse_mode=ParseMode.MARKDOWN
         )
         return
 
-    if data == "menu_crop":
-        await query.edit_message_text(
-            "✂️ *Choose Crop Ratio:*",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=crop_keyboard()
-        )
+    history = sessions.get(user.id, "history") or []
+    if not history:
+        await update.message.reply_text("❌ Pehle photo pe kuch edits karo, phir /preset <naam> bhejo.")
         return
-
-    if data == "menu_enhance":
-        await query.edit_message_text(
-            "✨ *Choose Enhancement:*",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=enhance_keyboard()
+    if len(history) > Config.PRESET_MAX_STEPS:
+        await update.message.reply_text(
+            f"❌ Preset mein max {Config.PRESET_MAX_STEPS} steps ho sakte hain, is photo pe {len(history)} hain.\n"
+            "↩️ Original pe wapas jao aur chhoti chain banao."
         )
         return
 
-    if data == "menu_ai":
-        user_data = db.get_or_create_user(user.id)
-        if not user_data["is_premium"]:
-            await query.edit_message_text(
-                "💎 *AI Suggestions — Premium Feature*\n\n"
-                "Upgrade to Premium to unlock:\n"
-                "• 🔍 Smart edit suggestions\n"
-                "• 📝 Caption generator\n"
-                "• 🔬 Deep image analysis\n\n"
-                f"Only ${Config.PREMIUM_MONTHLY_PRICE}/month",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=premium_keyboard()
-            )
-            return
-        await _handle_ai_suggestions(query, user)
-        return
-
-    if data == "menu_captions":
-        user_data = db.get_or_create_user(user.id)
-        if not user_data["is_premium"]:
-            await query.edit_message_text(
-                "💎 *AI Captions — Premium Feature*\n\nUpgrade to get AI-generated social media captions!",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=premium_keyboard()
-            )
-            return
-        await _handle_ai_captions(query, user)
-        return
-
-    if data == "menu_analysis":
-        user_data = db.get_or_create_user(user.id)
-        if not user_data["is_premium"]:
-            await query.edit_message_text(
-                "💎 *AI Analysis — Premium Feature*\n\nUpgrade to get professional AI photo analysis!",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=premium_keyboard()
-            )
-            return
-        await _handle_ai_analysis(query, user)
-        return
-
-    if data == "menu_stats":
-        user_data = db.get_or_create_user(user.id)
-        remaining = db.get_remaining_edits(user.id)
-        premium_status = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
-        text = (
-            f"📊 *Your Stats*\n\n"
-            f"🏷️ Plan: {premium_status}\n"
-            f"✏️ Total edits: {user_data['total_edits']}\n"
-            f"📆 Today: {user_data['daily_count']}\n"
-            f"🔋 Remaining: {remaining}"
-        )
-        await query.edit_message_text(
-            text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
-        )
-        return
-
-    if data == "menu_premium":
-        await query.edit_message_text(
-            f"💎 *Premium Plan — ${Config.PREMIUM_MONTHLY_PRICE}/month*\n\n"
-            "✅ Unlimited edits\n"
-            "✅ AI Style Transfer\n"
-            "✅ AI Image Analysis\n"
-            "✅ Caption Generator\n\n"
-            "👇 Choose payment:",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=premium_keyboard()
+    name = _preset_name(args)
+    if not db.save_preset(user.id, name, history):
+        await update.message.reply_text(
+            f"❌ Max {Config.PRESET_MAX_PER_USER} presets! Pehle /preset delete <naam> se ek hatao."
         )
         return
+    await update.message.reply_text(
+        f"✅ Preset \"{name}\" save ho gaya:\n{_action_name('+'.join(history))}\n\n"
+        "Agli photo pe ⭐ My Presets se ek tap mein lagao!"
+    )
 
-    if data == "pay_stars":
-        await query.edit_message_text(
-            "⭐ *Pay with Telegram Stars*\n\n"
-            "Contact admin to complete your Stars payment:\n"
-            f"Admin: @{await _get_admin_username(context)}\n\n"
-            "After payment, premium will be activated within minutes!",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="menu_premium")]
-            ])
-        )
-        return
 
-    if data == "contact_admin":
-        await query.edit_message_text(
-            "📧 *Contact Admin*\n\n"
-            "Send a message to admin to complete your payment.\n"
-            f"Your User ID: `{user.id}`\n\n"
-            "Payment methods accepted:\n"
-            "• JazzCash / Easypaisa\n"
-            "• USDT (Crypto)\n"
-            "• Telegram Stars",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="menu_premium")]
-            ])
-        )
-        return
+def _preset_name(words: list) -> str:
+    # Shown inside Markdown screens later, so no formatting characters
+    return " ".join(words).translate(str.maketrans("", "", "*_`[]"))[:32].strip() or "Preset"
 
-    # ── Filter/Crop/Enhance Actions ──
-    if data.startswith("filter_"):
-        action = data[len("filter_"):]
-        await _apply_filter(query, user, action)
-        return
 
-    # ── AI Style Actions ──
-    if data.startswith("ai_style_"):
-        style = data[len("ai_style_"):]
-        await _apply_ai_style(query, user, style)
+async def lut_upload_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin sends a .cube file (caption = look name, else its TITLE); it
+    is validated, stored in the LUT library and shows up under
+    Filters -> Custom LUTs"""
+    if update.effective_user.id != Config.ADMIN_USER_ID:
+        await update.message.reply_text("❌ Sirf admin LUT add kar sakta hai.")
         return
 
-
-async def _get_admin_username(context) -> str:
-    try:
-        admin = await context.bot.get_chat(Config.ADMIN_USER_ID)
-        return admin.username or str(Config.ADMIN_USER_ID)
-    except Exception:
-        return str(Config.ADMIN_USER_ID)
-
-
-async def _apply_filter(query, user, action: str):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text(
-            "❌ No image found! Please send a photo first.",
-            reply_markup=None
+    doc = update.message.document
+    if doc.file_size and doc.file_size > lut_library.MAX_CUBE_BYTES:
+        await update.message.reply_text(
+            f"❌ LUT file bahut bari hai! Max {lut_library.MAX_CUBE_BYTES // (1024 * 1024)} MB."
         )
         return
 
-    if not db.can_edit(user.id):
-        remaining = db.get_remaining_edits(user.id)
-        await query.edit_message_text(
-            f"⚠️ *Daily limit reached!*\n\n"
-            f"🆓 Free plan: {Config.FREE_DAILY_LIMIT} edits/day\n"
-            f"🔋 Remaining: {remaining}\n\n"
-            f"Upgrade to 💎 Premium for unlimited edits!",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=premium_keyboard()
+    try:
+        data = await _download_bytes(await doc.get_file())
+        name = (update.message.caption or "").strip()
+        entry = await asyncio.to_thread(lut_library.LIBRARY.add_cube, data, name)
+        await update.message.reply_text(
+            f"✅ LUT \"{entry['label']}\" add ho gaya ({entry['size']}³)!\n"
+            "🎨 Filters → 🎞️ Custom LUTs mein sab users ko milega."
         )
-        return
+    except lut_library.InvalidLut as e:
+        await update.message.reply_text(f"❌ {e}")
+    except Exception as e:
+        logger.error(f"LUT upload error: {e}")
+        await update.message.reply_text("❌ LUT save nahi ho saka. Dobara try karo.")
 
-    await query.edit_message_text("⏳ Applying edit, please wait...")
 
-    try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        result_bytes = img_proc.process(image_bytes, action)
+# ─── PHOTO HANDLER ─────────────────────────────────────────────────────────────
 
-        action_name = action.replace("_", " ").title()
-        db.increment_edit_count(user.id, "filter", action)
-        remaining = db.get_remaining_edits(user.id)
+# Bot API getFile only serves files up to 20 MB
+MAX_DOCUMENT_BYTES = 20 * 1024 * 1024
 
-        caption = (
-            f"✅ *{action_name}* applied!\n"
-            f"🔋 Remaining edits: {remaining}\n\n"
-            "Send another photo or choose another edit:"
-        )
+class _BytesSink:
+    """File.download_to_memory() target that keeps the downloaded buffer
+    instead of copying it into a BytesIO/bytearray"""
 
-        await query.message.reply_photo(
-            photo=BytesIO(result_bytes),
-            caption=caption,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=main_menu_keyboard()
-        )
-        await query.delete_message()
+    def __init__(self):
+        self.data = b""
 
-    except Exception as e:
-        logger.error(f"Filter error: {e}")
-        await query.edit_message_text(
-            "❌ Edit failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
-        )
+    def write(self, data) -> int:
+        self.data = bytes(data) if not self.data else self.data + data
+        return len(data)
 
 
-async def _handle_ai_suggestions(query, user):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text("❌ No image found! Please send a photo first.")
-        return
+async def _download_bytes(file) -> bytes:
+    # The request layer already hands back one immutable bytes object; keep
+    # exactly that. BytesIO(bytes) shares it too, so decoders read it in place.
+    sink = _BytesSink()
+    with STAGE_SECONDS.time(stage="download"):
+        await file.download_to_memory(sink)
+    return sink.data
 
-    await query.edit_message_text("🤖 AI suggestions generate ho rahi hain... ⏳")
 
+async def _run_processing(func, *args, pool: ThreadPoolExecutor = PROCESSING_POOL):
+    # Carry the request's trace into the pool thread so decode/filter/encode
+    # spans (and a sampled profile) land on the right request
+    func = profiled(func, current_trace())
+    ctx = contextvars.copy_context()
+    PROCESSING_QUEUE.inc()
     try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        suggestions = ai_editor.get_edit_suggestions(image_bytes)
-        db.increment_edit_count(user.id, "ai_suggestions")
+        return await asyncio.get_running_loop().run_in_executor(pool, ctx.run, func, *args)
+    finally:
+        PROCESSING_QUEUE.dec()
+
+
+def _pick_tier(sizes: list, min_side: int = 0) -> dict:
+    """Smallest PhotoSize whose longer side covers min_side (0 = largest)"""
+    if min_side:
+        for size in sizes:
+            if max(size["width"], size["height"]) >= min_side:
+                return size
+    return sizes[-1]
+
+
+class _Upgrade:
+    """Full-resolution render of action running in the background after a
+    preview went out in message_id. charges are the (edit_type, action)
+    edits it completes; they are charged once the session holds the result.
+    caption/reply_markup follow the screens _show puts on the message
+    meanwhile (None caption: the edit's own), so the full image swaps in
+    under whatever the user navigated to. rendered is set once the render
+    is done; stored once the session holds the result, or the upgrade
+    ended without one."""
+
+    def __init__(self, action: str, charges: list, chat_id: int, message_id: int):
+        self.action = action
+        self.charges = charges
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.caption = None
+        self.parse_mode = None
+        self.reply_markup = MORE_EDITS_KEYBOARD
+        self.task = None
+        self.rendered = False
+        self.stored = asyncio.Event()
+
+
+# user_id -> pending _Upgrade
+_UPGRADES: dict = {}
+
+
+async def _cancel_upgrade(user_id: int):
+    """New photo or start over: the pending render is of no use any more.
+    Returns once the upgrade has stopped, so a session write it had in
+    flight can't put the old image back after the caller resets the session."""
+    upgrade = _UPGRADES.pop(user_id, None)
+    if upgrade:
+        upgrade.task.cancel()
+        await asyncio.wait([upgrade.task])
+
+
+async def _settle_upgrade(user_id: int):
+    upgrade = _UPGRADES.get(user_id)
+    if upgrade and upgrade.task is not asyncio.current_task():
+        with span("wait_upgrade"):
+            await upgrade.stored.wait()
+
+
+async def _supersede_upgrade(user_id: int, action: str, edit_type: str) -> tuple:
+    """(chain to render, edits to charge) for a new edit. A full-resolution
+    render still queued or running for the previous edit is cancelled and
+    its action goes in front of this one, so the new edit renders both in
+    one pass from the session image instead of waiting for the old render,
+    and charges the old edit along with its own."""
+    charges = [(edit_type, action)]
+    upgrade = _UPGRADES.pop(user_id, None)
+    if upgrade is None:
+        return action, charges
+    if upgrade.rendered:
+        # Stored and charged; only the upload of a now stale result is left
+        await upgrade.stored.wait()
+        upgrade.task.cancel()
+        return action, charges
+    upgrade.task.cancel()
+    return f"{upgrade.action}+{action}", upgrade.charges + charges
+
+
+def _charge(user_id: int, charges: list):
+    for edit_type, action in charges:
+        db.increment_edit_count(user_id, edit_type, action)
+
+
+async def _get_image(bot, user_id: int, min_side: int = 0) -> bytes:
+    """Current session image. The full-size file is downloaded on the first
+    full-resolution render; until the photo is edited, callers that only need
+    min_side pixels get the smallest adequate Telegram tier instead."""
+    await _settle_upgrade(user_id)
+    image_bytes = await sessions.get_async(user_id, "current")
+    if image_bytes is None:
+        image_bytes = await sessions.get_async(user_id, "original")
+    if image_bytes is not None:
+        SESSION_LOOKUPS.inc(result="hit")
+        return image_bytes
+
+    sizes = sessions.get(user_id, "photo_sizes")
+    tier = _pick_tier(sizes, min_side)
+    field = "original" if tier["file_id"] == sizes[-1]["file_id"] else f"tier:{tier['file_id']}"
+    image_bytes = await sessions.get_async(user_id, field)
+    if image_bytes is None:
+        SESSION_LOOKUPS.inc(result="miss")
+        file = await bot.get_file(tier["file_id"])
+        image_bytes = await _download_bytes(file)
+        await sessions.update_async(user_id, {field: image_bytes})
+    else:
+        SESSION_LOOKUPS.inc(result="hit")
+    return image_bytes
 
-        await query.edit_message_text(
-            f"🤖 *AI Edit Suggestions*\n\n{suggestions}\n\n"
-            "👇 Ab in filters ko apply karo:",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎨 Apply Filters", callback_data="menu_filters")],
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")],
-            ])
-        )
 
-    except Exception as e:
-        logger.error(f"AI suggestions error: {e}")
-        await query.edit_message_text(
-            "❌ AI suggestions failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
-        )import os
-import logging
-import asyncio
-import aiohttp
-from io import BytesIO
-from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
-)
-from telegram.ext import (
-    Application, CommandHandler, MessageHandler,
-    CallbackQueryHandler, filters, ContextTypes
-)
-from telegram.constants import ParseMode
+async def _get_album_image(bot, user_id: int, index: int, sizes: list) -> bytes:
+    image_bytes = await sessions.get_async(user_id, f"album_current:{index}")
+    if image_bytes is None:
+        image_bytes = await sessions.get_async(user_id, f"album_original:{index}")
+    if image_bytes is not None:
+        SESSION_LOOKUPS.inc(result="hit")
+        return image_bytes
 
-from telegram.request import HTTPXRequest
-from config import Config
-from database import Database
-from image_processor import ImageProcessor
-from ai_editor import AIEditor, AI_STYLES
+    SESSION_LOOKUPS.inc(result="miss")
+    file = await bot.get_file(sizes[-1]["file_id"])
+    image_bytes = await _download_bytes(file)
+    await sessions.update_async(user_id, {f"album_original:{index}": image_bytes})
+    return image_bytes
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
 
-db = Database()
-img_proc = ImageProcessor()
-ai_editor = AIEditor()
+def _album(user_id: int) -> list:
+    return sessions.get(user_id, "album") or []
 
-USER_IMAGE_CACHE: dict = {}
-USER_ORIGINAL_CACHE: dict = {}
 
+def _max_pixels(user_id: int) -> int:
+    user_data = db.get_or_create_user(user_id)
+    return Config.PREMIUM_MAX_PIXELS if user_data["is_premium"] else Config.FREE_MAX_PIXELS
 
-# ─── KEYBOARDS ─────────────────────────────────────────────────────────────────
 
-def main_menu_keyboard(show_start_over: bool = False) -> InlineKeyboardMarkup:
-    buttons = [
-        [
-            InlineKeyboardButton("🎨 Filters (25)", callback_data="menu_filters"),
-            InlineKeyboardButton("✂️ Crop (5)", callback_data="menu_crop"),
-        ],
-        [
-            InlineKeyboardButton("✨ Enhance (10)", callback_data="menu_enhance"),
-            InlineKeyboardButton("🤖 AI Tips 💎", callback_data="menu_ai"),
-        ],
-        [
-            InlineKeyboardButton("📝 AI Captions 💎", callback_data="menu_captions"),
-            InlineKeyboardButton("🔍 AI Analysis 💎", callback_data="menu_analysis"),
-        ],
-        [
-            InlineKeyboardButton("📊 My Stats", callback_data="menu_stats"),
-            InlineKeyboardButton("💎 Get Premium", callback_data="menu_premium"),
-        ],
-    ]
-    if show_start_over:
-        buttons.append([
-            InlineKeyboardButton("↩️ Original Pic Pe Wapas", callback_data="start_over")
-        ])
-    return InlineKeyboardMarkup(buttons)
-
-
-def filters_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    row = []
-    for i, (label, code) in enumerate(Config.FILTERS_LIST):
-        row.append(InlineKeyboardButton(label, callback_data=f"filter_{code}"))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def crop_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    for label, code in Config.CROP_LIST:
-        buttons.append([InlineKeyboardButton(label, callback_data=f"filter_{code}")])
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def enhance_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    row = []
-    for i, (label, code) in enumerate(Config.ENHANCE_LIST):
-        row.append(InlineKeyboardButton(label, callback_data=f"filter_{code}"))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def ai_styles_keyboard() -> InlineKeyboardMarkup:
-    buttons = []
-    for label, code in AI_STYLES:
-        buttons.append([InlineKeyboardButton(label, callback_data=f"ai_style_{code}")])
-    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
-    return InlineKeyboardMarkup(buttons)
-
-
-def premium_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⭐ Pay with Telegram Stars", callback_data="pay_stars")],
-        [InlineKeyboardButton("📧 Contact Admin for Payment", callback_data="contact_admin")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="back_main")],
-    ])
+def _has_image(user_id: int) -> bool:
+    return sessions.has(user_id, "photo_sizes")
 
 
-# ─── COMMANDS ──────────────────────────────────────────────────────────────────
+def _has_edits(user_id: int) -> bool:
+    return sessions.has(user_id, "current") or sessions.has(user_id, "album_current:0")
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    db.get_or_create_user(user.id, user.username or "", user.full_name or "")
-    remaining = db.get_remaining_edits(user.id)
 
-    text = (
-        f"👋 *Welcome, {user.first_name}!*\n\n"
-        "🤖 I am your *Professional AI Photo Editor Bot*!\n\n"
-        "📸 *How to use:*\n"
-        "1️⃣ Send me any photo\n"
-        "2️⃣ Choose from 40+ editing options\n"
-        "3️⃣ Get your edited photo instantly!\n\n"
-        f"🆓 *Free edits today:* {remaining}/{Config.FREE_DAILY_LIMIT}\n\n"
-        "💎 *Premium features:*\n"
-        "• Unlimited edits\n"
-        "• AI Style Transfer (8 styles)\n"
-        "• AI Image Analysis\n"
-        "• Social Media Caption Generator\n\n"
-        "👇 *Send a photo to get started!*"
-    )
-    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+def _history_after(user_id: int, action: str) -> list:
+    """Edit chain of the current image once action is applied; /preset saves it"""
+    return (sessions.get(user_id, "history") or []) + action.split("+")
 
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (
-        "📖 *How to use this bot:*\n\n"
-        "1. Send any photo\n"
-        "2. Choose editing category:\n"
-        "   🎨 *Filters* - 25 creative filters\n"
-        "   ✂️ *Crop* - 5 aspect ratios\n"
-        "   ✨ *Enhance* - 10 enhancements\n"
-        "   🤖 *AI Styles* - 8 AI art styles 💎\n\n"
-        "📊 *Commands:*\n"
-        "/start - Welcome message\n"
-        "/stats - Your usage stats\n"
-        "/premium - Get unlimited access\n"
-        "/help - This message\n\n"
-        "💡 *Tip:* Send multiple photos for batch editing!"
+def _action_name(action: str) -> str:
+    return " → ".join(
+        (step.startswith(lut_library.LUT_PREFIX) and lut_library.LIBRARY.label(step))
+        or step.replace("_", " ").title()
+        for step in action.split("+")
     )
-    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
 
 
-async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _collect_album_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, sizes: list):
+    """Album photos arrive as one update each, in order (per-user lock).
+    Gather them into one batch session and answer once, from a job that
+    fires after the rest of the group has had time to arrive."""
     user = update.effective_user
-    user_data = db.get_or_create_user(user.id)
-    remaining = db.get_remaining_edits(user.id)
+    group_id = update.message.media_group_id
+    if sessions.get(user.id, "album_group") != group_id:
+        await _cancel_upgrade(user.id)
+        sessions.clear(user.id)
+        sessions.update(user.id, {"album_group": group_id, "album": [], "photo_sizes": sizes})
+        context.job_queue.run_once(
+            album_ready_job,
+            Config.ALBUM_COLLECT_SECONDS,
+            data=group_id,
+            chat_id=update.effective_chat.id,
+            user_id=user.id,
+        )
+    album = _album(user.id)
+    album.append(sizes)
+    sessions.set(user.id, "album", album)
 
-    premium_status = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
-    expiry = user_data.get("premium_expiry", "N/A") if user_data["is_premium"] else "—"
 
-    text = (
-        f"📊 *Your Statistics*\n\n"
-        f"👤 Name: {user.full_name}\n"
-        f"🏷️ Plan: {premium_status}\n"
-        f"📅 Premium until: {expiry}\n\n"
-        f"✏️ Total edits: {user_data['total_edits']}\n"
-        f"📆 Edits today: {user_data['daily_count']}\n"
-        f"🔋 Remaining today: {remaining}\n\n"
-        f"📅 Joined: {user_data['joined_at'][:10]}"
-    )
-    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+async def album_ready_job(context: ContextTypes.DEFAULT_TYPE):
+    job = context.job
+    if sessions.get(job.user_id, "album_group") != job.data:
+        return  # replaced by a newer photo before the menu went out
 
+    count = len(_album(job.user_id))
+    remaining = db.get_remaining_edits(job.user_id)
+    user_data = db.get_or_create_user(job.user_id)
+    plan = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
 
-async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
-        "💎 *Premium Plan*\n\n"
-        f"💰 Price: *${Config.PREMIUM_MONTHLY_PRICE}/month*\n\n"
-        "✅ *What you get:*\n"
-        "• Unlimited photo edits\n"
-        "• 🤖 AI Style Transfer (8 styles)\n"
-        "• 🔍 AI Image Analysis\n"
-        "• 📝 Caption Generator\n"
-        "• Priority processing\n"
-        "• New features first\n\n"
-        "👇 Choose payment method:"
+        f"✅ *Album received! ({count} photos)*\n\n"
+        f"🏷️ Plan: {plan}\n"
+        f"🔋 Remaining edits: {remaining}\n\n"
+        f"👇 *Jo bhi edit choose karo, sab {count} photos pe lagega:*"
     )
-    await update.message.reply_text(
+    await context.bot.send_message(
+        job.chat_id,
         text,
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=premium_keyboard()
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
 
-async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id != Config.ADMIN_USER_ID:
-        await update.message.reply_text("❌ Admin only!")
-        return
+@traced("photo")
+async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    with span("db_user"):
+        db.get_or_create_user(user.id, user.username or "", user.full_name or "")
 
-    stats = db.get_stats()
-    text = (
-        f"🔧 *Admin Dashboard*\n\n"
-        f"👥 Total Users: {stats['total_users']}\n"
-        f"💎 Premium Users: {stats['premium_users']}\n"
-        f"✏️ Total Edits: {stats['total_edits']}\n"
-        f"📆 Today's Edits: {stats['today_edits']}\n"
-    )
-    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+    try:
+        sizes = sorted(
+            (
+                {"file_id": p.file_id, "width": p.width, "height": p.height, "file_size": p.file_size}
+                for p in update.message.photo
+            ),
+            key=lambda p: p["width"] * p["height"],
+        )
+        if update.message.media_group_id:
+            with span("session"):
+                await _collect_album_photo(update, context, sizes)
+            return
 
+        with span("session"):
+            await _cancel_upgrade(user.id)
+            sessions.clear(user.id)
+            sessions.set(user.id, "photo_sizes", sizes)
 
-async def grant_premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id != Config.ADMIN_USER_ID:
-        await update.message.reply_text("❌ Admin only!")
-        return
+        with span("reply"):
+            await _reply_photo_menu(update, user.id, "✅ *Photo received!*")
 
-    if not context.args or len(context.args) < 1:
-        await update.message.reply_text("Usage: /grant <user_id> [days]")
+    except Exception as e:
+        logger.error(f"Photo handler error: {e}")
+        await update.message.reply_text("❌ Failed to process image. Please try again.")
+
+
+@traced("document")
+async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Originals sent as files skip Telegram's recompression, so they can be
+    24-50 MP; big colour filters render tiled and edits go back as files."""
+    user = update.effective_user
+    doc = update.message.document
+    db.get_or_create_user(user.id, user.username or "", user.full_name or "")
+
+    if doc.file_size and doc.file_size > MAX_DOCUMENT_BYTES:
+        await update.message.reply_text(
+            f"❌ File bahut bari hai! Max {MAX_DOCUMENT_BYTES // (1024 * 1024)} MB tak bhejo."
+        )
         return
 
     try:
-        target_id = int(context.args[0])
-        days = int(context.args[1]) if len(context.args) > 1 else 30
-        db.set_premium(target_id, days)
-        await update.message.reply_text(f"✅ Premium granted to {target_id} for {days} days!")
-        try:
-            await context.bot.send_message(
-                target_id,
-                f"🎉 *Congratulations!* You have been upgraded to *Premium* for {days} days!\n\nEnjoy unlimited edits and AI features! 💎",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception:
-            pass
-    except ValueError:
-        await update.message.reply_text("❌ Invalid user ID")
+        # Dimensions aren't known until the file is decoded
+        sizes = [{"file_id": doc.file_id, "width": 0, "height": 0, "file_size": doc.file_size}]
+        with span("session"):
+            await _cancel_upgrade(user.id)
+            sessions.clear(user.id)
+            sessions.update(user.id, {"photo_sizes": sizes, "document": True})
 
+        with span("reply"):
+            await _reply_photo_menu(update, user.id, "✅ *Original file received!*")
 
-# ─── PHOTO HANDLER ─────────────────────────────────────────────────────────────
+    except Exception as e:
+        logger.error(f"Document handler error: {e}")
+        await update.message.reply_text("❌ Failed to process image. Please try again.")
 
-async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    db.get_or_create_user(user.id, user.username or "", user.full_name or "")
 
-    msg = await update.message.reply_text("⏳ Processing your image...")
+async def _reply_photo_menu(update: Update, user_id: int, heading: str):
+    with span("db_quota"):
+        remaining = db.get_remaining_edits(user_id)
+        user_data = db.get_or_create_user(user_id)
+    plan = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
 
-    try:
-        photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
-        image_bytes = await file.download_as_bytearray()
-        USER_IMAGE_CACHE[user.id] = bytes(image_bytes)
-        USER_ORIGINAL_CACHE[user.id] = bytes(image_bytes)
+    text = (
+        f"{heading}\n\n"
+        f"🏷️ Plan: {plan}\n"
+        f"🔋 Remaining edits: {remaining}\n\n"
+        f"👇 *Choose what to do with your photo:*"
+    )
+    await update.message.reply_text(
+        text,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=MAIN_MENU_KEYBOARD
+    )
 
-        remaining = db.get_remaining_edits(user.id)
-        user_data = db.get_or_create_user(user.id)
-        plan = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
 
-        text = (
-            f"✅ *Photo received!*\n\n"
-            f"🏷️ Plan: {plan}\n"
-            f"🔋 Remaining edits: {remaining}\n\n"
-            f"👇 *Choose what to do with your photo:*"
-        )
+# ─── CALLBACK HANDLER ──────────────────────────────────────────────────────────
 
-        await msg.edit_text(
-            text,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=main_menu_keyboard(show_start_over=False)
-        )
+# Fire-and-forget calls (chat actions, cleanup) nobody needs to wait for;
+# held here so the tasks aren't garbage collected mid-flight
+_BACKGROUND_TASKS: set = set()
 
+
+async def _quietly(coro, what: str):
+    try:
+        await coro
     except Exception as e:
-        logger.error(f"Photo handler error: {e}")
-        await msg.edit_text("❌ Failed to process image. Please try again.")
+        logger.error(f"{what} failed: {e}")
+
+
+def _background(coro, what: str):
+    task = asyncio.create_task(_quietly(coro, what))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+
+async def _show(query, text: str, parse_mode=None, reply_markup=None):
+    """Show a screen on the message the button was on. Edited photos/files
+    keep their image and get the screen as caption; text too long for a
+    caption (AI results) goes out as a new message instead."""
+    message = query.message
+    if message is None or message.text is not None:
+        return await query.edit_message_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    upgrade = _UPGRADES.get(query.from_user.id)
+    if upgrade and (upgrade.chat_id, upgrade.message_id) != (message.chat_id, message.message_id):
+        upgrade = None
+    if len(text) <= MessageLimit.CAPTION_LENGTH:
+        if upgrade:
+            upgrade.caption, upgrade.parse_mode, upgrade.reply_markup = text, parse_mode, reply_markup
+        return await query.edit_message_caption(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    if upgrade:
+        upgrade.reply_markup = None
+    await query.edit_message_reply_markup(reply_markup=None)
+    return await message.reply_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+
+def _edits_in_place(message, as_document: bool) -> bool:
+    """edit_message_media can only swap media for media, so the first edit
+    (buttons on the text menu) still replies with a new photo"""
+    if not Config.EDIT_IN_PLACE or message is None:
+        return False
+    return bool(message.document) if as_document else bool(message.photo)
+
+
+# callback_data -> (handler, premium pitch). Exact routes are called as
+# handler(query, user); prefix routes as handler(query, user, rest_of_data).
+# Everything registers through @callback_route.
+CALLBACK_ROUTES: dict = {}
+CALLBACK_PREFIXES: dict = {}
+_PREFIX_LENGTHS: list = []
+
+
+def callback_route(data: str = "", prefix: str = "", premium: str = ""):
+    """Register a callback handler. With premium set, non-premium users get
+    that pitch and the premium keyboard instead."""
+    def decorator(handler):
+        if prefix:
+            CALLBACK_PREFIXES[prefix] = (handler, premium)
+            if len(prefix) not in _PREFIX_LENGTHS:
+                _PREFIX_LENGTHS.append(len(prefix))
+                _PREFIX_LENGTHS.sort(reverse=True)
+        else:
+            CALLBACK_ROUTES[data] = (handler, premium)
+        return handler
+    return decorator
 
 
-# ─── CALLBACK HANDLER ──────────────────────────────────────────────────────────
+def _screen(data: str, text: str, keyboard: InlineKeyboardMarkup, premium: str = ""):
+    """Route for a menu that is just fixed text plus a prebuilt keyboard"""
+    async def show(query, user):
+        await _show(query, text, parse_mode=ParseMode.MARKDOWN, reply_markup=keyboard)
+    callback_route(data, premium=premium)(show)
+
+
+def _match_route(data: str) -> tuple:
+    route = CALLBACK_ROUTES.get(data)
+    if route:
+        return route, None
+    # One dict lookup per distinct prefix length, longest first
+    for n in _PREFIX_LENGTHS:
+        route = CALLBACK_PREFIXES.get(data[:n])
+        if route:
+            return route, data[n:]
+    return None, None
+
 
+@traced("callback")
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    user = query.from_user
-    data = query.data
-
-    # ── Menu Navigation ──
-    if data == "back_main":
-        remaining = db.get_remaining_edits(user.id)
-        has_edits = user.id in USER_ORIGINAL_CACHE
-        await query.edit_message_text(
-            f"✅ *Photo ready!*\n🔋 Remaining edits: {remaining}\n\n👇 Choose an option:",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=main_menu_keyboard(show_start_over=has_edits)
-        )
+    route, arg = _match_route(query.data)
+    if route is None:
         return
 
-    if data == "start_over":
-        if user.id in USER_ORIGINAL_CACHE:
-            USER_IMAGE_CACHE[user.id] = USER_ORIGINAL_CACHE[user.id]
-            await query.edit_message_text(
-                "↩️ *Original photo restore ho gayi!*\n\nAb nayi editing karo:",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=main_menu_keyboard(show_start_over=False)
-            )
-        else:
-            await query.edit_message_text(
-                "❌ Original photo nahi mili. Dobara photo bhejo.",
-                reply_markup=None
-            )
-        return
-
-    if data == "menu_filters":
-        await query.edit_message_text(
-            "🎨 *Choose a Filter:*\n\nAll 25 filters are available!",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=filters_keyboard()
-        )
+    handler, premium = route
+    user = query.from_user
+    if premium and not db.get_or_create_user(user.id)["is_premium"]:
+        await _show(query, premium, parse_mode=ParseMode.MARKDOWN, reply_markup=PREMIUM_KEYBOARD)
         return
 
-    if data == "menu_crop":
-        await query.edit_message_text(
-            "✂️ *Choose Crop Ratio:*",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=crop_keyboard()
-        )
-        return
+    if arg is None:
+        await handler(query, user)
+    else:
+        await handler(query, user, arg)
 
-    if data == "menu_enhance":
-        await query.edit_message_text(
-            "✨ *Choose Enhancement:*",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=enhance_keyboard()
-        )
-        return
 
-    if data == "menu_ai":
-        user_data = db.get_or_create_user(user.id)
-        if not user_data["is_premium"]:
-            await query.edit_message_text(
-                "💎 *AI Suggestions — Premium Feature*\n\n"
-                "Upgrade to Premium to unlock:\n"
-                "• 🔍 Smart edit suggestions\n"
-                "• 📝 Caption generator\n"
-                "• 🔬 Deep image analysis\n\n"
-                f"Only ${Config.PREMIUM_MONTHLY_PRICE}/month",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=premium_keyboard()
-            )
-            return
-        await _handle_ai_suggestions(query, user)
-        return
+# ── Menu Navigation ──
 
-    if data == "menu_captions":
-        user_data = db.get_or_create_user(user.id)
-        if not user_data["is_premium"]:
-            await query.edit_message_text(
-                "💎 *AI Captions — Premium Feature*\n\nUpgrade to get AI-generated social media captions!",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=premium_keyboard()
-            )
-            return
-        await _handle_ai_captions(query, user)
-        return
+@callback_route("back_main")
+async def _back_main(query, user):
+    remaining = db.get_remaining_edits(user.id)
+    await _show(
+        query,
+        f"✅ *Photo ready!*\n🔋 Remaining edits: {remaining}\n\n👇 Choose an option:",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=MAIN_MENU_EDITED_KEYBOARD if _has_edits(user.id) else MAIN_MENU_KEYBOARD
+    )
 
-    if data == "menu_analysis":
-        user_data = db.get_or_create_user(user.id)
-        if not user_data["is_premium"]:
-            await query.edit_message_text(
-                "💎 *AI Analysis — Premium Feature*\n\nUpgrade to get professional AI photo analysis!",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=premium_keyboard()
-            )
-            return
-        await _handle_ai_analysis(query, user)
-        return
 
-    if data == "menu_stats":
-        user_data = db.get_or_create_user(user.id)
-        remaining = db.get_remaining_edits(user.id)
-        premium_status = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
-        text = (
-            f"📊 *Your Stats*\n\n"
-            f"🏷️ Plan: {premium_status}\n"
-            f"✏️ Total edits: {user_data['total_edits']}\n"
-            f"📆 Today: {user_data['daily_count']}\n"
-            f"🔋 Remaining: {remaining}"
-        )
-        await query.edit_message_text(
-            text,
+@callback_route("start_over")
+async def _start_over(query, user):
+    await _cancel_upgrade(user.id)
+    if _has_image(user.id):
+        album_edits = [f"album_current:{i}" for i in range(len(_album(user.id)))]
+        sessions.delete(user.id, "current", "history", *album_edits)
+        await _show(
+            query,
+            "↩️ *Original photo restore ho gayi!*\n\nAb nayi editing karo:",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
+            reply_markup=MAIN_MENU_KEYBOARD
         )
-        return
-
-    if data == "menu_premium":
-        await query.edit_message_text(
-            f"💎 *Premium Plan — ${Config.PREMIUM_MONTHLY_PRICE}/month*\n\n"
-            "✅ Unlimited edits\n"
-            "✅ AI Style Transfer\n"
-            "✅ AI Image Analysis\n"
-            "✅ Caption Generator\n\n"
-            "👇 Choose payment:",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=premium_keyboard()
+    else:
+        await _show(
+            query,
+            "❌ Original photo nahi mili. Dobara photo bhejo.",
+            reply_markup=None
         )
-        return
 
-    if data == "pay_stars":
-        await query.edit_message_text(
-            f"⭐ *Telegram Stars se Payment*\n\n"
-            f"Apna User ID: `{user.id}`\n\n"
-            f"Admin ko yeh ID bhejo aur payment karo.\n"
-            f"Premium activate ho jayega!\n\n"
-            f"Payment methods:\n"
-            f"• JazzCash / Easypaisa\n"
-            f"• USDT Crypto\n"
-            f"• Telegram Stars\n\n"
-            f"Price: ${Config.PREMIUM_MONTHLY_PRICE}/month",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Wapas", callback_data="menu_premium")]
-            ])
-        )
-        return
 
-    if data == "contact_admin":
-        await query.edit_message_text(
-            f"📧 *Admin se Contact Karo*\n\n"
-            f"Apna User ID: `{user.id}`\n\n"
-            f"Yeh ID admin ko bhejo aur payment karo:\n"
-            f"• JazzCash / Easypaisa\n"
-            f"• USDT (Crypto)\n"
-            f"• Telegram Stars\n\n"
-            f"Price: ${Config.PREMIUM_MONTHLY_PRICE}/month\n\n"
-            f"Payment ke baad admin /grant command se aapko premium dega!",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Wapas", callback_data="menu_premium")]
-            ])
-        )
-        return
+_screen("menu_filters", "🎨 *Choose a Filter:*\n\nAll 25 filters are available!", FILTERS_KEYBOARD)
+_screen("menu_crop", "✂️ *Choose Crop Ratio:*", CROP_KEYBOARD)
+_screen("menu_enhance", "✨ *Choose Enhancement:*", ENHANCE_KEYBOARD)
+_screen(
+    "menu_styles", "🪄 *Choose an AI Style:*", AI_STYLES_KEYBOARD,
+    premium="💎 *AI Styles — Premium Feature*\n\nUpgrade to turn your photo into anime, watercolor, sketch and more!",
+)
+_screen(
+    "menu_premium",
+    f"💎 *Premium Plan — ${Config.PREMIUM_MONTHLY_PRICE}/month*\n\n"
+    "✅ Unlimited edits\n"
+    "✅ AI Style Transfer\n"
+    "✅ AI Image Analysis\n"
+    "✅ Caption Generator\n\n"
+    "👇 Choose payment:",
+    PREMIUM_KEYBOARD,
+)
 
-    # ── Filter/Crop/Enhance Actions ──
-    if data.startswith("filter_"):
-        action = data[len("filter_"):]
-        await _apply_filter(query, user, action)
-        return
 
-    # ── AI Style Actions ──
-    if data.startswith("ai_style_"):
-        style = data[len("ai_style_"):]
-        await _apply_ai_style(query, user, style)
-        return
+@callback_route("menu_stats")
+async def _menu_stats(query, user):
+    user_data = db.get_or_create_user(user.id)
+    remaining = db.get_remaining_edits(user.id)
+    premium_status = "💎 Premium" if user_data["is_premium"] else "🆓 Free"
+    text = (
+        f"📊 *Your Stats*\n\n"
+        f"🏷️ Plan: {premium_status}\n"
+        f"✏️ Total edits: {user_data['total_edits']}\n"
+        f"📆 Today: {user_data['daily_count']}\n"
+        f"🔋 Remaining: {remaining}"
+    )
+    await _show(
+        query,
+        text,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=BACK_KEYBOARD
+    )
+
+
+@callback_route("pay_stars")
+async def _pay_stars(query, user):
+    await _show(
+        query,
+        f"⭐ *Telegram Stars se Payment*\n\n"
+        f"Apna User ID: `{user.id}`\n\n"
+        f"Admin ko yeh ID bhejo aur payment karo.\n"
+        f"Premium activate ho jayega!\n\n"
+        f"Payment methods:\n"
+        f"• JazzCash / Easypaisa\n"
+        f"• USDT Crypto\n"
+        f"• Telegram Stars\n\n"
+        f"Price: ${Config.PREMIUM_MONTHLY_PRICE}/month",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=BACK_TO_PREMIUM_KEYBOARD
+    )
+
+
+@callback_route("contact_admin")
+async def _contact_admin(query, user):
+    await _show(
+        query,
+        f"📧 *Admin se Contact Karo*\n\n"
+        f"Apna User ID: `{user.id}`\n\n"
+        f"Yeh ID admin ko bhejo aur payment karo:\n"
+        f"• JazzCash / Easypaisa\n"
+        f"• USDT (Crypto)\n"
+        f"• Telegram Stars\n\n"
+        f"Price: ${Config.PREMIUM_MONTHLY_PRICE}/month\n\n"
+        f"Payment ke baad admin /grant command se aapko premium dega!",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=BACK_TO_PREMIUM_KEYBOARD
+    )
 
 
 async def _get_admin_username(context) -> str:
@@ -984,41 +1009,98 @@ async def _get_admin_username(context) -> str:
         return str(Config.ADMIN_USER_ID)
 
 
-async def _apply_filter(query, user, action: str):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text(
+@callback_route(prefix="filter_")
+async def _apply_filter_button(query, user, action: str):
+    # The renderer knows the AI styles too; they are premium and only come
+    # through the gated ai_style_ route, not a hand-made filter_ callback
+    if AI_STYLE_CODES.intersection(action.split("+")) and not db.get_or_create_user(user.id)["is_premium"]:
+        await _show(query, AI_STYLES_PITCH, parse_mode=ParseMode.MARKDOWN, reply_markup=PREMIUM_KEYBOARD)
+        return
+    await _apply_filter(query, user, action)
+
+
+async def _apply_filter(query, user, action: str, edit_type: str = "filter"):
+    trace = current_trace()
+    if trace:
+        trace.name = f"{edit_type}:{action}"
+
+    if not _has_image(user.id):
+        await _show(
+            query,
             "❌ No image found! Please send a photo first.",
             reply_markup=None
         )
         return
 
-    if not db.can_edit(user.id):
+    with span("db_can_edit"):
+        allowed = db.can_edit(user.id)
+    if not allowed:
         remaining = db.get_remaining_edits(user.id)
-        await query.edit_message_text(
+        await _show(
+            query,
             f"⚠️ *Daily limit reached!*\n\n"
             f"🆓 Free plan: {Config.FREE_DAILY_LIMIT} edits/day\n"
             f"🔋 Remaining: {remaining}\n\n"
             f"Upgrade to 💎 Premium for unlimited edits!",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=premium_keyboard()
+            reply_markup=PREMIUM_KEYBOARD
         )
         return
 
-    await query.edit_message_text("⏳ Applying edit, please wait...")
+    # sendMediaGroup needs 2+ items; a lone album photo (the session's
+    # photo_sizes) is edited like any single photo
+    album = _album(user.id)
+    if len(album) > 1:
+        await _apply_filter_album(query, user, action, edit_type, album)
+        return
+
+    edit_started = time.perf_counter()
+    chain, charges = await _supersede_upgrade(user.id, action, edit_type)
+    as_document = sessions.get(user.id, "document", False)
+    if await _wants_preview(user.id):
+        await _apply_filter_progressive(query, user, action, chain, charges, as_document)
+        return
+
+    in_place = _edits_in_place(query.message, as_document)
+    calls = 0
+    waited = 0.0
+    if Config.EDIT_IN_PLACE:
+        # Progress as a chat action: nothing on the critical path waits for
+        # it. Old or inaccessible messages come without a chat to show it in.
+        if query.message is not None:
+            action_kind = ChatAction.UPLOAD_DOCUMENT if as_document else ChatAction.UPLOAD_PHOTO
+            with low_priority():
+                _background(query.get_bot().send_chat_action(query.message.chat_id, action_kind), "Chat action")
+    else:
+        started = time.perf_counter()
+        with span("status_edit"), low_priority():
+            await _show(query, "⏳ Applying edit, please wait...")
+        calls += 1
+        waited += time.perf_counter() - started
 
     try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        result_bytes = img_proc.process(image_bytes, action)
+        with span("get_image"):
+            image_bytes = await _get_image(query.get_bot(), user.id)
+        max_pixels = _max_pixels(user.id)
+        with span("render"):
+            if as_document:
+                # Full-resolution file back, no upload re-encode
+                result_bytes = upload_bytes = await _run_processing(
+                    image_processor().process, image_bytes, chain, "working", max_pixels
+                )
+            else:
+                result_bytes, upload_bytes = await _run_processing(
+                    image_processor().process_for_upload, image_bytes, chain, max_pixels
+                )
 
         # Edited image cache mein save karo taake agle edit pe bhi use ho
-        USER_IMAGE_CACHE[user.id] = result_bytes
+        with span("session"):
+            await sessions.update_async(user.id, {"current": result_bytes, "history": _history_after(user.id, chain)})
 
-        action_name = action.replace("_", " ").title()
-        db.increment_edit_count(user.id, "filter", action)
-        remaining = db.get_remaining_edits(user.id)
-
-        # Edited image cache mein save karo — agle edit is pe lagega
-        USER_IMAGE_CACHE[user.id] = result_bytes
+        action_name = _action_name(action)
+        with span("db_quota"):
+            _charge(user.id, charges)
+            remaining = db.get_remaining_edits(user.id)
 
         caption = (
             f"✅ *{action_name}* apply ho gaya!\n"
@@ -1026,246 +1108,484 @@ async def _apply_filter(query, user, action: str):
             f"👇 *Aur edit karo ya original pe wapas jao:*"
         )
 
-        more_edit_keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("🎨 Aur Filters", callback_data="menu_filters"),
-                InlineKeyboardButton("✨ Enhance", callback_data="menu_enhance"),
-            ],
-            [
-                InlineKeyboardButton("✂️ Crop", callback_data="menu_crop"),
-                InlineKeyboardButton("🔍 AI Analysis", callback_data="menu_analysis"),
-            ],
-            [
-                InlineKeyboardButton("↩️ Original Pe Wapas", callback_data="start_over"),
-                InlineKeyboardButton("💎 Premium", callback_data="menu_premium"),
-            ],
-        ])
-
-        await query.message.reply_photo(
-            photo=BytesIO(result_bytes),
-            caption=caption,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=more_edit_keyboard
+        started = time.perf_counter()
+        with STAGE_SECONDS.time(stage="upload"), span("upload"):
+            if in_place:
+                # Swap the image under the buttons: one call, no message chain
+                if as_document:
+                    media = InputMediaDocument(
+                        BytesIO(upload_bytes), caption=caption,
+                        parse_mode=ParseMode.MARKDOWN, filename=f"edited_{action}.jpg"
+                    )
+                else:
+                    media = InputMediaPhoto(BytesIO(upload_bytes), caption=caption, parse_mode=ParseMode.MARKDOWN)
+                await query.edit_message_media(media, reply_markup=MORE_EDITS_KEYBOARD)
+            elif as_document:
+                await query.message.reply_document(
+                    document=BytesIO(upload_bytes),
+                    filename=f"edited_{action}.jpg",
+                    caption=caption,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=MORE_EDITS_KEYBOARD
+                )
+            else:
+                await query.message.reply_photo(
+                    photo=BytesIO(upload_bytes),
+                    caption=caption,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=MORE_EDITS_KEYBOARD
+                )
+        calls += 1
+        waited += time.perf_counter() - started
+        TIME_TO_FIRST_PIXEL.observe(time.perf_counter() - edit_started, mode="full")
+
+        if not in_place:
+            if Config.EDIT_IN_PLACE:
+                # The result is already out; removing the old menu can trail
+                with low_priority():
+                    _background(query.delete_message(), "Menu cleanup")
+            else:
+                started = time.perf_counter()
+                with span("delete_status"), low_priority():
+                    await query.delete_message()
+                calls += 1
+                waited += time.perf_counter() - started
+
+        mode = "edit_media" if in_place else ("reply" if Config.EDIT_IN_PLACE else "legacy")
+        EDIT_TELEGRAM_CALLS.observe(calls, mode=mode)
+        EDIT_TELEGRAM_SECONDS.observe(waited, mode=mode)
+
+    except ImageRejected as e:
+        await _show(
+            query,
+            f"❌ {e}",
+            reply_markup=BACK_KEYBOARD
         )
-        await query.delete_message()
-
     except Exception as e:
         logger.error(f"Filter error: {e}")
-        await query.edit_message_text(
+        await _show(
+            query,
             "❌ Edit failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
+            reply_markup=BACK_KEYBOARD
         )
 
 
-async def _handle_ai_suggestions(query, user):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text("❌ No image found! Please send a photo first.")
-        return
-
-    await query.edit_message_text("🤖 AI suggestions generate ho rahi hain... ⏳")
+async def _wants_preview(user_id: int) -> bool:
+    """Progressive delivery pays off once the full render is big enough to
+    take noticeably longer than a preview"""
+    if not Config.PREVIEW_MIN_PIXELS:
+        return False
+    original = sessions.get(user_id, "photo_sizes")[-1]
+    width, height = original["width"], original["height"]
+    if not width:
+        # Documents: dimensions aren't known until the file is downloaded
+        image_bytes = await sessions.get_async(user_id, "original")
+        if image_bytes is None:
+            return True
+        try:
+            width, height, _ = probe(image_bytes)
+        except ImageRejected:
+            return False
+    return min(width * height, _max_pixels(user_id)) >= Config.PREVIEW_MIN_PIXELS
+
+
+async def _apply_filter_progressive(query, user, action: str, chain: str, charges: list, as_document: bool):
+    """Render a small preview of chain (action, after any superseded edit)
+    from the smallest adequate Telegram tier and send it right away; the
+    full-resolution render follows in the background (_upgrade_to_full),
+    replaces it in the same message and charges the edits."""
+    started = time.perf_counter()
+    message = query.message
+    in_place = Config.EDIT_IN_PLACE and message is not None and bool(message.photo or message.document)
+    if message is not None:
+        with low_priority():
+            _background(query.get_bot().send_chat_action(message.chat_id, ChatAction.UPLOAD_PHOTO), "Chat action")
 
     try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        suggestions = ai_editor.get_edit_suggestions(image_bytes)
-        db.increment_edit_count(user.id, "ai_suggestions")
+        with span("get_image"):
+            image_bytes = await _get_image(
+                query.get_bot(), user.id, min_side=math.isqrt(Config.PREVIEW_MAX_PIXELS)
+            )
+        with span("render"):
+            preview_bytes = await _run_processing(
+                image_processor().process_preview, image_bytes, chain, pool=PREVIEW_POOL
+            )
 
-        await query.edit_message_text(
-            f"🤖 *AI Edit Suggestions*\n\n{suggestions}\n\n"
-            "👇 Ab in filters ko apply karo:",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎨 Apply Filters", callback_data="menu_filters")],
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")],
-            ])
+        preview_caption = f"⚡ *{_action_name(action)}* preview — full quality aa rahi hai... ⏳"
+
+        with STAGE_SECONDS.time(stage="upload"), span("upload"):
+            media = InputMediaPhoto(BytesIO(preview_bytes), caption=preview_caption, parse_mode=ParseMode.MARKDOWN)
+            if in_place:
+                sent = await query.edit_message_media(media, reply_markup=MORE_EDITS_KEYBOARD)
+            else:
+                sent = await message.reply_photo(
+                    photo=BytesIO(preview_bytes),
+                    caption=preview_caption,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=MORE_EDITS_KEYBOARD
+                )
+                with low_priority():
+                    _background(query.delete_message(), "Menu cleanup")
+        TIME_TO_FIRST_PIXEL.observe(time.perf_counter() - started, mode="preview")
+
+    except ImageRejected as e:
+        await _show(
+            query,
+            f"❌ {e}",
+            reply_markup=BACK_KEYBOARD
         )
-
+        return
     except Exception as e:
-        logger.error(f"AI suggestions error: {e}")
-        await query.edit_message_text(
-            "❌ AI suggestions failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
+        logger.error(f"Preview error: {e}")
+        await _show(
+            query,
+            "❌ Edit failed. Please try again.",
+            reply_markup=BACK_KEYBOARD
         )
+        return
 
+    upgrade = _Upgrade(chain, charges, sent.chat_id, sent.message_id)
+    _UPGRADES[user.id] = upgrade
+    upgrade.task = asyncio.create_task(_upgrade_to_full(query.get_bot(), upgrade, user.id, as_document))
 
-async def _apply_ai_style(query, user, style: str):
-    pass
 
+async def _upgrade_to_full(bot, upgrade: _Upgrade, user_id: int, as_document: bool):
+    action = upgrade.action
+    try:
+        with trace(f"upgrade:{action}", user_id):
+            with span("get_image"):
+                image_bytes = await _get_image(bot, user_id)
+            max_pixels = _max_pixels(user_id)
+            with span("render"):
+                if as_document:
+                    result_bytes = upload_bytes = await _run_processing(
+                        image_processor().process, image_bytes, action, "working", max_pixels
+                    )
+                else:
+                    result_bytes, upload_bytes = await _run_processing(
+                        image_processor().process_for_upload, image_bytes, action, max_pixels
+                    )
+            upgrade.rendered = True
+            with span("session"):
+                await sessions.update_async(user_id, {"current": result_bytes, "history": _history_after(user_id, action)})
+            with span("db_quota"):
+                _charge(user_id, upgrade.charges)
+                remaining = db.get_remaining_edits(user_id)
+            upgrade.stored.set()
+
+            # The edit's own caption, unless the user has opened another
+            # screen on the message since
+            caption, parse_mode = upgrade.caption, upgrade.parse_mode
+            if caption is None:
+                caption = (
+                    f"✅ *{_action_name(upgrade.charges[-1][1])}* apply ho gaya!\n"
+                    f"🔋 Remaining edits: {remaining}\n\n"
+                    f"👇 *Aur edit karo ya original pe wapas jao:*"
+                )
+                parse_mode = ParseMode.MARKDOWN
+            if as_document:
+                media = InputMediaDocument(
+                    BytesIO(upload_bytes), caption=caption,
+                    parse_mode=parse_mode, filename=f"edited_{action}.jpg"
+                )
+            else:
+                media = InputMediaPhoto(BytesIO(upload_bytes), caption=caption, parse_mode=parse_mode)
+            with STAGE_SECONDS.time(stage="upload"), span("upload"):
+                await bot.edit_message_media(
+                    media, chat_id=upgrade.chat_id, message_id=upgrade.message_id, reply_markup=upgrade.reply_markup
+                )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Full-resolution upgrade error: {e}")
+        text = f"❌ {e}" if isinstance(e, ImageRejected) else "❌ Full quality edit fail ho gaya. Dobara try karo."
+        await _quietly(
+            bot.edit_message_caption(
+                chat_id=upgrade.chat_id, message_id=upgrade.message_id, caption=text, reply_markup=BACK_KEYBOARD
+            ),
+            "Upgrade error notice"
+        )
+    finally:
+        upgrade.stored.set()
+        if _UPGRADES.get(user_id) is upgrade:
+            del _UPGRADES[user_id]
 
-async def _handle_ai_analysis(query, user):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text("❌ No image found! Please send a photo first.")
+
+async def _apply_filter_album(query, user, action: str, edit_type: str, album: list):
+    count = len(album)
+    remaining = db.get_remaining_edits(user.id)
+    if remaining < count:
+        await _show(
+            query,
+            f"⚠️ *{count} photos ke liye {count} edits chahiye!*\n\n"
+            f"🔋 Remaining: {remaining}\n\n"
+            f"Upgrade to 💎 Premium for unlimited edits!",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=PREMIUM_KEYBOARD
+        )
         return
 
-    await query.edit_message_text("🔍 Analyzing your image with AI... ⏳")
+    with span("status_edit"), low_priority():
+        await _show(query, f"⏳ Applying edit to {count} photos, please wait...")
 
     try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        analysis = ai_editor.analyze_image(image_bytes)
-        db.increment_edit_count(user.id, "ai_analysis")
+        bot = query.get_bot()
+        with span("get_image"):
+            images = await asyncio.gather(*(
+                _get_album_image(bot, user.id, i, sizes) for i, sizes in enumerate(album)
+            ))
+        # One pool job per photo, so the album renders in parallel
+        max_pixels = _max_pixels(user.id)
+        with span("render"):
+            results = await asyncio.gather(*(
+                _run_processing(image_processor().process_for_upload, image_bytes, action, max_pixels)
+                for image_bytes in images
+            ))
+
+        with STAGE_SECONDS.time(stage="upload"), span("upload"):
+            await query.message.reply_media_group(
+                [InputMediaPhoto(BytesIO(upload_bytes)) for _, upload_bytes in results]
+            )
 
-        await query.edit_message_text(
-            f"🔍 *AI Image Analysis*\n\n{analysis}",
+        # Only an album the user actually got is kept and charged
+        with span("session"):
+            fields = {f"album_current:{i}": result_bytes for i, (result_bytes, _) in enumerate(results)}
+            fields["history"] = _history_after(user.id, action)
+            await sessions.update_async(user.id, fields)
+
+        action_name = _action_name(action)
+        with span("db_quota"):
+            db.increment_edit_count(user.id, edit_type, action, count=count)
+            remaining = db.get_remaining_edits(user.id)
+
+        # Media groups can't carry buttons, so the menu follows separately
+        await query.message.reply_text(
+            f"✅ *{action_name}* {count} photos pe apply ho gaya!\n"
+            f"🔋 Remaining edits: {remaining}\n\n"
+            f"👇 *Aur edit karo ya original pe wapas jao:*",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Edit", callback_data="back_main")]
-            ])
+            reply_markup=MORE_EDITS_KEYBOARD
+        )
+        with span("delete_status"), low_priority():
+            await query.delete_message()
+
+    except ImageRejected as e:
+        await _show(
+            query,
+            f"❌ {e}",
+            reply_markup=BACK_KEYBOARD
         )
-
     except Exception as e:
-        logger.error(f"AI analysis error: {e}")
-        await query.edit_message_text(
-            "❌ Analysis failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
+        logger.error(f"Album filter error: {e}")
+        await _show(
+            query,
+            "❌ Edit failed. Please try again.",
+            reply_markup=BACK_KEYBOARD
         )
 
 
-async def _handle_ai_captions(query, user):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text("❌ No image found! Please send a photo first.")
+@callback_route("menu_presets")
+async def _menu_presets(query, user):
+    presets = db.get_presets(user.id)
+    if not presets:
+        await _show(
+            query,
+            "⭐ *My Presets*\n\n"
+            "Abhi koi preset nahi hai.\n\n"
+            "Photo pe 2-3 edits karo, phir `/preset naam` bhejo — poori chain save ho jayegi "
+            "aur agli photo pe ek tap mein lagegi!",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=BACK_KEYBOARD
+        )
         return
 
-    await query.edit_message_text("📝 Generating captions... ⏳")
+    lines = [f"{i}. *{p['name']}* — {_action_name('+'.join(p['steps']))}" for i, p in enumerate(presets, 1)]
+    rows = [[InlineKeyboardButton(f"⭐ {p['name']}", callback_data=f"preset_{p['id']}")] for p in presets]
+    rows.append([InlineKeyboardButton("⬅️ Back", callback_data="back_main")])
+    await _show(
+        query,
+        "⭐ *My Presets*\n\n" + "\n".join(lines) + "\n\n👇 Poori chain ek tap mein (1 edit):",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=InlineKeyboardMarkup(rows)
+    )
 
-    try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        captions = ai_editor.get_caption_suggestions(image_bytes)
-        db.increment_edit_count(user.id, "ai_captions")
 
-        await query.edit_message_text(
-            f"📝 *AI Caption Suggestions*\n\n{captions}",
+@callback_route(prefix="preset_")
+async def _apply_preset(query, user, preset_id: str):
+    # The whole chain renders as one action: one decode, one encode, one
+    # upload and one charged edit, through the same path as a single filter
+    preset = db.get_preset(user.id, int(preset_id)) if preset_id.isdigit() else None
+    if preset is None:
+        await _show(query, "❌ Preset nahi mila.", reply_markup=BACK_KEYBOARD)
+        return
+    if AI_STYLE_CODES.intersection(preset["steps"]) and not db.get_or_create_user(user.id)["is_premium"]:
+        await _show(
+            query,
+            "💎 *Is preset mein AI Styles hain — Premium Feature*\n\nUpgrade karke ek tap mein lagao!",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Edit", callback_data="back_main")]
-            ])
-        )
-
-    except Exception as e:
-        logger.error(f"AI captions error: {e}")
-        await query.edit_message_text(
-            "❌ Caption generation failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
+            reply_markup=PREMIUM_KEYBOARD
         )
+        return
+    await _apply_filter(query, user, "+".join(preset["steps"]), edit_type="preset")
 
 
-async def unknown_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📸 Please send a *photo* to get started!\n\nUse /help for instructions.",
-        parse_mode=ParseMode.MARKDOWN
-    )
+LUTS_PER_PAGE = 20
 
 
-# ─── MAIN ──────────────────────────────────────────────────────────────────────
+@callback_route("menu_luts")
+async def _menu_luts(query, user):
+    await _show_luts(query, 0)
 
-def main():
-    if not Config.TELEGRAM_BOT_TOKEN:
-        print("❌ ERROR: TELEGRAM_BOT_TOKEN not set in .env file!")
-        return
 
-    print("Starting Editor Bot...")
+@callback_route(prefix="luts_page_")
+async def _luts_page(query, user, page: str):
+    await _show_luts(query, int(page) if page.isdigit() else 0)
 
-    proxy = os.getenv("PROXY_URL", "")
-    if proxy:
-        request = HTTPXRequest(proxy=proxy, connect_timeout=30, read_timeout=30)
-        app = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).request(request).build()
-    else:
-        request = HTTPXRequest(connect_timeout=30, read_timeout=30)
-        app = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).request(request).build()
 
-    app.add_handler(CommandHandler("start", start_command))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("stats", stats_command))
-    app.add_handler(CommandHandler("premium", premium_command))
-    app.add_handler(CommandHandler("admin", admin_stats_command))
-    app.add_handler(CommandHandler("grant", grant_premium_command))
-    app.add_handler(MessageHandler(filters.PHOTO, photo_handler))
-    app.add_handler(CallbackQueryHandler(callback_handler))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown_handler))
+async def _show_luts(query, page: int):
+    """Custom looks, LUTS_PER_PAGE at a time (Telegram caps a keyboard at
+    100 buttons); they apply through the filter_ route like any filter"""
+    looks = lut_library.LIBRARY.entries()
+    if not looks:
+        await _show(
+            query,
+            "🎞️ *Custom LUTs*\n\nAbhi koi custom LUT nahi hai.",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="menu_filters")]])
+        )
+        return
 
-    print("Bot is running! Press Ctrl+C to stop.")
-    app.run_polling(
-        drop_pending_updates=True,
-        allowed_updates=Update.ALL_TYPES,
-        read_timeout=30,
-        write_timeout=30,
-        connect_timeout=30,
-        pool_timeout=30,
+    pages = (len(looks) + LUTS_PER_PAGE - 1) // LUTS_PER_PAGE
+    page = min(page, pages - 1)
+    shown = [(f"🎞️ {label}", code) for label, code in looks[page * LUTS_PER_PAGE:(page + 1) * LUTS_PER_PAGE]]
+    rows = _button_grid(shown, "filter_", 2)
+    rows[-1] = [InlineKeyboardButton("⬅️ Back", callback_data="menu_filters")]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"luts_page_{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"luts_page_{page + 1}"))
+    if nav:
+        rows.insert(-1, nav)
+    await _show(
+        query,
+        f"🎞️ *Custom LUTs* ({len(looks)}) — page {page + 1}/{pages}",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=InlineKeyboardMarkup(rows)
     )
 
 
-if __name__ == "__main__":
-    main()
+@callback_route("menu_ai", premium=(
+    "💎 *AI Suggestions — Premium Feature*\n\n"
+    "Upgrade to Premium to unlock:\n"
+    "• 🔍 Smart edit suggestions\n"
+    "• 📝 Caption generator\n"
+    "• 🔬 Deep image analysis\n\n"
+    f"Only ${Config.PREMIUM_MONTHLY_PRICE}/month"
+))
+async def _handle_ai_suggestions(query, user):
+    if not _has_image(user.id):
+        await _show(query, "❌ No image found! Please send a photo first.")
+        return
 
+    with low_priority():
+        await _show(query, "🤖 AI suggestions generate ho rahi hain... ⏳")
 
+    try:
+        image_bytes = await _get_image(query.get_bot(), user.id, min_side=Config.AI_INPUT_SIDE)
+        editor = await asyncio.to_thread(ai_editor)
+        suggestions = await asyncio.to_thread(editor.get_edit_suggestions, image_bytes)
+        if not suggestions.degraded:
+            db.increment_edit_count(user.id, "ai_suggestions")
+
+        # One tap per recommended edit; they share the filter_ route
+        rows = _button_grid(suggestions.actions, "filter_", 1)
+        rows.insert(-1, [InlineKeyboardButton("🎨 Apply Filters", callback_data="menu_filters")])
+        await _show(
+            query,
+            f"🤖 *AI Edit Suggestions*\n\n{suggestions}\n\n"
+            "👇 Ek tap mein apply karo:",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup(rows)
+        )
 
+    except Exception as e:
+        logger.error(f"AI suggestions error: {e}")
+        await _show(
+            query,
+            "❌ AI suggestions failed. Please try again.",
+            reply_markup=BACK_KEYBOARD
+        )
+
+
+@callback_route(prefix="ai_style_", premium=AI_STYLES_PITCH)
 async def _apply_ai_style(query, user, style: str):
-    pass
+    # Styles are local effects in ImageProcessor, so they share the filter
+    # path: same processing pool, same image cache, same quota.
+    await _apply_filter(query, user, style, edit_type="ai_style")
 
 
+@callback_route("menu_analysis", premium="💎 *AI Analysis — Premium Feature*\n\nUpgrade to get professional AI photo analysis!")
 async def _handle_ai_analysis(query, user):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text("❌ No image found! Please send a photo first.")
+    if not _has_image(user.id):
+        await _show(query, "❌ No image found! Please send a photo first.")
         return
 
-    await query.edit_message_text("🔍 Analyzing your image with AI... ⏳")
+    with low_priority():
+        await _show(query, "🔍 Analyzing your image with AI... ⏳")
 
     try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        analysis = ai_editor.analyze_image(image_bytes)
-        db.increment_edit_count(user.id, "ai_analysis")
-
-        await query.edit_message_text(
+        image_bytes = await _get_image(query.get_bot(), user.id, min_side=Config.AI_INPUT_SIDE)
+        editor = await asyncio.to_thread(ai_editor)
+        analysis = await asyncio.to_thread(editor.analyze_image, image_bytes)
+        if not analysis.degraded:
+            db.increment_edit_count(user.id, "ai_analysis")
+
+        await _show(
+            query,
             f"🔍 *AI Image Analysis*\n\n{analysis}",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Edit", callback_data="back_main")]
-            ])
+            reply_markup=BACK_TO_EDIT_KEYBOARD
         )
 
     except Exception as e:
         logger.error(f"AI analysis error: {e}")
-        await query.edit_message_text(
+        await _show(
+            query,
             "❌ Analysis failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
+            reply_markup=BACK_KEYBOARD
         )
 
 
+@callback_route("menu_captions", premium="💎 *AI Captions — Premium Feature*\n\nUpgrade to get AI-generated social media captions!")
 async def _handle_ai_captions(query, user):
-    if user.id not in USER_IMAGE_CACHE:
-        await query.edit_message_text("❌ No image found! Please send a photo first.")
+    if not _has_image(user.id):
+        await _show(query, "❌ No image found! Please send a photo first.")
         return
 
-    await query.edit_message_text("📝 Generating captions... ⏳")
+    with low_priority():
+        await _show(query, "📝 Generating captions... ⏳")
 
     try:
-        image_bytes = USER_IMAGE_CACHE[user.id]
-        captions = ai_editor.get_caption_suggestions(image_bytes)
-        db.increment_edit_count(user.id, "ai_captions")
-
-        await query.edit_message_text(
+        image_bytes = await _get_image(query.get_bot(), user.id, min_side=Config.AI_INPUT_SIDE)
+        editor = await asyncio.to_thread(ai_editor)
+        captions = await asyncio.to_thread(editor.get_caption_suggestions, image_bytes)
+        if not captions.degraded:
+            db.increment_edit_count(user.id, "ai_captions")
+
+        await _show(
+            query,
             f"📝 *AI Caption Suggestions*\n\n{captions}",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Edit", callback_data="back_main")]
-            ])
+            reply_markup=BACK_TO_EDIT_KEYBOARD
         )
 
     except Exception as e:
         logger.error(f"AI captions error: {e}")
-        await query.edit_message_text(
+        await _show(
+            query,
             "❌ Caption generation failed. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back", callback_data="back_main")]
-            ])
+            reply_markup=BACK_KEYBOARD
         )
 
 
@@ -1276,6 +1596,62 @@ async def unknown_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def route_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every other handler: updates owned by another replica
+    are forwarded there and go no further here"""
+    if worker_router.is_local(update):
+        return
+    try:
+        await worker_router.forward(update)
+    except Exception as e:
+        # Better served here out of order than not at all
+        logger.error(f"Update forward error: {e}")
+        return
+    raise ApplicationHandlerStop
+
+
+async def _post_init(app: Application):
+    _mark_startup("initialize")
+    # Everything not needed to receive the first update waits until polling
+    # (or the webhook) is running
+    app.job_queue.run_once(after_start_job, 0)
+
+
+async def after_start_job(context: ContextTypes.DEFAULT_TYPE):
+    _mark_startup("polling")
+    report = ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in STARTUP_MARKS)
+    logger.info(f"Startup: {report}")
+    STARTUP_SECONDS.set(STARTUP_MARKS[-1][1])
+
+    if Config.METRICS_PORT:
+        context.bot_data["metrics_runner"] = await start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+        logger.info(f"Metrics on http://{Config.METRICS_HOST}:{Config.METRICS_PORT}/metrics")
+
+    # Warm the filter engine in the background so the first edit doesn't
+    # pay for importing numpy; AIEditor stays lazy until an AI request.
+    # A failure here is logged; the first edit retries the construction.
+    _background(asyncio.get_running_loop().run_in_executor(PROCESSING_POOL, image_processor), "Filter engine warm-up")
+
+
+async def _post_shutdown(app: Application):
+    runner = app.bot_data.get("metrics_runner")
+    if runner:
+        await runner.cleanup()
+    await worker_router.close()
+
+
+async def expire_premium_job(context: ContextTypes.DEFAULT_TYPE):
+    expired = db.expire_premium()
+    if expired:
+        logger.info(f"Premium expired for {expired} users")
+
+
+async def prune_sessions_job(context: ContextTypes.DEFAULT_TYPE):
+    removed = sessions.prune(Config.SESSION_TTL_HOURS * 3600)
+    if removed:
+        logger.info(f"Pruned {removed} stale session rows")
+
+
 # ─── MAIN ──────────────────────────────────────────────────────────────────────
 
 def main():
@@ -1285,25 +1661,61 @@ def main():
 
     print("Starting Editor Bot...")
 
+    # One pooled connection per concurrently running update
     proxy = os.getenv("PROXY_URL", "")
+    pool_size = Config.MAX_CONCURRENT_UPDATES
     if proxy:
-        request = HTTPXRequest(proxy=proxy, connect_timeout=30, read_timeout=30)
-        app = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).request(request).build()
+        request = HTTPXRequest(proxy=proxy, connection_pool_size=pool_size, connect_timeout=30, read_timeout=30)
     else:
-        request = HTTPXRequest(connect_timeout=30, read_timeout=30)
-        app = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).request(request).build()
-
+        request = HTTPXRequest(connection_pool_size=pool_size, connect_timeout=30, read_timeout=30)
+    builder = (
+        Application.builder()
+        .token(Config.TELEGRAM_BOT_TOKEN)
+        .request(request)
+        .concurrent_updates(update_processor)
+        .rate_limiter(rate_limiter)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+    )
+    if Config.TELEGRAM_API_URL:
+        api_url = Config.TELEGRAM_API_URL.rstrip("/")
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    app = builder.build()
+    _mark_startup("build")
+
+    if len(Config.WORKER_URLS) > 1:
+        app.add_handler(TypeHandler(Update, route_update), group=-1)
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CommandHandler("premium", premium_command))
     app.add_handler(CommandHandler("admin", admin_stats_command))
     app.add_handler(CommandHandler("grant", grant_premium_command))
+    app.add_handler(CommandHandler("perf", perf_command))
+    app.add_handler(CommandHandler("preset", preset_command))
     app.add_handler(MessageHandler(filters.PHOTO, photo_handler))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("cube"), lut_upload_handler))
+    app.add_handler(MessageHandler(filters.Document.IMAGE, document_handler))
     app.add_handler(CallbackQueryHandler(callback_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown_handler))
 
+    app.job_queue.run_repeating(expire_premium_job, interval=Config.PREMIUM_SWEEP_SECONDS, first=30)
+    if hasattr(sessions, "prune"):
+        app.job_queue.run_repeating(prune_sessions_job, interval=3600, first=60)
+
     print("Bot is running! Press Ctrl+C to stop.")
+    if Config.WEBHOOK_URL:
+        # Every replica registers the same URL; the load balancer spreads
+        # updates and route_update passes each on to its user's replica.
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=Config.PORT,
+            url_path=Config.TELEGRAM_BOT_TOKEN,
+            webhook_url=f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.TELEGRAM_BOT_TOKEN}",
+            allowed_updates=Update.ALL_TYPES,
+        )
+        return
+
     app.run_polling(
         drop_pending_updates=True,
         allowed_updates=Update.ALL_TYPES,
@@ -1316,4 +1728,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+from metrics import REGISTRY
+
+CIRCUIT_SHORT_CIRCUITS = REGISTRY.counter(
+    "editor_circuit_short_circuits_total", "Calls refused because the circuit was open", ("circuit",)
+)
+CIRCUIT_OPENED = REGISTRY.counter(
+    "editor_circuit_opened_total", "Times a circuit tripped open", ("circuit",)
+)
+CIRCUIT_OPEN = REGISTRY.gauge(
+    "editor_circuit_open", "1 while the circuit is open or probing", ("circuit",)
+)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+
+class CircuitOpen(Exception):
+    """Refused without calling: the dependency is failing or too slow"""
+
+
+class CircuitBreaker:
+    """Tracks the last `window` calls to a dependency. Once at least
+    min_calls are in, it opens when the share of errors, or of calls slower
+    than slow_seconds, reaches error_rate; while open every call fails
+    fast with CircuitOpen. After open_seconds one probe call is let
+    through (half-open): success closes the circuit, failure re-opens it.
+
+    Thread-safe: callers run on worker threads (asyncio.to_thread)."""
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, error_rate: float = 0.5,
+                 slow_seconds: float = 10.0, open_seconds: float = 30.0, clock=time.monotonic):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        CIRCUIT_OPEN.set(0, circuit=name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def _allow(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def _record(self, ok: bool, seconds: float):
+        healthy = ok and seconds < self.slow_seconds
+        with self._lock:
+            if ok:
+                self._latencies.append(seconds)
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if healthy:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    CIRCUIT_OPEN.set(0, circuit=self.name)
+                else:
+                    self._trip()
+                return
+            self._outcomes.append(healthy)
+            if self._state == CLOSED and len(self._outcomes) >= self.min_calls:
+                bad = self._outcomes.count(False)
+                if bad / len(self._outcomes) >= self.error_rate:
+                    self._trip()
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        CIRCUIT_OPENED.inc(circuit=self.name)
+        CIRCUIT_OPEN.set(1, circuit=self.name)
+
+    def call(self, func, *args):
+        if not self._allow():
+            CIRCUIT_SHORT_CIRCUITS.inc(circuit=self.name)
+            raise CircuitOpen(f"{self.name} circuit open")
+        start = self._clock()
+        try:
+            result = func(*args)
+        except Exception:
+            self._record(False, self._clock() - start)
+            raise
+        self._record(True, self._clock() - start)
+        return result
+
+    def latency_quantile(self, q: float):
+        """Recent successful-call latency at quantile q, None until min_calls"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < self.min_calls:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
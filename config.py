@@ -12,8 +12,124 @@ class Config:
 
     FREE_DAILY_LIMIT = 10
     PREMIUM_DAILY_LIMIT = 999
+    # Saved edit chains (/preset); one application is charged as one edit
+    PRESET_MAX_PER_USER = int(os.getenv("PRESET_MAX_PER_USER", "10"))
+    PRESET_MAX_STEPS = int(os.getenv("PRESET_MAX_STEPS", "8"))
 
-    DB_PATH = "editor_bot.db"
+    DB_PATH = os.getenv("DB_PATH", "editor_bot.db")
+
+    # "memory" (single process) or "sqlite" (shared by replicas on one volume)
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+    SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+    SESSION_SHARDS = int(os.getenv("SESSION_SHARDS", "1"))
+    SESSION_MAX_IN_MEMORY = int(os.getenv("SESSION_MAX_IN_MEMORY", "500"))
+    SESSION_TTL_HOURS = int(os.getenv("SESSION_TTL_HOURS", "24"))
+    # Histograms of recent image versions (a few KB each), see image_stats.py
+    IMAGE_STATS_CACHE_SIZE = int(os.getenv("IMAGE_STATS_CACHE_SIZE", "2000"))
+
+    # How often expired premium plans are flipped back to free in bulk
+    PREMIUM_SWEEP_SECONDS = int(os.getenv("PREMIUM_SWEEP_SECONDS", "3600"))
+
+    # Webhook mode lets several replicas sit behind one load balancer;
+    # polling only allows a single getUpdates consumer per token.
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    # Webhook replicas that each own a share of the users (jump hash of the
+    # user ID): every replica lists the same internal base URLs, its own
+    # included, and its position in that list. An update that the load
+    # balancer hands to the wrong replica is forwarded to the owner, so a
+    # user's ordering and pending upgrade stay in one process.
+    WORKER_URLS = [url.strip().rstrip("/") for url in os.getenv("WORKER_URLS", "").split(",") if url.strip()]
+    WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+
+    # Bot API server root, for a self-hosted server or the load test's
+    # fake one (fake_bot_api.py); empty means api.telegram.org
+    TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+    PORT = int(os.getenv("PORT", "8443"))
+
+    # Prometheus /metrics endpoint, 0 disables it
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+    # Requests slower than this get a logged span breakdown; a sample of
+    # them also gets a cProfile dump in PROFILE_DIR
+    TRACE_SLOW_MS = int(os.getenv("TRACE_SLOW_MS", "3000"))
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.05"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+    # Outgoing Bot API calls: overall calls/s, per private chat calls/s
+    # (bursts up to TG_CHAT_BURST), per group calls/minute. A 429 pauses the
+    # chat for retry_after and retries up to TG_MAX_RETRIES times.
+    TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+    TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+    TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "5"))
+    TG_GROUP_PER_MINUTE = float(os.getenv("TG_GROUP_PER_MINUTE", "20"))
+    TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+    # Longest a low-priority call (status edits, cleanup) yields to others
+    TG_LOW_PRIORITY_MAX_DEFER = float(os.getenv("TG_LOW_PRIORITY_MAX_DEFER", "2"))
+
+    # Apply edits by replacing the photo in the message the buttons are on
+    # (one Bot API call, progress as a chat action) instead of a "⏳" text
+    # edit + new photo + deleting the menu
+    EDIT_IN_PLACE = os.getenv("EDIT_IN_PLACE", "1") == "1"
+
+    # Progressive delivery: edits of images above PREVIEW_MIN_PIXELS first
+    # send a render of at most PREVIEW_MAX_PIXELS, then swap in full
+    # resolution once it's ready. 0 turns previews off.
+    PREVIEW_MIN_PIXELS = int(os.getenv("PREVIEW_MIN_PIXELS", str(3_000_000)))
+    PREVIEW_MAX_PIXELS = int(os.getenv("PREVIEW_MAX_PIXELS", str(400_000)))
+    # Threads for preview renders, apart from PROCESSING_WORKERS
+    PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+
+    PROCESSING_WORKERS = int(os.getenv("PROCESSING_WORKERS", str(os.cpu_count() or 2)))
+    MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+    # Ingest limits: inputs above the plan's cap are downscaled while
+    # decoding, anything above MAX_INPUT_PIXELS is refused from the header.
+    # MEMORY_BUDGET_MB bounds the estimated working set of all render jobs
+    # in flight; a job that doesn't fit waits up to INGEST_QUEUE_SECONDS.
+    FREE_MAX_PIXELS = int(os.getenv("FREE_MAX_PIXELS", str(12_000_000)))
+    PREMIUM_MAX_PIXELS = int(os.getenv("PREMIUM_MAX_PIXELS", str(50_000_000)))
+    MAX_INPUT_PIXELS = int(os.getenv("MAX_INPUT_PIXELS", str(100_000_000)))
+    MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "1024"))
+    INGEST_QUEUE_SECONDS = float(os.getenv("INGEST_QUEUE_SECONDS", "30"))
+
+    # Colour filters on images above TILE_THRESHOLD_PIXELS (documents, not
+    # Telegram photos) render in strips of about TILE_PIXELS
+    TILE_THRESHOLD_PIXELS = int(os.getenv("TILE_THRESHOLD_PIXELS", str(12_000_000)))
+    TILE_PIXELS = int(os.getenv("TILE_PIXELS", str(4_000_000)))
+
+    # Custom .cube looks uploaded by the admin, see lut_library.py
+    LUT_DIR = os.getenv("LUT_DIR", "luts")
+
+    UPLOAD_TARGET_BYTES = int(os.getenv("UPLOAD_TARGET_BYTES", str(600 * 1024)))
+    ENCODE_BASELINE_EVERY = 20
+
+    # Gemini downscales uploads anyway; the ~800 px Telegram tier is plenty
+    AI_INPUT_SIDE = 768
+
+    # Edit suggestions come from a local histogram analysis (suggestions.py,
+    # a few ms, no API call); AI_SUGGESTIONS=gemini asks Gemini for the text
+    AI_SUGGESTIONS = os.getenv("AI_SUGGESTIONS", "local")
+
+    # Gemini circuit breaker: over the last GEMINI_BREAKER_WINDOW calls, once
+    # GEMINI_BREAKER_ERROR_RATE of them failed or took over
+    # GEMINI_SLOW_SECONDS, AI features answer from the local fallback for
+    # GEMINI_BREAKER_OPEN_SECONDS before a probe call is let through.
+    # GEMINI_HEDGE=1 sends a second request once the first is slower than
+    # recent p95 (at least GEMINI_HEDGE_MIN_SECONDS).
+    GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "20"))
+    GEMINI_SLOW_SECONDS = float(os.getenv("GEMINI_SLOW_SECONDS", "10"))
+    GEMINI_BREAKER_WINDOW = int(os.getenv("GEMINI_BREAKER_WINDOW", "20"))
+    GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "5"))
+    GEMINI_BREAKER_ERROR_RATE = float(os.getenv("GEMINI_BREAKER_ERROR_RATE", "0.5"))
+    GEMINI_BREAKER_OPEN_SECONDS = float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", "30"))
+    GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "0") == "1"
+    GEMINI_HEDGE_MIN_SECONDS = float(os.getenv("GEMINI_HEDGE_MIN_SECONDS", "1.0"))
+    GEMINI_MAX_INFLIGHT = int(os.getenv("GEMINI_MAX_INFLIGHT", "16"))
+
+    # Album photos arrive as separate updates; wait this long after the
+    # first one before showing the batch menu
+    ALBUM_COLLECT_SECONDS = float(os.getenv("ALBUM_COLLECT_SECONDS", "1.5"))
 
     FILTERS_LIST = [
         ("🌅 Warm", "warm"),
@@ -63,3 +179,16 @@ class Config:
         ("↔️ Flip Horizontal", "enhance_flip_h"),
         ("↕️ Flip Vertical", "enhance_flip_v"),
     ]
+
+    # Rendered locally by ImageProcessor; listed here so the menus don't
+    # need to import the AI module
+    AI_STYLES_LIST = [
+        ("🎬 Cinematic", "cinematic"),
+        ("🎌 Anime Style", "anime"),
+        ("🎨 Watercolor", "watercolor"),
+        ("🖼️ Oil Painting", "oil_painting"),
+        ("✏️ Pencil Sketch", "sketch"),
+        ("🌆 Neon City", "neon_city"),
+        ("📮 Vintage Poster", "vintage_poster"),
+        ("📸 Professional", "professional"),
+    ]
@@ -1,7 +1,140 @@
 import sqlite3
 import os
-from datetime import datetime, date
+import functools
+from datetime import date
 from config import Config
+from metrics import DB_SECONDS
+
+# Dates are stored as days since 1970-01-01, so the per-edit quota and
+# premium checks are plain integer comparisons
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def epoch_day(day: date = None) -> int:
+    return (day or date.today()).toordinal() - _EPOCH
+
+
+def day_to_str(day: int) -> str:
+    return date.fromordinal(day + _EPOCH).isoformat() if day is not None else None
+
+
+def _timed(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with DB_SECONDS.time(query=method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# ─── MIGRATIONS ────────────────────────────────────────────────────────────────
+# Applied in order, each in its own transaction; PRAGMA user_version holds the
+# last one applied. Never edit a released migration, append a new one.
+
+def _migration_1(conn):
+    """Original schema (TEXT dates); a no-op on databases that predate migrations"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            is_premium INTEGER DEFAULT 0,
+            premium_expiry TEXT,
+            daily_count INTEGER DEFAULT 0,
+            last_reset TEXT,
+            total_edits INTEGER DEFAULT 0,
+            joined_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS edits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            edit_type TEXT,
+            filter_name TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            status TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _migration_2(conn):
+    """users.last_reset / premium_expiry become INTEGER epoch days, indexed"""
+    conn.execute("""
+        CREATE TABLE users_v2 (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            is_premium INTEGER NOT NULL DEFAULT 0,
+            premium_expiry INTEGER,
+            daily_count INTEGER NOT NULL DEFAULT 0,
+            last_reset INTEGER,
+            total_edits INTEGER NOT NULL DEFAULT 0,
+            joined_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # julianday() of a 'YYYY-MM-DD' string minus the Unix epoch's is a whole day count
+    conn.execute("""
+        INSERT INTO users_v2
+        SELECT user_id, username, full_name, COALESCE(is_premium, 0),
+               CAST(julianday(premium_expiry) - 2440587.5 AS INTEGER),
+               COALESCE(daily_count, 0),
+               CAST(julianday(last_reset) - 2440587.5 AS INTEGER),
+               COALESCE(total_edits, 0), joined_at
+        FROM users
+    """)
+    conn.execute("DROP TABLE users")
+    conn.execute("ALTER TABLE users_v2 RENAME TO users")
+    conn.execute("CREATE INDEX idx_users_premium_expiry ON users (premium_expiry) WHERE is_premium = 1")
+    conn.execute("CREATE INDEX idx_users_last_reset ON users (last_reset)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_edits_created_at ON edits (created_at)")
+
+
+def _migration_3(conn):
+    """presets: named edit chains, steps stored "+"-joined as the renderer takes them"""
+    conn.execute("""
+        CREATE TABLE presets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            steps TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, name)
+        )
+    """)
+
+
+MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn) -> int:
+    """Bring the schema up to SCHEMA_VERSION; returns the version found.
+    BEGIN IMMEDIATE serialises replicas starting at the same time."""
+    found = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return found
 
 
 class Database:
@@ -14,39 +147,9 @@ class Database:
 
     def _init_db(self):
         with self._get_conn() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    full_name TEXT,
-                    is_premium INTEGER DEFAULT 0,
-                    premium_expiry TEXT,
-                    daily_count INTEGER DEFAULT 0,
-                    last_reset TEXT,
-                    total_edits INTEGER DEFAULT 0,
-                    joined_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS edits (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    edit_type TEXT,
-                    filter_name TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS payments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount REAL,
-                    status TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
+            migrate(conn)
 
+    @_timed
     def get_or_create_user(self, user_id: int, username: str = "", full_name: str = "") -> dict:
         with self._get_conn() as conn:
             row = conn.execute(
@@ -56,7 +159,7 @@ class Database:
             if not row:
                 conn.execute(
                     "INSERT INTO users (user_id, username, full_name, last_reset) VALUES (?, ?, ?, ?)",
-                    (user_id, username, full_name, str(date.today()))
+                    (user_id, username, full_name, epoch_day())
                 )
                 conn.commit()
                 row = conn.execute(
@@ -66,18 +169,21 @@ class Database:
             return self._row_to_dict(row)
 
     def _row_to_dict(self, row) -> dict:
+        # is_premium is also checked against the expiry here, so an expired
+        # plan reads as free before the sweeper gets to it
         return {
             "user_id": row[0],
             "username": row[1],
             "full_name": row[2],
-            "is_premium": bool(row[3]),
-            "premium_expiry": row[4],
+            "is_premium": bool(row[3]) and (row[4] or 0) >= epoch_day(),
+            "premium_expiry": day_to_str(row[4]),
             "daily_count": row[5],
-            "last_reset": row[6],
+            "last_reset": day_to_str(row[6]),
             "total_edits": row[7],
             "joined_at": row[8],
         }
 
+    @_timed
     def can_edit(self, user_id: int) -> bool:
         with self._get_conn() as conn:
             row = conn.execute(
@@ -89,33 +195,36 @@ class Database:
                 return True
 
             daily_count, last_reset, is_premium, premium_expiry = row
+            today = epoch_day()
 
-            if str(date.today()) != last_reset:
+            if last_reset != today:
                 conn.execute(
                     "UPDATE users SET daily_count = 0, last_reset = ? WHERE user_id = ?",
-                    (str(date.today()), user_id)
+                    (today, user_id)
                 )
                 conn.commit()
                 daily_count = 0
 
-            if is_premium:
-                if premium_expiry and datetime.strptime(premium_expiry, "%Y-%m-%d").date() >= date.today():
-                    return True
+            if is_premium and premium_expiry is not None and premium_expiry >= today:
+                return True
 
             return daily_count < Config.FREE_DAILY_LIMIT
 
-    def increment_edit_count(self, user_id: int, edit_type: str, filter_name: str = ""):
+    @_timed
+    def increment_edit_count(self, user_id: int, edit_type: str, filter_name: str = "", count: int = 1):
+        # count > 1 for albums: every photo is charged, in one transaction
         with self._get_conn() as conn:
             conn.execute(
-                "UPDATE users SET daily_count = daily_count + 1, total_edits = total_edits + 1 WHERE user_id = ?",
-                (user_id,)
+                "UPDATE users SET daily_count = daily_count + ?, total_edits = total_edits + ? WHERE user_id = ?",
+                (count, count, user_id)
             )
-            conn.execute(
+            conn.executemany(
                 "INSERT INTO edits (user_id, edit_type, filter_name) VALUES (?, ?, ?)",
-                (user_id, edit_type, filter_name)
+                [(user_id, edit_type, filter_name)] * count
             )
             conn.commit()
 
+    @_timed
     def get_remaining_edits(self, user_id: int) -> int:
         with self._get_conn() as conn:
             row = conn.execute(
@@ -127,19 +236,19 @@ class Database:
                 return Config.FREE_DAILY_LIMIT
 
             daily_count, last_reset, is_premium, premium_expiry = row
+            today = epoch_day()
 
-            if str(date.today()) != last_reset:
+            if last_reset != today:
                 return Config.FREE_DAILY_LIMIT
 
-            if is_premium and premium_expiry:
-                if datetime.strptime(premium_expiry, "%Y-%m-%d").date() >= date.today():
-                    return Config.PREMIUM_DAILY_LIMIT
+            if is_premium and premium_expiry is not None and premium_expiry >= today:
+                return Config.PREMIUM_DAILY_LIMIT
 
             return max(0, Config.FREE_DAILY_LIMIT - daily_count)
 
+    @_timed
     def set_premium(self, user_id: int, days: int = 30):
-        from datetime import timedelta
-        expiry = (date.today() + timedelta(days=days)).strftime("%Y-%m-%d")
+        expiry = epoch_day() + days
         with self._get_conn() as conn:
             conn.execute(
                 "UPDATE users SET is_premium = 1, premium_expiry = ? WHERE user_id = ?",
@@ -147,21 +256,85 @@ class Database:
             )
             conn.commit()
 
+    @_timed
     def get_stats(self) -> dict:
         with self._get_conn() as conn:
             total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-            premium_users = conn.execute("SELECT COUNT(*) FROM users WHERE is_premium = 1").fetchone()[0]
+            today = epoch_day()
+            premium_users = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE is_premium = 1 AND premium_expiry >= ?", (today,)
+            ).fetchone()[0]
+            active_today = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE last_reset = ? AND daily_count > 0", (today,)
+            ).fetchone()[0]
             total_edits = conn.execute("SELECT SUM(total_edits) FROM users").fetchone()[0] or 0
+            # Range on the raw column so idx_edits_created_at applies
             today_edits = conn.execute(
-                "SELECT COUNT(*) FROM edits WHERE DATE(created_at) = ?", (str(date.today()),)
+                "SELECT COUNT(*) FROM edits WHERE created_at >= ? AND created_at < ?",
+                (day_to_str(today), day_to_str(today + 1))
             ).fetchone()[0]
             return {
                 "total_users": total_users,
                 "premium_users": premium_users,
+                "active_today": active_today,
                 "total_edits": total_edits,
                 "today_edits": today_edits,
             }
 
+    @_timed
+    def expire_premium(self) -> int:
+        """Flip is_premium off for every plan that ran out; returns how many"""
+        with self._get_conn() as conn:
+            cursor = conn.execute(
+                "UPDATE users SET is_premium = 0 WHERE is_premium = 1 AND premium_expiry < ?",
+                (epoch_day(),)
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    @_timed
+    def save_preset(self, user_id: int, name: str, steps: list) -> bool:
+        """Create or overwrite the user's preset called name; False when
+        that would go past PRESET_MAX_PER_USER"""
+        with self._get_conn() as conn:
+            count, exists = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(name = ?), 0) FROM presets WHERE user_id = ?",
+                (name, user_id)
+            ).fetchone()
+            if not exists and count >= Config.PRESET_MAX_PER_USER:
+                return False
+            conn.execute(
+                "INSERT INTO presets (user_id, name, steps) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, name) DO UPDATE SET steps = excluded.steps",
+                (user_id, name, "+".join(steps))
+            )
+            conn.commit()
+            return True
+
+    @_timed
+    def get_presets(self, user_id: int) -> list:
+        with self._get_conn() as conn:
+            rows = conn.execute(
+                "SELECT id, name, steps FROM presets WHERE user_id = ? ORDER BY id", (user_id,)
+            ).fetchall()
+            return [{"id": row[0], "name": row[1], "steps": row[2].split("+")} for row in rows]
+
+    @_timed
+    def get_preset(self, user_id: int, preset_id: int):
+        with self._get_conn() as conn:
+            row = conn.execute(
+                "SELECT id, name, steps FROM presets WHERE id = ? AND user_id = ?", (preset_id, user_id)
+            ).fetchone()
+            return {"id": row[0], "name": row[1], "steps": row[2].split("+")} if row else None
+
+    @_timed
+    def delete_preset(self, user_id: int, name: str) -> bool:
+        with self._get_conn() as conn:
+            cursor = conn.execute("DELETE FROM presets WHERE user_id = ? AND name = ?", (user_id, name))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    @_timed
     def get_all_users(self) -> list:
         with self._get_conn() as conn:
             rows = conn.execute("SELECT user_id FROM users").fetchall()
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from io import BytesIO
+from aiohttp import web
+from PIL import Image
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Photo Editor", "username": "photo_editor_bot"}
+
+
+class FakeBotAPI:
+    """Just enough of the Telegram Bot API to run bot.py against: long-polled
+    getUpdates fed by inject_*(), getFile plus file downloads, and the send /
+    edit / delete calls the bot makes, with added latency and random 429s.
+
+    Every message the bot sends or changes is pushed to a per-chat queue
+    that the load test (loadtest.py) reads like a user watching the chat.
+    Point the bot at it with TELEGRAM_API_URL=http://host:port."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0.0,
+                 retry_after: int = 1, upload_bytes_per_sec: float = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.upload_bytes_per_sec = upload_bytes_per_sec
+
+        self.files: dict = {}
+        self.messages: dict = {}
+        self.events: dict = defaultdict(asyncio.Queue)
+        self.calls: dict = defaultdict(int)
+        self.floods: dict = defaultdict(int)
+        self.uploaded_bytes = 0
+        self.polling = asyncio.Event()
+
+        self._updates: list = []
+        self._new_updates = asyncio.Event()
+        self._update_id = 0
+        self._message_id = 0
+        self._file_id = 0
+        self._runner = None
+
+    # ─── SERVER ────────────────────────────────────────────────────────────
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        server = web.Application(client_max_size=64 * 1024 * 1024)
+        server.router.add_post("/bot{token}/{method}", self._handle_method)
+        server.router.add_get("/file/bot{token}/{path:.+}", self._handle_file)
+        self._runner = web.AppRunner(server)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _handle_method(self, request):
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        self.calls[method] += 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.upload_bytes_per_sec:
+            delay += request.content_length / self.upload_bytes_per_sec if request.content_length else 0
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method != "getUpdates" and random.random() < self.flood_rate:
+            self.floods[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        handler = getattr(self, f"_api_{method}", None)
+        try:
+            result = await handler(params) if handler else True
+        except KeyError as e:
+            return web.json_response(
+                {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}, status=400
+            )
+        return web.json_response({"ok": True, "result": result})
+
+    async def _read_params(self, request) -> dict:
+        """PTB posts form fields (objects JSON-encoded, scalars as plain
+        strings) and uploads as multipart file parts"""
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        form = await request.post()
+        for name, value in form.items():
+            if isinstance(value, web.FileField):
+                data = value.file.read()
+                self.uploaded_bytes += len(data)
+                params[name] = data
+            elif value[:1] in ("{", "["):
+                params[name] = json.loads(value)
+            else:
+                params[name] = value
+        return params
+
+    async def _handle_file(self, request):
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        data = self.files.get(file_id)
+        if data is None:
+            raise web.HTTPNotFound()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(body=data, content_type="application/octet-stream")
+
+    # ─── BOT API METHODS ───────────────────────────────────────────────────
+
+    async def _api_getMe(self, params):
+        return BOT_USER
+
+    async def _api_getUpdates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit") or 100)]
+
+    async def _api_getFile(self, params):
+        file_id = params["file_id"]
+        return {
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_size": len(self.files[file_id]),
+            "file_path": f"photos/{file_id}",
+        }
+
+    async def _api_sendMessage(self, params):
+        return self._new_message(params["chat_id"], params, text=params["text"])
+
+    async def _api_sendPhoto(self, params):
+        return self._new_message(params["chat_id"], params, photo=self._photo(params["photo"]))
+
+    async def _api_sendDocument(self, params):
+        return self._new_message(params["chat_id"], params, document=self._document(params["document"]))
+
+    async def _api_sendMediaGroup(self, params):
+        messages = []
+        for item in params["media"]:
+            media = self._attachment(params, item["media"])
+            message = self._new_message(params["chat_id"], item, photo=self._photo(media))
+            messages.append(message)
+        return messages
+
+    async def _api_editMessageText(self, params):
+        return self._edit(params, text=params["text"])
+
+    async def _api_editMessageCaption(self, params):
+        return self._edit(params, caption=params.get("caption"))
+
+    async def _api_editMessageReplyMarkup(self, params):
+        return self._edit(params)
+
+    async def _api_editMessageMedia(self, params):
+        item = params["media"]
+        media = self._attachment(params, item["media"])
+        if item["type"] == "document":
+            return self._edit(params, ("photo",), caption=item.get("caption"), document=self._document(media))
+        return self._edit(params, ("document",), caption=item.get("caption"), photo=self._photo(media))
+
+    async def _api_deleteMessage(self, params):
+        message = self.messages.pop((int(params["chat_id"]), int(params["message_id"])), None)
+        if message:
+            self._emit("deleteMessage", message)
+        return True
+
+    async def _api_answerCallbackQuery(self, params):
+        return True
+
+    async def _api_sendChatAction(self, params):
+        return True
+
+    # ─── MESSAGES ──────────────────────────────────────────────────────────
+
+    def _attachment(self, params: dict, media):
+        if isinstance(media, str) and media.startswith("attach://"):
+            return params[media[len("attach://"):]]
+        return media
+
+    def _photo(self, media) -> list:
+        if isinstance(media, str):
+            return [{"file_id": media, "file_unique_id": media, "width": 1, "height": 1}]
+        file_id = self.add_file(media)
+        width, height = Image.open(BytesIO(media)).size
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": width,
+                 "height": height, "file_size": len(media)}]
+
+    def _document(self, media) -> dict:
+        file_id = media if isinstance(media, str) else self.add_file(media)
+        return {"file_id": file_id, "file_unique_id": file_id, "file_name": "image.jpg"}
+
+    def _new_message(self, chat_id, params: dict, **content) -> dict:
+        chat_id = int(chat_id)
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            **content,
+        }
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self.messages[(chat_id, self._message_id)] = message
+        self._emit("send", message)
+        return message
+
+    def _edit(self, params: dict, drop: tuple = (), **fields) -> dict:
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        message = self.messages[key]
+        for field in drop:
+            message.pop(field, None)
+        message.update({k: v for k, v in fields.items() if v is not None})
+        if "caption" in fields and fields["caption"] is None:
+            message.pop("caption", None)
+        if "reply_markup" in params:
+            message["reply_markup"] = params["reply_markup"]
+        else:
+            message.pop("reply_markup", None)
+        message["edit_date"] = int(time.time())
+        self._emit("edit", message)
+        return message
+
+    def _emit(self, kind: str, message: dict):
+        self.events[message["chat"]["id"]].put_nowait((time.perf_counter(), kind, dict(message)))
+
+    # ─── USER SIDE ─────────────────────────────────────────────────────────
+
+    def add_file(self, data: bytes) -> str:
+        self._file_id += 1
+        file_id = f"file{self._file_id}"
+        self.files[file_id] = data
+        return file_id
+
+    def _push(self, update: dict):
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def inject_photo(self, user: dict, sizes: list):
+        """User sends a photo; sizes is [(file_id, width, height)] smallest first"""
+        self._message_id += 1
+        self._push({"message": {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private"},
+            "from": user,
+            "photo": [
+                {"file_id": file_id, "file_unique_id": file_id, "width": width,
+                 "height": height, "file_size": len(self.files[file_id])}
+                for file_id, width, height in sizes
+            ],
+        }})
+
+    def inject_callback(self, user: dict, message: dict, data: str):
+        """User taps the button with callback_data data on message"""
+        self._push({"callback_query": {
+            "id": str(random.getrandbits(48)),
+            "from": user,
+            "message": self.messages.get((message["chat"]["id"], message["message_id"]), message),
+            "chat_instance": str(user["id"]),
+            "data": data,
+        }})
+
+    async def next_event(self, chat_id: int, timeout: float) -> tuple:
+        """(perf_counter time, kind, message snapshot) of the bot's next change in the chat"""
+        return await asyncio.wait_for(self.events[chat_id].get(), timeout)
+
+
+def buttons(message: dict) -> list:
+    """callback_data of every inline button on a message"""
+    markup = message.get("reply_markup") or {}
+    return [b.get("callback_data") for row in markup.get("inline_keyboard", []) for b in row]
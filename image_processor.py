@@ -1,13 +1,159 @@
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageDraw
+import logging
+import threading
+from contextlib import contextmanager
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ImageDraw, ImageChops, ImageStat
 from io import BytesIO
 import numpy as np
+from config import Config
+import blur
+import grain
+import image_stats
+import ingest
+import lut_library
+from metrics import STAGE_SECONDS, FILTER_SECONDS
+from tracing import span
 
+logger = logging.getLogger(__name__)
 
-class ImageProcessor:
 
-    def process(self, image_bytes: bytes, action: str) -> bytes:
-        img = Image.open(BytesIO(image_bytes)).convert("RGB")
+def _curve_table(shadows: float, highlights: float, contrast: float = 0.0) -> list:
+    """256-entry tone curve: lift/drop shadows + highlights, optional S-curve"""
+    x = np.linspace(0.0, 1.0, 256, dtype=np.float32)
+    if contrast:
+        x = x + contrast * x * (1.0 - x) * (2.0 * x - 1.0)
+    y = x + shadows * (1.0 - x) ** 2 + highlights * x ** 2
+    return np.clip(y * 255.0, 0, 255).astype(np.uint8).tolist()
+
 
+class ImageProcessor:
+
+    # Per-channel (R, G, B) tone curves used by the AI styles. Built once —
+    # Image.point() with a 768-entry table is the cheapest grade PIL offers.
+    _CINEMATIC_CURVES = (
+        _curve_table(-0.06, 0.06, 0.35)
+        + _curve_table(0.0, 0.0, 0.35)
+        + _curve_table(0.08, -0.08, 0.35)
+    )
+    _NEON_CURVES = (
+        _curve_table(0.06, 0.04, 0.5)
+        + _curve_table(-0.04, -0.04, 0.5)
+        + _curve_table(0.14, 0.06, 0.5)
+    )
+    _PRO_CURVES = (
+        _curve_table(0.0, 0.02, 0.15)
+        + _curve_table(0.0, 0.0, 0.15)
+        + _curve_table(0.0, -0.02, 0.15)
+    )
+    # Warm film stock: R * 1.05 + 5, B * 0.95
+    _FILM_CURVES = (
+        [min(255, int(i * 1.05 + 5)) for i in range(256)]
+        + list(range(256))
+        + [int(i * 0.95) for i in range(256)]
+    )
+
+    # Output encoder profiles, see encode().
+    ENCODE_PROFILES = {
+        # Session cache copy. Every follow-up edit decodes it again, so keep
+        # generation loss low — same settings as the old fixed output.
+        "working": {"format": "JPEG", "quality": 95},
+        # What we send to Telegram. It recompresses photos to roughly q87
+        # 4:2:0 anyway, so anything above that is wasted uplink.
+        "upload": {
+            "format": "JPEG",
+            "quality": 87,
+            "min_quality": 70,
+            "subsampling": "4:2:0",
+            "progressive": True,
+            "optimize": True,
+            "target_bytes": Config.UPLOAD_TARGET_BYTES,
+        },
+        "preview": {"format": "WEBP", "quality": 70, "method": 2},
+    }
+
+    # Actions that only look at each pixel or a small neighbourhood, with the
+    # rows of padding their kernels need. Above TILE_THRESHOLD_PIXELS these
+    # render strip by strip (see _render_tiled); everything else renders whole.
+    TILED_ACTIONS = {
+        **{code: 0 for code in (
+            "warm", "cool", "vintage", "sepia", "bw", "dramatic", "vivid", "fade",
+            "bright", "dark", "retro", "moody", "film", "ocean", "nature", "golden",
+            "pastel", "neon", "popart", "enhance_bright", "enhance_dark",
+            "enhance_contrast", "enhance_saturation",
+        )},
+        "hdr": 2, "sharp": 2, "urban": 2, "portrait": 2, "enhance_sharpen": 2,
+        "enhance_smooth": 4,
+        "soft": 8,
+        "bloom": 48,
+    }
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._encode_stats: dict = {}
+        # Per-thread contrast pivots while a tiled render is running
+        self._tiling = threading.local()
+        # Per-thread decoded source image and its bytes, see _stats
+        self._source = threading.local()
+
+    # Working set of a whole-image render, in uint8 RGB image sizes: source,
+    # result and the filters' float32 temporaries
+    WHOLE_RENDER_COPIES = 8
+
+    def process(self, image_bytes: bytes, action: str, profile: str = "working",
+                max_pixels: int = 0) -> bytes:
+        with self.admit(image_bytes, action, max_pixels) as img:
+            return self.encode(self.render(img, action), profile)
+
+    def process_for_upload(self, image_bytes: bytes, action: str, max_pixels: int = 0) -> tuple:
+        """Render once, return (working bytes for the cache, upload bytes)"""
+        with self.admit(image_bytes, action, max_pixels) as img:
+            img = self.render(img, action)
+            return self.encode(img, "working"), self.encode(img, "upload")
+
+    def process_preview(self, image_bytes: bytes, action: str) -> bytes:
+        """Quick low-resolution render for progressive delivery; JPEG
+        sources decode straight at reduced scale"""
+        with self.admit(image_bytes, action, Config.PREVIEW_MAX_PIXELS) as img:
+            return self.encode(self.render(img, action), "preview")
+
+    @contextmanager
+    def admit(self, image_bytes: bytes, action: str, max_pixels: int = 0):
+        """Check the header, pick the decode size and hold this job's share
+        of the memory budget while the block runs. Inputs above max_pixels
+        (the user's plan cap) are downscaled while decoding; actions that
+        can't render tiled are further capped to what fits the budget."""
+        width, height, fmt = ingest.probe(image_bytes)
+        limit = max_pixels or Config.FREE_MAX_PIXELS
+        if not self._tiled(action):
+            limit = min(limit, ingest.BUDGET.limit // (3 * self.WHOLE_RENDER_COPIES))
+        size = ingest.fit(width, height, limit)
+
+        nbytes = max(
+            self._job_bytes(size[0] * size[1], action),
+            ingest.decode_pixels(width, height, fmt, size) * 3 * 2,
+        )
+        with ingest.BUDGET.reserve(nbytes):
+            with STAGE_SECONDS.time(stage="decode"), span("decode"):
+                img = ingest.decode(image_bytes, size)
+            self._source.img, self._source.image_bytes = img, image_bytes
+            try:
+                yield img
+            finally:
+                self._source.__dict__.clear()
+
+    def _tiled(self, action: str) -> bool:
+        return all(
+            step in self.TILED_ACTIONS or step.startswith(lut_library.LUT_PREFIX) for step in action.split("+")
+        )
+
+    def _job_bytes(self, pixels: int, action: str) -> int:
+        if self._tiled(action) and pixels > Config.TILE_THRESHOLD_PIXELS:
+            return pixels * 3 * 2 + Config.TILE_PIXELS * 3 * self.WHOLE_RENDER_COPIES
+        return pixels * 3 * self.WHOLE_RENDER_COPIES
+
+    def render(self, img: Image.Image, action: str) -> Image.Image:
+        """Apply action to img. action may chain several codes with "+"
+        (a preset): they run back to back on the decoded image, so the
+        chain costs one decode and one encode however long it is."""
         filter_map = {
             "warm": self._warm,
             "cool": self._cool,
@@ -49,21 +195,164 @@ class ImageProcessor:
             "enhance_rotate": self._enhance_rotate,
             "enhance_flip_h": self._enhance_flip_h,
             "enhance_flip_v": self._enhance_flip_v,
+            "cinematic": self._style_cinematic,
+            "anime": self._style_anime,
+            "watercolor": self._style_watercolor,
+            "oil_painting": self._style_oil_painting,
+            "sketch": self._style_sketch,
+            "neon_city": self._style_neon_city,
+            "vintage_poster": self._style_vintage_poster,
+            "professional": self._style_professional,
         }
 
-        if action in filter_map:
-            img = filter_map[action](img)
+        for step in action.split("+"):
+            func, pad, label = filter_map.get(step), self.TILED_ACTIONS.get(step), step
+            if func is None and step.startswith(lut_library.LUT_PREFIX):
+                # Uploaded looks: one label, not one time series per look
+                func, pad, label = self._custom_lut(step), 0, "lut"
+            if func is None:
+                continue
+            with FILTER_SECONDS.time(action=label), span("filter"):
+                if pad is not None and img.width * img.height > Config.TILE_THRESHOLD_PIXELS:
+                    img = self._render_tiled(img, func, pad)
+                else:
+                    img = func(img)
 
-        output = BytesIO()
-        img.save(output, format="JPEG", quality=95)
-        output.seek(0)
-        return output.read()
+        return img
 
-    def _to_bytes(self, img: Image.Image) -> bytes:
+    def _custom_lut(self, code: str):
+        """Render function for an uploaded .cube look, None if it's gone"""
+        lut = lut_library.LIBRARY.filter(code)
+        if lut is None:
+            return None
+        return lambda img: img.filter(lut)
+
+    def _render_tiled(self, img: Image.Image, func, pad: int) -> Image.Image:
+        """Run func over full-width strips of about TILE_PIXELS each, padded
+        by pad rows on both sides, so the filter's temporaries (float32
+        copies and the like) scale with the strip, not the image.
+
+        ImageEnhance.Contrast pivots on the whole image's mean grey, which a
+        strip can't know, so func first runs on a ~1 MP proxy to record those
+        means and each strip replays them (see _contrast)."""
+        w, h = img.size
+        # Whole grain tiles per strip keeps the grain pattern continuous
+        rows = max(1, Config.TILE_PIXELS // w // grain.TILE_SIZE) * grain.TILE_SIZE
+
+        factor = max(1, int((w * h / 1_000_000) ** 0.5))
+        self._tiling.means = []
+        try:
+            func(img.reduce(factor))
+            means = self._tiling.means
+
+            out = Image.new("RGB", (w, h))
+            for top in range(0, h, rows):
+                bottom = min(h, top + rows)
+                y0, y1 = max(0, top - pad), min(h, bottom + pad)
+                self._tiling.replay = iter(means)
+                strip = func(img.crop((0, y0, w, y1)))
+                out.paste(strip.crop((0, top - y0, w, bottom - y0)), (0, top))
+            return out
+        finally:
+            self._tiling.__dict__.clear()
+
+    def _stats(self, img: Image.Image) -> image_stats.ImageStats:
+        """Statistics of img: the shared cache entry of its image version
+        when img is the decoded source itself, else computed for img alone
+        (any earlier step in the render made it a new version)"""
+        if img is getattr(self._source, "img", None):
+            return image_stats.CACHE.get(image_stats.key(self._source.image_bytes, img.size), img)
+        return image_stats.ImageStats(img)
+
+    def _contrast(self, img: Image.Image, factor: float) -> Image.Image:
+        """Same as ImageEnhance.Contrast(img).enhance(factor), except that
+        inside _render_tiled the mean grey comes from the whole image"""
+        replay = getattr(self._tiling, "replay", None)
+        if replay is not None:
+            mean = next(replay)
+        elif img is getattr(self._source, "img", None):
+            mean = int(self._stats(img).mean("L") + 0.5)
+        else:
+            mean = int(ImageStat.Stat(img.convert("L")).mean[0] + 0.5)
+            recorded = getattr(self._tiling, "means", None)
+            if recorded is not None:
+                recorded.append(mean)
+        degenerate = Image.new("L", img.size, mean).convert(img.mode)
+        return Image.blend(degenerate, img, factor)
+
+    # ─── ENCODER ───────────────────────────────────────────────────────────
+
+    def encode(self, img: Image.Image, profile: str = "upload") -> bytes:
+        opts = self.ENCODE_PROFILES[profile]
+        with STAGE_SECONDS.time(stage="encode"), span(f"encode_{profile}"):
+            if opts["format"] == "WEBP":
+                data = self._save(img, format="WEBP", quality=opts["quality"], method=opts.get("method", 4))
+            else:
+                data = self._encode_jpeg(img, opts)
+        self._record_encode(img, profile, data)
+        return data
+
+    def _save(self, img: Image.Image, **params) -> bytes:
         output = BytesIO()
-        img.save(output, format="JPEG", quality=95)
-        output.seek(0)
-        return output.read()
+        img.save(output, **params)
+        return output.getvalue()
+
+    def _encode_jpeg(self, img: Image.Image, opts: dict) -> bytes:
+        params = {"format": "JPEG", "quality": opts["quality"]}
+        if "subsampling" in opts:
+            params["subsampling"] = opts["subsampling"]
+        final = dict(params, progressive=opts.get("progressive", False), optimize=opts.get("optimize", False))
+
+        target = opts.get("target_bytes")
+        if not target or len(self._save(img, **params)) <= target:
+            return self._save(img, **final)
+
+        # Binary search the highest quality that fits. Probes are plain
+        # baseline encodes (fast); the final progressive/optimized encode only
+        # ever comes out smaller than its probe.
+        lo, hi = opts.get("min_quality", 50), opts["quality"] - 1
+        best = lo
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if len(self._save(img, **dict(params, quality=mid))) <= target:
+                best, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+        return self._save(img, **dict(final, quality=best))
+
+    def _record_encode(self, img: Image.Image, profile: str, data: bytes):
+        with self._stats_lock:
+            stats = self._encode_stats.setdefault(
+                profile, {"count": 0, "bytes": 0, "sampled_bytes": 0, "baseline_bytes": 0}
+            )
+            stats["count"] += 1
+            stats["bytes"] += len(data)
+            sample = profile != "working" and stats["count"] % Config.ENCODE_BASELINE_EVERY == 1
+
+        if sample:
+            # Compare against the old fixed quality=95 output now and then
+            baseline = len(self._save(img, format="JPEG", quality=95))
+            with self._stats_lock:
+                stats["sampled_bytes"] += len(data)
+                stats["baseline_bytes"] += baseline
+            logger.info(
+                f"Encoder [{profile}]: {len(data) / 1024:.0f} KB vs {baseline / 1024:.0f} KB at q95 "
+                f"({100 * (1 - len(data) / baseline):.0f}% saved)"
+            )
+
+    def encode_report(self) -> dict:
+        """Per-profile output sizes and estimated bytes saved vs q95"""
+        report = {}
+        with self._stats_lock:
+            for profile, stats in self._encode_stats.items():
+                ratio = stats["sampled_bytes"] / stats["baseline_bytes"] if stats["baseline_bytes"] else 1.0
+                report[profile] = {
+                    "count": stats["count"],
+                    "avg_bytes": stats["bytes"] // max(1, stats["count"]),
+                    "saved_pct": round(100 * (1 - ratio), 1),
+                    "bytes_saved": int(stats["bytes"] / ratio - stats["bytes"]) if ratio else 0,
+                }
+        return report
 
     # ─── FILTERS ───────────────────────────────────────────────────────────
 
@@ -97,8 +386,7 @@ class ImageProcessor:
 
     def _vintage(self, img: Image.Image) -> Image.Image:
         img = self._sepia(img)
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(0.85)
+        img = self._contrast(img, 0.85)
         enhancer = ImageEnhance.Brightness(img)
         img = enhancer.enhance(0.9)
         arr = np.array(img, dtype=np.float32)
@@ -106,8 +394,7 @@ class ImageProcessor:
         return Image.fromarray(arr.astype(np.uint8))
 
     def _dramatic(self, img: Image.Image) -> Image.Image:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.8)
+        img = self._contrast(img, 1.8)
         enhancer = ImageEnhance.Brightness(img)
         img = enhancer.enhance(0.85)
         enhancer = ImageEnhance.Color(img)
@@ -117,13 +404,11 @@ class ImageProcessor:
     def _vivid(self, img: Image.Image) -> Image.Image:
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(1.9)
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.2)
+        img = self._contrast(img, 1.2)
         return img
 
     def _fade(self, img: Image.Image) -> Image.Image:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(0.7)
+        img = self._contrast(img, 0.7)
         enhancer = ImageEnhance.Brightness(img)
         img = enhancer.enhance(1.15)
         enhancer = ImageEnhance.Color(img)
@@ -139,8 +424,7 @@ class ImageProcessor:
         return enhancer.enhance(0.65)
 
     def _hdr(self, img: Image.Image) -> Image.Image:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.5)
+        img = self._contrast(img, 1.5)
         enhancer = ImageEnhance.Sharpness(img)
         img = enhancer.enhance(2.0)
         enhancer = ImageEnhance.Color(img)
@@ -148,7 +432,7 @@ class ImageProcessor:
         return img
 
     def _soft(self, img: Image.Image) -> Image.Image:
-        return img.filter(ImageFilter.GaussianBlur(radius=1.2))
+        return blur.pyramid_blur(img, 1.2)
 
     def _sharp(self, img: Image.Image) -> Image.Image:
         enhancer = ImageEnhance.Sharpness(img)
@@ -158,32 +442,24 @@ class ImageProcessor:
         img = self._warm(img)
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(0.8)
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.1)
-        arr = np.array(img, dtype=np.float32)
-        noise = np.random.randint(-10, 10, arr.shape, dtype=np.int16)
-        arr = np.clip(arr.astype(np.int16) + noise, 0, 255)
-        return Image.fromarray(arr.astype(np.uint8))
+        img = self._contrast(img, 1.1)
+        return grain.apply_preset(img, "retro")
 
     def _moody(self, img: Image.Image) -> Image.Image:
         img = self._cool(img)
         enhancer = ImageEnhance.Brightness(img)
         img = enhancer.enhance(0.8)
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.3)
+        img = self._contrast(img, 1.3)
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(0.85)
         return img
 
     def _film(self, img: Image.Image) -> Image.Image:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.2)
+        img = self._contrast(img, 1.2)
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(0.9)
-        arr = np.array(img, dtype=np.float32)
-        arr[:, :, 0] = np.clip(arr[:, :, 0] * 1.05 + 5, 0, 255)
-        arr[:, :, 2] = np.clip(arr[:, :, 2] * 0.95, 0, 255)
-        return Image.fromarray(arr.astype(np.uint8))
+        img = img.point(self._FILM_CURVES)
+        return grain.apply_preset(img, "film")
 
     def _ocean(self, img: Image.Image) -> Image.Image:
         arr = np.array(img, dtype=np.float32)
@@ -220,16 +496,14 @@ class ImageProcessor:
     def _neon(self, img: Image.Image) -> Image.Image:
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(3.0)
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.5)
+        img = self._contrast(img, 1.5)
         enhancer = ImageEnhance.Brightness(img)
         return enhancer.enhance(0.9)
 
     def _popart(self, img: Image.Image) -> Image.Image:
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(4.0)
-        enhancer = ImageEnhance.Contrast(img)
-        return enhancer.enhance(2.0)
+        return self._contrast(img, 2.0)
 
     def _portrait(self, img: Image.Image) -> Image.Image:
         enhancer = ImageEnhance.Color(img)
@@ -242,20 +516,15 @@ class ImageProcessor:
         return img.filter(ImageFilter.SMOOTH)
 
     def _urban(self, img: Image.Image) -> Image.Image:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.4)
+        img = self._contrast(img, 1.4)
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(0.85)
         enhancer = ImageEnhance.Sharpness(img)
         return enhancer.enhance(1.5)
 
     def _bloom(self, img: Image.Image) -> Image.Image:
-        blurred = img.filter(ImageFilter.GaussianBlur(radius=8))
-        arr_orig = np.array(img, dtype=np.float32)
-        arr_blur = np.array(blurred, dtype=np.float32)
-        arr = np.clip(arr_orig + arr_blur * 0.3, 0, 255)
-        img2 = Image.fromarray(arr.astype(np.uint8))
-        enhancer = ImageEnhance.Color(img2)
+        img = blur.glow(img, radius=8, amount=0.3)
+        enhancer = ImageEnhance.Color(img)
         return enhancer.enhance(1.2)
 
     # ─── CROPS ─────────────────────────────────────────────────────────────
@@ -294,7 +563,7 @@ class ImageProcessor:
     # ─── ENHANCEMENTS ──────────────────────────────────────────────────────
 
     def _enhance_auto(self, img: Image.Image) -> Image.Image:
-        img = ImageOps.autocontrast(img, cutoff=1)
+        img = img.point(self._stats(img).autocontrast_lut(cutoff=1))
         enhancer = ImageEnhance.Color(img)
         img = enhancer.enhance(1.1)
         enhancer = ImageEnhance.Sharpness(img)
@@ -307,7 +576,7 @@ class ImageProcessor:
         return ImageEnhance.Brightness(img).enhance(0.7)
 
     def _enhance_contrast(self, img: Image.Image) -> Image.Image:
-        return ImageEnhance.Contrast(img).enhance(1.5)
+        return self._contrast(img, 1.5)
 
     def _enhance_saturation(self, img: Image.Image) -> Image.Image:
         return ImageEnhance.Color(img).enhance(1.6)
@@ -326,3 +595,78 @@ class ImageProcessor:
 
     def _enhance_flip_v(self, img: Image.Image) -> Image.Image:
         return ImageOps.flip(img)
+
+    # ─── AI STYLES ─────────────────────────────────────────────────────────
+    # Local CPU versions of Config.AI_STYLES_LIST. Large blurs go through
+    # the blur pyramid, so each style stays well under ~500 ms at 2 MP.
+
+    def _edge_mask(self, img: Image.Image, gain: float = 4.0) -> Image.Image:
+        """0-255 "L" mask, bright on edges"""
+        edges = img.convert("L").filter(ImageFilter.FIND_EDGES)
+        return edges.point(lambda v: min(255, int(v * gain)))
+
+    def _edge_preserving_smooth(self, img: Image.Image, radius: float) -> Image.Image:
+        # Blur flat areas, keep the original pixels where the edge mask is
+        # strong — a cheap stand-in for a bilateral filter.
+        blurred = blur.pyramid_blur(img, radius)
+        mask = self._edge_mask(img).filter(ImageFilter.BoxBlur(int(radius)))
+        mask = mask.point(lambda v: min(255, v * 8))
+        return Image.composite(img, blurred, mask)
+
+    def _ink_lines(self, img: Image.Image, source: Image.Image, threshold: int,
+                   color=(20, 20, 20)) -> Image.Image:
+        lines = self._edge_mask(source, gain=2.0).point(lambda v: 255 if v > threshold else 0)
+        return Image.composite(Image.new("RGB", img.size, color), img, lines)
+
+    def _style_cinematic(self, img: Image.Image) -> Image.Image:
+        img = img.point(self._CINEMATIC_CURVES)
+        return ImageEnhance.Color(img).enhance(0.85)
+
+    def _style_anime(self, img: Image.Image) -> Image.Image:
+        smooth = self._edge_preserving_smooth(img, radius=4)
+        flat = ImageOps.posterize(smooth, 3)
+        flat = Image.blend(smooth, flat, 0.6)
+        flat = ImageEnhance.Color(flat).enhance(1.4)
+        return self._ink_lines(flat, img, threshold=90)
+
+    def _style_watercolor(self, img: Image.Image) -> Image.Image:
+        wash = self._edge_preserving_smooth(img, radius=6)
+        wash = ImageEnhance.Color(wash).enhance(1.15)
+        wash = ImageEnhance.Brightness(wash).enhance(1.08)
+        # Pigment pooling: darken softly along edges
+        pooling = ImageOps.invert(self._edge_mask(img, gain=1.5)).filter(ImageFilter.BoxBlur(2))
+        return ImageChops.multiply(wash, Image.merge("RGB", (pooling, pooling, pooling)))
+
+    def _style_oil_painting(self, img: Image.Image) -> Image.Image:
+        paint = self._edge_preserving_smooth(img, radius=5)
+        paint = ImageOps.posterize(paint, 5)
+        paint = ImageEnhance.Color(paint).enhance(1.3)
+        return paint.filter(ImageFilter.EDGE_ENHANCE)
+
+    def _style_sketch(self, img: Image.Image) -> Image.Image:
+        # Colour dodge of the grayscale over its blurred negative
+        gray = img.convert("L")
+        blur_inv = blur.pyramid_blur(ImageOps.invert(gray), radius=10)
+        g = np.asarray(gray, dtype=np.uint16)
+        b = np.asarray(blur_inv, dtype=np.uint16)
+        sketch = np.minimum(255, (g << 8) // (256 - b))
+        return Image.fromarray(sketch.astype(np.uint8)).convert("RGB")
+
+    def _style_neon_city(self, img: Image.Image) -> Image.Image:
+        base = ImageEnhance.Brightness(img.point(self._NEON_CURVES)).enhance(0.6)
+        edges = ImageEnhance.Color(img.filter(ImageFilter.FIND_EDGES)).enhance(3.0)
+        edges = ImageEnhance.Brightness(edges).enhance(2.5)
+        glow = blur.pyramid_blur(edges, radius=6)
+        return ImageChops.screen(base, ImageChops.add(edges, glow))
+
+    def _style_vintage_poster(self, img: Image.Image) -> Image.Image:
+        smooth = self._edge_preserving_smooth(img, radius=3)
+        gray = ImageOps.autocontrast(smooth.convert("L"), cutoff=2)
+        toned = ImageOps.colorize(gray, black="#1d2b44", mid="#c8553d", white="#f2e3c6")
+        return ImageOps.posterize(toned, 3)
+
+    def _style_professional(self, img: Image.Image) -> Image.Image:
+        img = img.point(self._stats(img).autocontrast_lut(cutoff=0.5, preserve_tone=True))
+        img = img.point(self._PRO_CURVES)
+        img = ImageEnhance.Color(img).enhance(1.08)
+        return img.filter(ImageFilter.UnsharpMask(radius=2, percent=60, threshold=3))
@@ -0,0 +1,137 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from config import Config
+from metrics import REGISTRY
+
+IMAGE_STATS_LOOKUPS = REGISTRY.counter(
+    "editor_image_stats_lookups_total", "Image statistics cache reads", ("result",)
+)
+
+# Histograms come off a copy of at most this many pixels, every n-th pixel
+# of every n-th row: unlike averaging (reduce, draft decoding) sampling
+# keeps the spread, so percentiles stay within a level of the full image's
+PROXY_PIXELS = 1_000_000
+
+
+def version(image_bytes: bytes) -> bytes:
+    """Digest of one image version: a new edit means new bytes"""
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+
+def key(image_bytes: bytes, size: tuple) -> tuple:
+    """Cache key of one version decoded at size. The same bytes decoded
+    at preview size (JPEG draft mode averages pixels) have a narrower
+    histogram than at full size, so each decode size gets its own entry."""
+    return version(image_bytes), tuple(size)
+
+
+class ImageStats:
+    """Per-channel, luminance and saturation histograms of one image and
+    what derives from them. Nothing is scanned until the first read; then
+    one pass over a <= PROXY_PIXELS copy fills everything and the image
+    reference is dropped, so a cached entry is a few KB."""
+
+    def __init__(self, img: Image.Image):
+        self._img = img
+        self._lock = threading.Lock()
+        self._rgb = self._luma = self._saturation = None
+
+    def _load(self):
+        with self._lock:
+            if self._img is None:
+                return
+            img = self._img
+            step = int((img.width * img.height / PROXY_PIXELS) ** 0.5)
+            if step > 1:
+                img = img.resize((img.width // step, img.height // step), Image.NEAREST)
+            img = img.convert("RGB")
+            self._rgb = np.array(img.histogram(), dtype=np.int64).reshape(3, 256)
+            self._luma = np.array(img.convert("L").histogram(), dtype=np.int64)
+            # Same values as convert("HSV")'s S band at a quarter of the cost
+            r, g, b = (np.asarray(band) for band in img.split())
+            top = np.maximum(np.maximum(r, g), b)
+            spread = top - np.minimum(np.minimum(r, g), b)
+            saturation = spread.astype(np.uint16) * 255 // np.maximum(top, 1)
+            self._saturation = np.bincount(saturation.ravel(), minlength=256)
+            self._img = None
+
+    def histogram(self, channel: str = "L") -> np.ndarray:
+        """256 bins of "R", "G", "B", "L" (luminance) or "S" (HSV saturation)"""
+        self._load()
+        if channel == "L":
+            return self._luma
+        if channel == "S":
+            return self._saturation
+        return self._rgb["RGB".index(channel)]
+
+    def percentile(self, q: float, channel: str = "L") -> int:
+        """Level below which q percent of the pixels fall"""
+        cdf = np.cumsum(self.histogram(channel))
+        return int(np.searchsorted(cdf, cdf[-1] * q / 100))
+
+    def mean(self, channel: str = "L") -> float:
+        hist = self.histogram(channel)
+        return float(np.dot(hist, np.arange(256)) / max(1, hist.sum()))
+
+    def clipped(self, dark: int = 4, light: int = 251) -> tuple:
+        """Fractions of pixels at or below dark and at or above light"""
+        hist = self.histogram("L")
+        total = max(1, hist.sum())
+        return float(hist[:dark + 1].sum() / total), float(hist[light:].sum() / total)
+
+    def autocontrast_lut(self, cutoff: float = 0, preserve_tone: bool = False) -> list:
+        """The table ImageOps.autocontrast(img, cutoff, preserve_tone=...)
+        would build for this image, for img.point()"""
+        layers = [self.histogram("L")] if preserve_tone else [self.histogram(c) for c in "RGB"]
+        lut = []
+        for hist in layers:
+            cut = hist.sum() * cutoff // 100
+            lo = int(np.argmax(np.cumsum(hist) > cut))
+            hi = 255 - int(np.argmax(np.cumsum(hist[::-1]) > cut))
+            if hi <= lo:
+                lut.extend(range(256))
+                continue
+            scale = 255.0 / (hi - lo)
+            lut.extend(np.clip((np.arange(256) * scale - lo * scale).astype(np.int64), 0, 255).tolist())
+        # One luminance curve drives all three bands
+        return lut * 3 if preserve_tone else lut
+
+
+class StatsCache:
+    """ImageStats by key() (image version and decoded size), least
+    recently used dropped past max_entries. The session keeps the current
+    bytes, so repeated renders of a version at one size, a re-render after
+    Start Over and every tone operation on it share one entry; an edit
+    makes new bytes and with them a new key. A preview and the full render
+    of the same version decode to different sizes and never share one."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key: tuple):
+        """The cached entry, without creating one"""
+        with self._lock:
+            stats = self._entries.get(key)
+        IMAGE_STATS_LOOKUPS.inc(result="miss" if stats is None else "hit")
+        return stats
+
+    def get(self, key: tuple, img: Image.Image) -> ImageStats:
+        with self._lock:
+            stats = self._entries.get(key)
+            if stats is not None:
+                self._entries.move_to_end(key)
+                IMAGE_STATS_LOOKUPS.inc(result="hit")
+                return stats
+            stats = self._entries[key] = ImageStats(img)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        IMAGE_STATS_LOOKUPS.inc(result="miss")
+        return stats
+
+
+CACHE = StatsCache(Config.IMAGE_STATS_CACHE_SIZE)
@@ -0,0 +1,124 @@
+import math
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+from config import Config
+from metrics import REGISTRY
+
+INGEST_REJECTED = REGISTRY.counter(
+    "editor_ingest_rejected_total", "Images refused before decoding", ("reason",)
+)
+
+
+class ImageRejected(Exception):
+    """Input refused before (or instead of) a full decode; str() is shown to the user"""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+        INGEST_REJECTED.inc(reason=reason)
+
+
+def probe(image_bytes: bytes) -> tuple:
+    """(width, height, format) from the header only, nothing is decoded"""
+    # PIL loads with the first image, not with bot.py's import of
+    # ImageRejected, so startup doesn't pay for it
+    from PIL import Image
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            width, height = img.size
+            fmt = img.format
+    except Image.DecompressionBombError:
+        raise ImageRejected("Image bahut bari hai, chhoti image bhejo.", "bomb")
+    except Exception:
+        raise ImageRejected("Yeh file image nahi lagti. JPG ya PNG bhejo.", "unreadable")
+
+    if width * height > Config.MAX_INPUT_PIXELS:
+        raise ImageRejected(
+            f"Image bahut bari hai ({width}×{height}). "
+            f"Max {Config.MAX_INPUT_PIXELS // 1_000_000} MP tak bhejo.",
+            "too_many_pixels",
+        )
+    return width, height, fmt
+
+
+def fit(width: int, height: int, max_pixels: int) -> tuple:
+    """Largest size with the same aspect ratio and at most max_pixels"""
+    if not max_pixels or width * height <= max_pixels:
+        return width, height
+    scale = math.sqrt(max_pixels / (width * height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def decode_pixels(width: int, height: int, fmt: str, size: tuple) -> int:
+    """Pixels held while decoding to size: JPEG draft mode decodes straight
+    at 1/2, 1/4 or 1/8 scale, anything else is decoded full size first"""
+    if size == (width, height):
+        return width * height
+    if fmt == "JPEG":
+        return min(width * height, 4 * size[0] * size[1])
+    return width * height
+
+
+def decode(image_bytes: bytes, size: tuple):
+    """Decode to an RGB PIL image of exactly size (as returned by fit)"""
+    from PIL import Image
+    img = Image.open(BytesIO(image_bytes))
+    if img.size != tuple(size):
+        img.draft("RGB", size)
+        img = img.resize(size, Image.BICUBIC, reducing_gap=2.0)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.load()
+    return img
+
+
+def open_image(image_bytes: bytes, max_pixels: int):
+    width, height, _ = probe(image_bytes)
+    return decode(image_bytes, fit(width, height, max_pixels))
+
+
+class MemoryBudget:
+    """Estimated bytes held by in-flight image jobs across the processing
+    pool. A job that doesn't fit waits for others to finish, up to
+    timeout seconds, then is rejected."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int, timeout: float = None):
+        if nbytes > self.limit:
+            raise ImageRejected("Image is effect ke liye bahut bari hai.", "over_budget")
+        if timeout is None:
+            timeout = Config.INGEST_QUEUE_SECONDS
+
+        with self._cond:
+            self.waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: self.in_use + nbytes <= self.limit, timeout):
+                    raise ImageRejected("Server abhi busy hai, thori dair baad try karo.", "busy")
+            finally:
+                self.waiting -= 1
+            self.in_use += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= nbytes
+                self._cond.notify_all()
+
+
+BUDGET = MemoryBudget(Config.MEMORY_BUDGET_MB * 1024 * 1024)
+
+REGISTRY.gauge(
+    "editor_ingest_budget_bytes", "Estimated bytes reserved by in-flight image jobs",
+    callback=lambda: BUDGET.in_use
+)
+REGISTRY.gauge(
+    "editor_ingest_budget_waiting", "Image jobs waiting for memory budget",
+    callback=lambda: BUDGET.waiting
+)
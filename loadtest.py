@@ -0,0 +1,200 @@
+"""End-to-end load test: runs bot.py against a local fake Bot API server and
+drives it with simulated users.
+
+    python loadtest.py --rate 2 --duration 60 --latency 0.05 --flood 0.01
+
+Each simulated user sends a photo, waits for the menu, then taps
+Filters -> a random filter as many times as --edits, always acting on what
+the bot actually sent. Users arrive at --rate per second (Poisson), so
+queueing shows up as latency rather than as a slower arrival rate.
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from config import Config
+from fake_bot_api import FakeBotAPI, buttons
+
+FILTERS = [code for _, code in Config.FILTERS_LIST]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict = {}
+        self.sessions = 0
+        self.edits = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def record(self, name: str, seconds: float):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    @staticmethod
+    def percentiles(values: list) -> dict:
+        values = sorted(values)
+        pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+        return {"count": len(values), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1]}
+
+
+def make_photo(width: int, height: int) -> dict:
+    """Telegram-style PhotoSize tiers of one synthetic photo, as JPEG bytes"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=2)
+    noise = rng.integers(-20, 20, base.shape)
+    img = Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+    tiers = {}
+    for side in (90, 320, 800, 1280, 2560):
+        if side >= max(width, height):
+            break
+        scale = side / max(width, height)
+        tiers[side] = img.resize((int(width * scale), int(height * scale)), Image.BILINEAR)
+    tiers[max(width, height)] = img
+    photos = {}
+    for side, tier in tiers.items():
+        output = BytesIO()
+        tier.save(output, format="JPEG", quality=87)
+        photos[tier.size] = output.getvalue()
+    return photos
+
+
+async def wait_for(api: FakeBotAPI, chat_id: int, predicate, timeout: float) -> tuple:
+    """Next message the bot sent or changed in the chat that matches
+    predicate(message); deletions are skipped"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        at, kind, message = await api.next_event(chat_id, max(0.0, deadline - time.perf_counter()))
+        if kind != "deleteMessage" and predicate(message):
+            return at, message
+
+
+def _has_image(message) -> bool:
+    return bool(message.get("photo") or message.get("document"))
+
+
+async def simulate_user(api: FakeBotAPI, user_id: int, sizes: list, args, stats: Stats):
+    user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+    try:
+        started = time.perf_counter()
+        api.inject_photo(user, sizes)
+        at, menu = await wait_for(api, user_id, lambda m: "menu_filters" in buttons(m), args.timeout)
+        stats.record("photo_to_menu", at - started)
+
+        for _ in range(args.edits):
+            tapped = time.perf_counter()
+            api.inject_callback(user, menu, "menu_filters")
+            at, screen = await wait_for(
+                api, user_id, lambda m: any(b and b.startswith("filter_") for b in buttons(m)), args.timeout
+            )
+            stats.record("menu_tap", at - tapped)
+
+            tapped = time.perf_counter()
+            api.inject_callback(user, screen, f"filter_{random.choice(FILTERS)}")
+            at, menu = await wait_for(api, user_id, _has_image, args.timeout)
+            stats.record("first_pixel", at - tapped)
+            # Progressive delivery sends a preview first and swaps in full
+            # resolution with the final caption
+            while not (menu.get("caption") or "").startswith("✅"):
+                at, menu = await wait_for(api, user_id, _has_image, args.timeout)
+            stats.record("edit_done", at - tapped)
+            stats.edits += 1
+        stats.sessions += 1
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+    except Exception as e:
+        stats.errors += 1
+        print(f"user {user_id}: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+def spawn_bot(args, workdir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="1000:LOADTEST",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.port}",
+        DB_PATH=os.path.join(workdir, "loadtest.db"),
+        SESSION_DB_PATH=os.path.join(workdir, "sessions.db"),
+        PROFILE_DIR=os.path.join(workdir, "profiles"),
+        LUT_DIR=os.path.join(workdir, "luts"),
+        WEBHOOK_URL="",
+        METRICS_PORT="0",
+    )
+    log = open(os.path.join(workdir, "bot.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def report(stats: Stats, api: FakeBotAPI, elapsed: float):
+    print(f"\n{stats.sessions} sessions, {stats.edits} edits in {elapsed:.1f} s "
+          f"→ {stats.edits / elapsed:.2f} edits/s")
+    print(f"timeouts {stats.timeouts}, errors {stats.errors}")
+    print(f"\n{'stage':<14}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}   (ms)")
+    for name, values in stats.latencies.items():
+        p = Stats.percentiles(values)
+        print(f"{name:<14}{p['count']:>7}{p['p50'] * 1000:>9.0f}{p['p90'] * 1000:>9.0f}"
+              f"{p['p99'] * 1000:>9.0f}{p['max'] * 1000:>9.0f}")
+    calls = ", ".join(f"{m} {n}" for m, n in sorted(api.calls.items(), key=lambda c: -c[1]))
+    print(f"\nBot API calls: {calls}")
+    print(f"Injected 429s: {sum(api.floods.values())}, uploaded {api.uploaded_bytes / 1024 / 1024:.1f} MB")
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, flood_rate=args.flood,
+                     upload_bytes_per_sec=args.upload_mbps * 125_000)
+    await api.start(port=args.port)
+
+    width, height = (int(v) for v in args.photo.split("x"))
+    sizes = [(api.add_file(data), w, h) for (w, h), data in make_photo(width, height).items()]
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    bot = None if args.no_spawn else spawn_bot(args, workdir)
+    try:
+        print(f"Waiting for the bot to poll (log: {workdir}/bot.log)...")
+        await asyncio.wait_for(api.polling.wait(), 120)
+
+        stats = Stats()
+        users = []
+        started = time.perf_counter()
+        user_id = 1
+        while time.perf_counter() - started < args.duration:
+            users.append(asyncio.create_task(simulate_user(api, user_id, sizes, args, stats)))
+            user_id += 1
+            await asyncio.sleep(random.expovariate(args.rate))
+        await asyncio.gather(*users)
+        report(stats, api, time.perf_counter() - started)
+    finally:
+        if bot:
+            # SIGINT is PTB's clean stop; it finishes the current long poll first
+            bot.send_signal(signal.SIGINT)
+            bot.wait(60)
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=1.0, help="new users per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to keep adding users")
+    parser.add_argument("--edits", type=int, default=3, help="filter edits per user")
+    parser.add_argument("--photo", default="1280x960", help="largest photo tier, WxH")
+    parser.add_argument("--latency", type=float, default=0.05, help="added seconds per API call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="extra random latency, seconds")
+    parser.add_argument("--flood", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="simulated uplink, 0 = unlimited")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds a user waits for the bot")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--no-spawn", action="store_true",
+                        help="don't start bot.py; run it yourself with TELEGRAM_API_URL pointing here")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
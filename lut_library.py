@@ -0,0 +1,187 @@
+import json
+import os
+import re
+import threading
+from config import Config
+
+LUT_PREFIX = "lut_"
+
+# .lut file: MAGIC, the cube size as one byte, 3 zero bytes, then size**3
+# RGB triples as little-endian uint16 (0-65535), red varying fastest like
+# .cube and PIL's Color3DLUT
+MAGIC = b"LUT3"
+HEADER_BYTES = 8
+MIN_SIZE, MAX_SIZE = 2, 65
+MAX_CUBE_BYTES = 16 * 1024 * 1024
+
+
+class InvalidLut(Exception):
+    """The .cube file can't be used; the message is shown to the admin"""
+
+
+def parse_cube(text: str) -> tuple:
+    """(title, size, float32 table of size**3 x 3 in 0..1) from .cube text"""
+    # numpy only loads on upload/apply; listing the looks stays light
+    import numpy as np
+
+    title, size = "", None
+    domain_min, domain_max = [0.0] * 3, [1.0] * 3
+    rows = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if not (line[0].isalpha() or line[0] == "_"):
+            rows.append(line)
+            continue
+        key, _, rest = line.replace("\t", " ").partition(" ")
+        rest = rest.strip()
+        try:
+            if key == "TITLE":
+                title = rest.strip('"')
+            elif key == "LUT_3D_SIZE":
+                size = int(rest)
+            elif key == "LUT_1D_SIZE":
+                raise InvalidLut("1D LUT hai — sirf 3D (.cube LUT_3D_SIZE) LUTs chalte hain.")
+            elif key == "DOMAIN_MIN":
+                domain_min = [float(v) for v in rest.split()]
+            elif key == "DOMAIN_MAX":
+                domain_max = [float(v) for v in rest.split()]
+        except ValueError:
+            raise InvalidLut(f"{key} ki value galat hai: {rest[:40]}")
+
+    if size is None:
+        raise InvalidLut("LUT_3D_SIZE nahi mila — yeh .cube 3D LUT nahi lagta.")
+    if not MIN_SIZE <= size <= MAX_SIZE:
+        raise InvalidLut(f"LUT size {size} support nahi hai ({MIN_SIZE}-{MAX_SIZE} chahiye).")
+    if domain_min != [0.0] * 3 or domain_max != [1.0] * 3:
+        raise InvalidLut("Sirf 0-1 DOMAIN wale LUTs chalte hain.")
+
+    try:
+        table = np.array(" ".join(rows).split(), dtype=np.float32)
+    except ValueError:
+        raise InvalidLut("LUT data mein number ke ilawa kuch hai.")
+    if table.size != size ** 3 * 3:
+        raise InvalidLut(f"{size}³ LUT ke liye {size ** 3} rows chahiye, {table.size // 3} mili.")
+    if not np.isfinite(table).all():
+        raise InvalidLut("LUT data mein NaN/inf values hain.")
+    # Many grading LUTs overshoot 0..1 slightly; the output can't
+    return title, size, np.clip(table, 0.0, 1.0).reshape(-1, 3)
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")[:40] or "look"
+
+
+class LutLibrary:
+    """Custom .cube looks on disk. index.json lists them; each table is a
+    <code>.lut file that is memory-mapped the first time it is applied, so
+    a library of hundreds costs one small JSON read at startup and only
+    the pages of looks actually in use stay resident. Replicas sharing the
+    directory pick up changes when index.json's mtime moves."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(directory, "index.json")
+        self._mtime = None
+        self._entries: dict = {}
+        self._maps: dict = {}
+
+    def _refresh(self):
+        """Re-read index.json if it changed; call with the lock held"""
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        entries = {}
+        if mtime is not None:
+            with open(self._index_path, encoding="utf-8") as f:
+                entries = {entry["code"]: entry for entry in json.load(f)}
+        self._entries, self._maps, self._mtime = entries, {}, mtime
+
+    def entries(self) -> list:
+        """(label, code) of every look, in the order they were added"""
+        with self._lock:
+            self._refresh()
+            return [(entry["label"], code) for code, entry in self._entries.items()]
+
+    def __contains__(self, code: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return code in self._entries
+
+    def label(self, code: str):
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(code)
+            return entry["label"] if entry else None
+
+    def add_cube(self, data: bytes, name: str = "") -> dict:
+        """Validate a .cube file and store it as name (else its TITLE);
+        an existing look of the same name is replaced. A different name that
+        slugs the same gets a numbered code, so presets holding the other
+        look's code keep pointing at it. Returns the entry."""
+        if len(data) > MAX_CUBE_BYTES:
+            raise InvalidLut(f"File bahut bari hai (max {MAX_CUBE_BYTES // (1024 * 1024)} MB).")
+        try:
+            text = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise InvalidLut("Yeh text .cube file nahi hai.")
+        import numpy as np
+
+        title, size, table = parse_cube(text)
+
+        label = re.sub(r"[*_`\[\]]", "", name or title).strip()[:40] or "Custom Look"
+        payload = MAGIC + bytes([size, 0, 0, 0]) + np.round(table * 65535).astype("<u2").tobytes()
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._refresh()
+            base = code = LUT_PREFIX + _slug(label)
+            n = 1
+            while code in self._entries and self._entries[code]["label"] != label:
+                n += 1
+                code = f"{base}_{n}"
+            entry = {"code": code, "label": label, "size": size}
+            self._write(os.path.join(self.directory, f"{entry['code']}.lut"), payload)
+            self._entries[entry["code"]] = entry
+            self._write(self._index_path, json.dumps(list(self._entries.values()), indent=1).encode())
+            self._maps.pop(entry["code"], None)
+            self._mtime = os.stat(self._index_path).st_mtime_ns
+        return entry
+
+    def _write(self, path: str, payload: bytes):
+        # Readers (other replicas, open maps) see the old file or the new one
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+    def filter(self, code: str):
+        """Color3DLUT for the look, None if there is no such look"""
+        import numpy as np
+        from PIL import ImageFilter
+
+        with self._lock:
+            self._refresh()
+            if code not in self._entries:
+                return None
+            mapped = self._maps.get(code)
+            if mapped is None:
+                path = os.path.join(self.directory, f"{code}.lut")
+                with open(path, "rb") as f:
+                    header = f.read(HEADER_BYTES)
+                if header[:4] != MAGIC:
+                    raise InvalidLut(f"{code}.lut kharab hai")
+                size = header[4]
+                table = np.memmap(path, dtype="<u2", mode="r", offset=HEADER_BYTES, shape=(size ** 3 * 3,))
+                mapped = self._maps[code] = (size, table)
+        size, table = mapped
+        # C trilinear pass over the image; only the small table is converted
+        return ImageFilter.Color3DLUT(size, table.astype(np.float32) / 65535, _copy_table=False)
+
+
+LIBRARY = LutLibrary(Config.LUT_DIR)
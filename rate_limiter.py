@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from metrics import REGISTRY
+
+TELEGRAM_REQUESTS = REGISTRY.counter(
+    "editor_telegram_requests_total", "Bot API calls made through the rate limiter", ("endpoint",)
+)
+TELEGRAM_THROTTLE_SECONDS = REGISTRY.histogram(
+    "editor_telegram_throttle_seconds", "Time a Bot API call waited for a token", ("priority",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+TELEGRAM_RETRY_AFTER = REGISTRY.counter(
+    "editor_telegram_retry_after_total", "429 RetryAfter responses from Telegram", ("endpoint",)
+)
+
+_low_priority: ContextVar = ContextVar("low_priority", default=False)
+
+
+@contextmanager
+def low_priority():
+    """Mark Bot API calls in this block as cosmetic ("⏳ please wait" edits,
+    cleaning up status messages): they yield to everything else under load"""
+    token = _low_priority.set(True)
+    try:
+        yield
+    finally:
+        _low_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if one is now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Throttles outgoing Bot API calls to a global rate plus a per-chat rate
+    (stricter for groups), pauses on RetryAfter and retries the call, and
+    lets normal calls go ahead of ones marked with low_priority(). A low
+    priority call only yields to normal calls waiting for a token it would
+    take (the global bucket's or its own chat's), and for at most
+    max_defer seconds."""
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 5,
+                 group_rate: float = 20 / 60, max_retries: int = 3, max_chats: int = 10000,
+                 max_defer: float = 2.0):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.max_defer = max_defer
+        self._chats: OrderedDict = OrderedDict()
+        self._paused_until = 0.0
+        self._chat_paused_until: dict = {}
+        # Normal-priority calls waiting, by chat, and how many of them are
+        # held back by the global bucket (or a global pause) right now
+        self._high_waiting: dict = {}
+        self._high_on_global = 0
+        self.waiting = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Negative IDs are groups/channels: ~20 messages a minute
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id, low: bool):
+        chat = self._chat_bucket(chat_id) if chat_id is not None else None
+        start = time.monotonic()
+        on_global = False
+        self.waiting += 1
+        if not low:
+            self._high_waiting[chat_id] = self._high_waiting.get(chat_id, 0) + 1
+        try:
+            while True:
+                now = time.monotonic()
+                global_wait = max(self._paused_until - now, self.global_bucket.wait_time(now))
+                chat_wait = max(
+                    self._chat_paused_until.get(chat_id, 0.0) - now,
+                    chat.wait_time(now) if chat else 0.0,
+                )
+                wait = max(global_wait, chat_wait)
+                if not low:
+                    # A call throttled by its own chat doesn't compete with
+                    # other chats for the global bucket
+                    blocked = global_wait > 0 and global_wait >= chat_wait
+                    if blocked != on_global:
+                        self._high_on_global += 1 if blocked else -1
+                        on_global = blocked
+                elif now - start < self.max_defer and (self._high_on_global or self._high_waiting.get(chat_id)):
+                    wait = max(wait, 0.05)
+                if wait <= 0:
+                    self.global_bucket.take()
+                    if chat:
+                        chat.take()
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+            if on_global:
+                self._high_on_global -= 1
+            if not low:
+                self._high_waiting[chat_id] -= 1
+                if not self._high_waiting[chat_id]:
+                    del self._high_waiting[chat_id]
+            TELEGRAM_THROTTLE_SECONDS.observe(time.monotonic() - start, priority="low" if low else "normal")
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        low = _low_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, low)
+            TELEGRAM_REQUESTS.inc(endpoint=endpoint)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                TELEGRAM_RETRY_AFTER.inc(endpoint=endpoint)
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                until = time.monotonic() + retry_after + 0.1
+                # Flood limits on one chat don't need to stall every other chat
+                if chat_id is not None:
+                    self._chat_paused_until[chat_id] = until
+                else:
+                    self._paused_until = until
+                await asyncio.sleep(retry_after + 0.1)
+            finally:
+                if chat_id is not None and self._chat_paused_until.get(chat_id, 0.0) <= time.monotonic():
+                    self._chat_paused_until.pop(chat_id, None)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from metrics import SESSION_EVICTIONS
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach): maps a user ID to a bucket so
+    that growing from n to n+1 buckets only moves ~1/(n+1) of the users."""
+    key &= 0xFFFFFFFFFFFFFFFF
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+class MemorySessionStore:
+    """Process-local sessions, least recently used evicted past max_sessions"""
+
+    def __init__(self, max_sessions: int = 0):
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, user_id: int, field: str, default=None):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return default
+            self._sessions.move_to_end(user_id)
+            return session.get(field, default)
+
+    def set(self, user_id: int, field: str, value):
+        self.update(user_id, {field: value})
+
+    def update(self, user_id: int, fields: dict):
+        with self._lock:
+            session = self._sessions.setdefault(user_id, {})
+            session.update(fields)
+            self._sessions.move_to_end(user_id)
+            while self.max_sessions and len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+                SESSION_EVICTIONS.inc()
+
+    def delete(self, user_id: int, *fields: str):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                for field in fields:
+                    session.pop(field, None)
+
+    def has(self, user_id: int, field: str) -> bool:
+        with self._lock:
+            return field in self._sessions.get(user_id, ())
+
+    async def get_async(self, user_id: int, field: str, default=None):
+        return self.get(user_id, field, default)
+
+    async def update_async(self, user_id: int, fields: dict):
+        self.update(user_id, fields)
+
+    def clear(self, user_id: int):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file (WAL mode) that several bot processes on the
+    same host/volume can share, so a restart or a second replica keeps every
+    in-progress edit. Bytes are stored as BLOBs, everything else as JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._get_conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    user_id INTEGER,
+                    field TEXT,
+                    is_json INTEGER,
+                    value BLOB,
+                    updated_at REAL,
+                    PRIMARY KEY (user_id, field)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at)")
+
+    def _get_conn(self):
+        # One connection per thread: handlers and the processing pool both read sessions
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: int, field: str, default=None):
+        row = self._get_conn().execute(
+            "SELECT is_json, value FROM sessions WHERE user_id = ? AND field = ?",
+            (user_id, field)
+        ).fetchone()
+        if not row:
+            return default
+        is_json, value = row
+        return json.loads(value) if is_json else bytes(value)
+
+    def set(self, user_id: int, field: str, value):
+        self.update(user_id, {field: value})
+
+    def update(self, user_id: int, fields: dict):
+        now = time.time()
+        rows = []
+        for field, value in fields.items():
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                rows.append((user_id, field, 0, sqlite3.Binary(value), now))
+            else:
+                rows.append((user_id, field, 1, json.dumps(value), now))
+        with self._get_conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sessions (user_id, field, is_json, value, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def delete(self, user_id: int, *fields: str):
+        with self._get_conn() as conn:
+            conn.executemany(
+                "DELETE FROM sessions WHERE user_id = ? AND field = ?",
+                [(user_id, field) for field in fields]
+            )
+
+    def has(self, user_id: int, field: str) -> bool:
+        return self._get_conn().execute(
+            "SELECT 1 FROM sessions WHERE user_id = ? AND field = ?", (user_id, field)
+        ).fetchone() is not None
+
+    # Image fields are multi-MB BLOBs: handlers read and write them on a
+    # worker thread so the event loop keeps serving other users meanwhile
+    async def get_async(self, user_id: int, field: str, default=None):
+        return await asyncio.to_thread(self.get, user_id, field, default)
+
+    async def update_async(self, user_id: int, fields: dict):
+        write = asyncio.ensure_future(asyncio.to_thread(self.update, user_id, fields))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # The thread can't be stopped: hold a cancelled caller until the
+            # row is in, so the write can't land after the caller's cleanup
+            await asyncio.wait([write])
+            raise
+
+    def clear(self, user_id: int):
+        with self._get_conn() as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def prune(self, max_age_seconds: float) -> int:
+        """Drop sessions untouched for max_age_seconds, returns rows removed"""
+        with self._get_conn() as conn:
+            cur = conn.execute(
+                "DELETE FROM sessions WHERE user_id IN "
+                "(SELECT user_id FROM sessions GROUP BY user_id HAVING MAX(updated_at) < ?)",
+                (time.time() - max_age_seconds,)
+            )
+            return cur.rowcount
+
+    def __len__(self) -> int:
+        return self._get_conn().execute(
+            "SELECT COUNT(DISTINCT user_id) FROM sessions"
+        ).fetchone()[0]
+
+
+class ShardedSessionStore:
+    """Routes each user to one of several stores by consistent hash, so
+    session writes spread over several files instead of contending on one
+    write lock. Spreading users over replicas is WorkerRouter's job
+    (update_processor.py), with the same hash."""
+
+    def __init__(self, shards: list):
+        self.shards = shards
+
+    def shard_for(self, user_id: int):
+        return self.shards[jump_hash(user_id, len(self.shards))]
+
+    def get(self, user_id: int, field: str, default=None):
+        return self.shard_for(user_id).get(user_id, field, default)
+
+    def set(self, user_id: int, field: str, value):
+        self.shard_for(user_id).set(user_id, field, value)
+
+    def update(self, user_id: int, fields: dict):
+        self.shard_for(user_id).update(user_id, fields)
+
+    def delete(self, user_id: int, *fields: str):
+        self.shard_for(user_id).delete(user_id, *fields)
+
+    def has(self, user_id: int, field: str) -> bool:
+        return self.shard_for(user_id).has(user_id, field)
+
+    async def get_async(self, user_id: int, field: str, default=None):
+        return await self.shard_for(user_id).get_async(user_id, field, default)
+
+    async def update_async(self, user_id: int, fields: dict):
+        await self.shard_for(user_id).update_async(user_id, fields)
+
+    def clear(self, user_id: int):
+        self.shard_for(user_id).clear(user_id)
+
+    def prune(self, max_age_seconds: float) -> int:
+        return sum(shard.prune(max_age_seconds) for shard in self.shards if hasattr(shard, "prune"))
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+
+def create_session_store():
+    """Backend from Config.SESSION_BACKEND: "memory" or "sqlite"."""
+    if Config.SESSION_BACKEND == "sqlite":
+        if Config.SESSION_SHARDS <= 1:
+            return SQLiteSessionStore(Config.SESSION_DB_PATH)
+        base, ext = os.path.splitext(Config.SESSION_DB_PATH)
+        return ShardedSessionStore([
+            SQLiteSessionStore(f"{base}.{i}{ext}") for i in range(Config.SESSION_SHARDS)
+        ])
+    return MemorySessionStore(max_sessions=Config.SESSION_MAX_IN_MEMORY)
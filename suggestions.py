@@ -0,0 +1,116 @@
+import numpy as np
+from PIL import Image
+from config import Config
+import image_stats
+import ingest
+
+# Analysed at thumbnail size: the statistics below barely move with
+# resolution and a 64K-pixel pass takes a few ms
+THUMB_PIXELS = 256 * 256
+
+LABELS = dict(
+    [(code, label) for label, code in Config.FILTERS_LIST]
+    + [(code, label) for label, code in Config.CROP_LIST]
+    + [(code, label) for label, code in Config.ENHANCE_LIST]
+)
+
+CROP_RATIOS = {
+    "crop_square": 1.0,
+    "crop_wide": 16 / 9,
+    "crop_story": 9 / 16,
+    "crop_classic": 4 / 3,
+    "crop_photo": 3 / 2,
+}
+
+
+def analyze(img: Image.Image, stats: image_stats.ImageStats = None) -> dict:
+    """Exposure, clipping, contrast, saturation, colour cast, sharpness and
+    aspect ratio of an RGB image, all as plain floats. Tonal figures come
+    from stats (the image version's cached histograms) when given."""
+    width, height = img.size
+    size = ingest.fit(width, height, THUMB_PIXELS)
+    if size != img.size:
+        img = img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    if stats is None:
+        stats = image_stats.ImageStats(img)
+
+    # 4-neighbour Laplacian on the interior
+    luma = np.asarray(img.convert("L"), dtype=np.float32)
+    lap = 4 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1] - luma[1:-1, :-2] - luma[1:-1, 2:]
+
+    clip_low, clip_high = stats.clipped(4, 251)
+    mean_r, mean_g, mean_b = (stats.mean(c) / 255 for c in "RGB")
+    return {
+        "exposure": stats.mean("L") / 255,
+        "clip_low": clip_low,
+        "clip_high": clip_high,
+        "contrast": (stats.percentile(95) - stats.percentile(5)) / 255,
+        "saturation": stats.mean("S") / 255,
+        "warmth": mean_r - mean_b,
+        "tint": mean_g - (mean_r + mean_b) / 2,
+        "sharpness": float(lap.var()) if lap.size else 0.0,
+        "aspect": width / height,
+    }
+
+
+def _candidates(s: dict) -> list:
+    """(group, code, score, reason); one pick per group survives ranking"""
+    out = []
+    if s["exposure"] < 0.35 or s["clip_low"] > 0.08:
+        deficit = max(0.35 - s["exposure"], s["clip_low"])
+        out.append(("exposure", "enhance_bright", 1.0 + deficit * 4, "photo dark hai"))
+        if s["clip_low"] > 0.05 and s["clip_high"] > 0.02:
+            out.append(("exposure", "hdr", 1.2 + s["clip_low"] * 4, "shadows aur highlights dono kat rahe hain"))
+    elif s["exposure"] > 0.68 or s["clip_high"] > 0.06:
+        excess = max(s["exposure"] - 0.68, s["clip_high"])
+        out.append(("exposure", "enhance_dark", 1.0 + excess * 4, "highlights bahut tez hain"))
+
+    if s["contrast"] < 0.45:
+        out.append(("contrast", "enhance_contrast", 0.9 + (0.45 - s["contrast"]) * 3, "contrast flat hai"))
+        if s["contrast"] < 0.3:
+            out.append(("contrast", "dramatic", 1.0 + (0.3 - s["contrast"]) * 3, "bahut flat, dramatic look jachega"))
+    elif s["contrast"] > 0.9 and s["clip_low"] + s["clip_high"] > 0.05:
+        out.append(("contrast", "fade", 0.6, "contrast bahut harsh hai"))
+
+    if s["saturation"] < 0.06:
+        out.append(("colour", "bw", 0.9, "colours na hone ke barabar, B&W clean lagega"))
+    elif s["saturation"] < 0.2:
+        out.append(("colour", "enhance_saturation", 0.8 + (0.2 - s["saturation"]) * 3, "colours halke hain"))
+        out.append(("colour", "vivid", 0.7 + (0.2 - s["saturation"]) * 3, "colours ko pop chahiye"))
+    elif s["saturation"] > 0.55:
+        out.append(("colour", "pastel", 0.5 + (s["saturation"] - 0.55) * 2, "colours bahut tez hain"))
+
+    if s["warmth"] > 0.08:
+        out.append(("cast", "cool", 0.7 + s["warmth"] * 3, "yellow/orange tint hai"))
+    elif s["warmth"] < -0.06:
+        out.append(("cast", "warm", 0.7 - s["warmth"] * 3, "blue tint hai"))
+    elif s["tint"] > 0.04 and s["saturation"] > 0.2:
+        out.append(("cast", "nature", 0.6, "greenery zyada hai"))
+
+    # Laplacian variance at thumbnail scale: a sharp photo lands in the
+    # hundreds, ~1.5 px of blur at this size drops it below 30
+    if s["sharpness"] < 30:
+        out.append(("detail", "enhance_sharpen", 0.5 + (30 - s["sharpness"]) / 100, "details soft hain"))
+    elif s["sharpness"] > 2500 and s["exposure"] < 0.4:
+        out.append(("detail", "enhance_smooth", 0.6, "dark areas mein noise hai"))
+
+    ratio = min(CROP_RATIOS.items(), key=lambda c: abs(np.log(s["aspect"] / c[1])))
+    if abs(np.log(s["aspect"] / ratio[1])) > 0.02:
+        out.append(("crop", ratio[0], 0.3, "sabse kam trim hoga"))
+
+    out.append(("auto", "enhance_auto", 0.25, "overall balance ke liye"))
+    return out
+
+
+def suggest(img: Image.Image, stats: image_stats.ImageStats = None, limit: int = 3) -> list:
+    """Ranked [(code, label, reason)], at most one per kind of problem"""
+    best: dict = {}
+    for group, code, score, reason in _candidates(analyze(img, stats)):
+        if group not in best or score > best[group][1]:
+            best[group] = (code, score, reason)
+    ranked = sorted(best.values(), key=lambda c: c[1], reverse=True)[:limit]
+    return [(code, LABELS[code], reason) for code, _, reason in ranked]
+
+
+def format_suggestions(picks: list) -> str:
+    return "\n".join(f"{i}. *{label}* — {reason}" for i, (_, label, reason) in enumerate(picks, 1))
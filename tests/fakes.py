@@ -0,0 +1,37 @@
+import threading
+import types
+
+
+class FakeClock:
+    """Monotonic clock the test moves by hand"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class FakeModel:
+    """Stands in for the Gemini model. Each generate_content call runs the
+    next scripted step: a string is the reply, an exception is raised, a
+    callable is called (to advance a clock or block) and its return value
+    used the same way. Once the script runs out the last step repeats."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, parts):
+        with self._lock:
+            step = self.script[min(self.calls, len(self.script) - 1)]
+            self.calls += 1
+        if callable(step) and not isinstance(step, type):
+            step = step()
+        if isinstance(step, BaseException) or isinstance(step, type):
+            raise step
+        return types.SimpleNamespace(text=step)
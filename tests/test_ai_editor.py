@@ -0,0 +1,113 @@
+import threading
+from io import BytesIO
+import pytest
+from PIL import Image
+from ai_editor import AIEditor
+from config import Config
+from fakes import FakeClock, FakeModel
+
+
+@pytest.fixture
+def photo() -> bytes:
+    output = BytesIO()
+    Image.new("RGB", (64, 48), (90, 120, 160)).save(output, format="JPEG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def gemini_config(monkeypatch):
+    monkeypatch.setattr(Config, "GEMINI_TIMEOUT_SECONDS", 2.0)
+    monkeypatch.setattr(Config, "GEMINI_SLOW_SECONDS", 10.0)
+    monkeypatch.setattr(Config, "GEMINI_BREAKER_WINDOW", 10)
+    monkeypatch.setattr(Config, "GEMINI_BREAKER_MIN_CALLS", 3)
+    monkeypatch.setattr(Config, "GEMINI_BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(Config, "GEMINI_BREAKER_OPEN_SECONDS", 30.0)
+    monkeypatch.setattr(Config, "GEMINI_HEDGE", False)
+    monkeypatch.setattr(Config, "GEMINI_HEDGE_MIN_SECONDS", 0.05)
+
+
+@pytest.fixture
+def release():
+    """Set at teardown so blocked fake calls don't outlive the test"""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_answer_from_model(gemini_config, photo):
+    model = FakeModel("A nice photo")
+    result = AIEditor(model=model).analyze_image(photo)
+    assert result == "A nice photo"
+    assert not result.degraded
+    assert model.calls == 1
+
+
+def test_error_falls_back_locally(gemini_config, photo):
+    result = AIEditor(model=FakeModel(RuntimeError("500"))).analyze_image(photo)
+    assert result.degraded
+    assert result.startswith("⚠️")
+
+
+def test_breaker_opens_then_fails_fast(gemini_config, photo):
+    model = FakeModel(RuntimeError("503"))
+    editor = AIEditor(model=model, clock=FakeClock())
+    for _ in range(3):
+        assert editor.get_caption_suggestions(photo).degraded
+    assert model.calls == 3
+
+    # Open: the model isn't called at all
+    result = editor.get_caption_suggestions(photo)
+    assert result.degraded
+    assert model.calls == 3
+
+
+def test_half_open_probe_closes_the_circuit(gemini_config, photo):
+    clock = FakeClock()
+    model = FakeModel(RuntimeError("503"), RuntimeError("503"), RuntimeError("503"), "Back up")
+    editor = AIEditor(model=model, clock=clock)
+    for _ in range(3):
+        editor.analyze_image(photo)
+    assert editor.analyze_image(photo).degraded
+    assert model.calls == 3
+
+    clock.advance(Config.GEMINI_BREAKER_OPEN_SECONDS)
+    result = editor.analyze_image(photo)
+    assert result == "Back up"
+    assert not result.degraded
+    assert editor.breaker.state == "closed"
+
+
+def test_timeout_falls_back_locally(gemini_config, monkeypatch, photo, release):
+    monkeypatch.setattr(Config, "GEMINI_TIMEOUT_SECONDS", 0.1)
+    model = FakeModel(lambda: release.wait() and "too late")
+    result = AIEditor(model=model).analyze_image(photo)
+    assert result.degraded
+    assert model.calls == 1
+
+
+def test_hedge_wins_when_first_call_hangs(gemini_config, monkeypatch, photo, release):
+    monkeypatch.setattr(Config, "GEMINI_HEDGE", True)
+    clock = FakeClock()
+
+    def quick():
+        clock.advance(0.01)
+        return "warm"
+
+    # Three quick calls give the breaker a p95, then the fourth call hangs
+    # and the hedge sent after GEMINI_HEDGE_MIN_SECONDS answers
+    model = FakeModel(quick, quick, quick, lambda: release.wait() and "first", "hedge")
+    editor = AIEditor(model=model, clock=clock)
+    for _ in range(3):
+        assert editor.analyze_image(photo) == "warm"
+
+    result = editor.analyze_image(photo)
+    assert result == "hedge"
+    assert not result.degraded
+    assert model.calls == 5
+
+
+def test_no_hedge_without_latency_history(gemini_config, monkeypatch, photo):
+    monkeypatch.setattr(Config, "GEMINI_HEDGE", True)
+    model = FakeModel("only")
+    assert AIEditor(model=model).analyze_image(photo) == "only"
+    assert model.calls == 1
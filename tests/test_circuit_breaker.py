@@ -0,0 +1,108 @@
+import pytest
+from circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, HALF_OPEN, OPEN
+from fakes import FakeClock
+
+
+def _fail():
+    raise RuntimeError("boom")
+
+
+def _breaker(clock, **kwargs):
+    options = dict(window=10, min_calls=4, error_rate=0.5, slow_seconds=5.0, open_seconds=30.0)
+    options.update(kwargs)
+    return CircuitBreaker("test", clock=clock, **options)
+
+
+def test_opens_after_error_rate_reached():
+    breaker = _breaker(FakeClock())
+    breaker.call(lambda: "ok")
+    breaker.call(lambda: "ok")
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    assert breaker.state == CLOSED  # 1 of 3, under min_calls
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    assert breaker.state == OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpen):
+        breaker.call(calls.append, 1)
+    assert calls == []
+
+
+def test_slow_calls_count_as_failures():
+    clock = FakeClock()
+    breaker = _breaker(clock, min_calls=2)
+
+    def slow():
+        clock.advance(6)
+        return "late"
+
+    assert breaker.call(slow) == "late"
+    breaker.call(slow)
+    assert breaker.state == OPEN
+
+
+def test_half_open_probe_success_closes():
+    clock = FakeClock()
+    breaker = _breaker(clock, min_calls=1)
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    assert breaker.state == OPEN
+
+    clock.advance(29)
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: "ok")
+    clock.advance(1)
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(lambda: "probe") == "probe"
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    clock = FakeClock()
+    breaker = _breaker(clock, min_calls=1)
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    clock.advance(30)
+
+    # A second call while the probe is still out is refused
+    def probe():
+        with pytest.raises(CircuitOpen):
+            breaker.call(lambda: "second")
+        return "probe"
+
+    assert breaker.call(probe) == "probe"
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_failure_reopens():
+    clock = FakeClock()
+    breaker = _breaker(clock, min_calls=1)
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    clock.advance(30)
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    assert breaker.state == OPEN
+
+    # The open period restarts from the failed probe
+    clock.advance(29)
+    assert breaker.state == OPEN
+    clock.advance(1)
+    assert breaker.state == HALF_OPEN
+
+
+def test_latency_quantile_needs_min_calls():
+    clock = FakeClock()
+    breaker = _breaker(clock, min_calls=3)
+
+    def takes(seconds):
+        clock.advance(seconds)
+        return seconds
+
+    breaker.call(takes, 1.0)
+    breaker.call(takes, 2.0)
+    assert breaker.latency_quantile(0.95) is None
+    breaker.call(takes, 3.0)
+    assert breaker.latency_quantile(0.95) == 3.0
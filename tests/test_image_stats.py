@@ -0,0 +1,57 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+import image_stats
+from image_processor import ImageProcessor
+
+
+@pytest.fixture
+def photo() -> bytes:
+    """Noisy 6 MP JPEG: draft decoding it at preview size averages the
+    noise away and visibly narrows the histogram"""
+    rng = np.random.default_rng(1)
+    height, width = 2000, 3000
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 200 // width + 20, y * 180 // height + 30, (x + y) * 160 // (width + height) + 40], axis=2)
+    pixels = np.clip(base + rng.integers(-45, 45, base.shape), 0, 255).astype(np.uint8)
+    output = BytesIO()
+    Image.fromarray(pixels).save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(image_stats, "CACHE", image_stats.StatsCache(100))
+
+
+def test_autocontrast_lut_matches_pil(photo):
+    img = Image.open(BytesIO(photo)).convert("RGB").resize((600, 400), Image.NEAREST)
+    stats = image_stats.ImageStats(img)
+    for cutoff in (0, 1, 2):
+        for preserve_tone in (False, True):
+            expected = ImageOps.autocontrast(img, cutoff=cutoff, preserve_tone=preserve_tone)
+            got = img.point(stats.autocontrast_lut(cutoff, preserve_tone))
+            assert got.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("action", ["enhance_auto", "professional"])
+def test_preview_does_not_change_full_render(photo, fresh_cache, action):
+    processor = ImageProcessor()
+    full_only = processor.process(photo, action, "working")
+
+    image_stats.CACHE = image_stats.StatsCache(100)
+    processor.process_preview(photo, action)
+    after_preview = processor.process(photo, action, "working")
+
+    assert after_preview == full_only
+
+
+def test_entries_are_per_decoded_size(photo, fresh_cache):
+    processor = ImageProcessor()
+    processor.process_preview(photo, "enhance_auto")
+    processor.process(photo, "enhance_auto", "working")
+    key = image_stats.version(photo)
+    sizes = {size for version, size in image_stats.CACHE._entries if version == key}
+    assert (3000, 2000) in sizes
+    assert len(sizes) == 2
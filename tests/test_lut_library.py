@@ -0,0 +1,25 @@
+from lut_library import LutLibrary
+
+
+def _cube(scale: float) -> bytes:
+    rows = [f"{r * scale} {g * scale} {b * scale}" for b in (0, 1) for g in (0, 1) for r in (0, 1)]
+    return ("LUT_3D_SIZE 2\n" + "\n".join(rows)).encode()
+
+
+def test_same_slug_different_name_keeps_both(tmp_path):
+    library = LutLibrary(str(tmp_path))
+    first = library.add_cube(_cube(1.0), "Warm Film")
+    second = library.add_cube(_cube(0.5), "warm-film")
+    assert first["code"] == "lut_warm_film"
+    assert second["code"] == "lut_warm_film_2"
+    assert library.entries() == [("Warm Film", "lut_warm_film"), ("warm-film", "lut_warm_film_2")]
+    assert library.label("lut_warm_film") == "Warm Film"
+
+
+def test_same_name_replaces_the_look(tmp_path):
+    library = LutLibrary(str(tmp_path))
+    library.add_cube(_cube(1.0), "Warm Film")
+    library.add_cube(_cube(1.0), "warm-film")
+    replaced = library.add_cube(_cube(0.5), "warm-film")
+    assert replaced["code"] == "lut_warm_film_2"
+    assert len(library.entries()) == 2
@@ -0,0 +1,29 @@
+import asyncio
+import time
+import pytest
+from session_store import SQLiteSessionStore
+
+
+def test_cancelled_write_lands_before_the_caller_stops(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    update = store.update
+
+    def slow_update(user_id, fields):
+        time.sleep(0.2)
+        update(user_id, fields)
+
+    store.update = slow_update
+
+    async def scenario():
+        task = asyncio.create_task(store.update_async(1, {"current": b"old"}))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # What a reset after the cancel sees is final: nothing lands later
+        assert store.get(1, "current") == b"old"
+        store.clear(1)
+        await asyncio.sleep(0.3)
+        assert store.get(1, "current") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,32 @@
+import asyncio
+from types import SimpleNamespace
+from update_processor import PerUserUpdateProcessor
+
+
+def _update(user_id: int):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+
+
+def test_one_users_updates_run_in_order_others_concurrently():
+    processor = PerUserUpdateProcessor(4)
+    log = []
+
+    async def handle(user_id: int, n: int, seconds: float):
+        log.append(("start", user_id, n))
+        await asyncio.sleep(seconds)
+        log.append(("end", user_id, n))
+
+    async def scenario():
+        await asyncio.gather(
+            processor.process_update(_update(1), handle(1, 0, 0.05)),
+            processor.process_update(_update(1), handle(1, 1, 0.0)),
+            processor.process_update(_update(2), handle(2, 0, 0.0)),
+        )
+
+    asyncio.run(scenario())
+    # User 1's second update waits for the first; user 2 doesn't
+    assert log.index(("end", 1, 0)) < log.index(("start", 1, 1))
+    assert log.index(("end", 2, 0)) < log.index(("end", 1, 0))
+    assert processor.processed == 3
+    assert processor.pending == 0
+    assert processor.wait_stats()["count"] == 3
@@ -0,0 +1,148 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar = ContextVar("trace", default=None)
+
+# Last finished traces, /perf reads from here
+RECENT_TRACES: deque = deque(maxlen=200)
+
+# cProfile hooks the whole thread, so only one sampled request is profiled
+# at a time; concurrent updates on the loop still show up in its output.
+_profiling_active = False
+
+
+class Trace:
+    def __init__(self, name: str, user_id: int = 0):
+        self.name = name
+        self.user_id = user_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans: list = []
+        self.total = 0.0
+        self.profile = None
+        self.worker_profiles: list = []
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, time.perf_counter() - start))
+
+    def to_dict(self) -> dict:
+        spans: dict = {}
+        for name, duration in self.spans:
+            spans[name] = spans.get(name, 0.0) + duration
+        return {
+            "name": self.name,
+            "user_id": self.user_id,
+            "started_at": round(self.started_at, 3),
+            "total_ms": round(self.total * 1000, 1),
+            "spans": {name: round(d * 1000, 1) for name, d in spans.items()},
+        }
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the current request; no-op outside a trace"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def profiled(func, trace=None):
+    """Wrap func so it runs under its own cProfile when trace is being
+    profiled. For work handed to the processing pool thread."""
+    if trace is None or trace.profile is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            trace.worker_profiles.append(profile)
+    return wrapper
+
+
+@contextmanager
+def trace(name: str, user_id: int = 0):
+    """Open a Trace for the block: logs a span breakdown when it runs longer
+    than TRACE_SLOW_MS and keeps a cProfile dump of a PROFILE_SAMPLE_RATE
+    sample of those slow requests. Must stay within one asyncio task."""
+    global _profiling_active
+    current = Trace(name, user_id)
+    token = _current.set(current)
+
+    if not _profiling_active and random.random() < Config.PROFILE_SAMPLE_RATE:
+        _profiling_active = True
+        current.profile = cProfile.Profile()
+        current.profile.enable()
+    try:
+        yield current
+    finally:
+        if current.profile is not None:
+            current.profile.disable()
+            _profiling_active = False
+        current.total = time.perf_counter() - current._start
+        _current.reset(token)
+        _finish(current)
+
+
+def traced(name: str):
+    """Decorator for update handlers: runs each update under trace()"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            user = getattr(update, "effective_user", None)
+            with trace(name, user.id if user else 0):
+                return await handler(update, context)
+        return wrapper
+    return decorator
+
+
+def _finish(trace: Trace):
+    RECENT_TRACES.append(trace.to_dict())
+    if trace.total * 1000 < Config.TRACE_SLOW_MS:
+        return
+
+    logger.warning(f"Slow request: {json.dumps(trace.to_dict())}")
+    if trace.profile is not None:
+        try:
+            os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+            path = os.path.join(
+                Config.PROFILE_DIR,
+                f"{trace.name.replace(':', '_')}-{int(trace.started_at)}-{trace.user_id}.prof"
+            )
+            stats = pstats.Stats(trace.profile)
+            for profile in trace.worker_profiles:
+                stats.add(profile)
+            stats.dump_stats(path)
+            logger.warning(f"Profile saved: {path}")
+        except Exception as e:
+            logger.error(f"Profile dump failed: {e}")
+
+
+def slowest(limit: int = 5) -> list:
+    return sorted(RECENT_TRACES, key=lambda t: t["total_ms"], reverse=True)[:limit]
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import time
+from collections import deque
+import httpx
+from telegram.ext import BaseUpdateProcessor
+from metrics import REGISTRY
+from session_store import jump_hash
+
+UPDATES_FORWARDED = REGISTRY.counter(
+    "editor_updates_forwarded_total", "Updates handed to the replica that owns the user", ("worker",)
+)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates from different users concurrently (up to
+    max_concurrent_updates) while updates from the same user stay strictly
+    in arrival order. Also records how long each update queued for its
+    user's lock before it ran."""
+
+    def __init__(self, max_concurrent_updates: int, window: int = 1000):
+        super().__init__(max_concurrent_updates)
+        self._user_locks: dict = {}
+        self._waiters: dict = {}
+        self._waits = deque(maxlen=window)
+        self.processed = 0
+        self.pending = 0
+
+    @staticmethod
+    def _key(update):
+        user = getattr(update, "effective_user", None)
+        if user:
+            return user.id
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat else None
+
+    async def do_process_update(self, update, coroutine):
+        # Called by the base class with one of max_concurrent_updates slots
+        # held. Slots and the lock are both handed out first come first
+        # served, so one user's updates still run in arrival order.
+        queued_at = time.perf_counter()
+        self.pending += 1
+        key = self._key(update)
+        if key is None:
+            await self._timed(coroutine, queued_at)
+            return
+
+        lock = self._user_locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await self._timed(coroutine, queued_at)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._user_locks[key]
+
+    async def _timed(self, coroutine, queued_at: float):
+        self.pending -= 1
+        self._waits.append(time.perf_counter() - queued_at)
+        try:
+            await coroutine
+        finally:
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def wait_stats(self) -> dict:
+        """Queue wait percentiles (seconds) over the recent window"""
+        waits = sorted(self._waits)
+        if not waits:
+            return {"count": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": len(waits),
+            "p50": waits[len(waits) // 2],
+            "p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+            "max": waits[-1],
+        }
+
+
+class WorkerRouter:
+    """Pins every user to one webhook replica by jump hash of the user ID.
+    Replicas behind a load balancer get updates for anyone; whatever isn't
+    theirs is POSTed on to the owner's webhook, so all of a user's updates
+    run through one PerUserUpdateProcessor and one process's upgrade tasks.
+    Growing from n to n+1 replicas moves ~1/(n+1) of the users."""
+
+    def __init__(self, worker_urls: list, index: int, url_path: str):
+        self.worker_urls = worker_urls
+        self.index = index
+        self.url_path = url_path
+        self._client = None
+
+    def owner(self, user_id: int) -> int:
+        return jump_hash(user_id, len(self.worker_urls))
+
+    def is_local(self, update) -> bool:
+        user = getattr(update, "effective_user", None)
+        return user is None or len(self.worker_urls) <= 1 or self.owner(user.id) == self.index
+
+    async def forward(self, update):
+        """Deliver update to its owner's webhook, as Telegram would have"""
+        worker = self.owner(update.effective_user.id)
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10)
+        response = await self._client.post(
+            f"{self.worker_urls[worker]}/{self.url_path}",
+            content=json.dumps(update.to_dict()),
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+        UPDATES_FORWARDED.inc(worker=str(worker))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None